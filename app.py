@@ -1,84 +1,311 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for
+import json
+import math
+import os
+import sys
+import click
+from flask import Blueprint, Flask, current_app, get_template_attribute, render_template, request, jsonify, redirect, url_for, session, send_file, abort, stream_with_context
 from flask_login import LoginManager, login_user, login_required, logout_user, current_user
-from models import db, User, Blog
-from flask_bcrypt import Bcrypt
+from sqlalchemy.exc import SQLAlchemyError
+from assets import assets, build_assets, print_build_report
+from models import db, User, Blog, Reply
+import bulk
+import feed
+from feed_events import EventHub, feed_events, latest_event_id, publish
+import hexbins
+import map as map_builder
+from metrics import metrics
+import migrations
+from passwords import password_hasher, HasherBusy
+from post_cache import post_cache
+from ratelimit import login_limiter
+from user_cache import user_cache
+import scrape
+import search
+from scheduler import scheduler
+import spatial
+import storage
+import tiles
+from tile_proxy import tile_proxy, UpstreamError
+from votes import vote_buffer, record_vote, vote_counts, VOTE_VALUES
 
-app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///app.db'
-app.config['SECRET_KEY'] = 'your_secret_key'
+# Pages, API routes and CLI commands; create_app registers them on the app
+bp = Blueprint('main', __name__, cli_group=None)
+login_manager = LoginManager()
+login_manager.login_view = 'main.login'  # Redirect to a login route if needed
 
-db.init_app(app)
-bcrypt = Bcrypt(app)
-login_manager = LoginManager(app)
-login_manager.login_view = 'login'  # Redirect to a login route if needed
 
+def create_app(config=None):
+    """Build the app; config overrides the defaults and the environment.
+
+    Nothing here touches the database, so every worker process can call it.
+    Create or upgrade the schema once per deploy with flask --app app migrate.
+    """
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'your_secret_key')
+    # Batch like/dislike counter updates instead of writing them on every vote
+    app.config['VOTE_COALESCING'] = True
+    app.config.update(config or {})
+
+    # Picks the database from DATABASE_URL and tunes it per STORAGE_PROFILE
+    storage.init_app(app, db)
+    # Per-route latency, size and query metrics at /metrics; registered first so it times the other hooks too
+    metrics.init_app(app)
+    vote_buffer.init_app(app)
+    # Live feed events; the hub itself runs as flask --app app serve-events
+    feed_events.init_app(app)
+    tile_proxy.init_app(app)
+    # NDJSON export and import of users and blogs, and who may use them over HTTP
+    bulk.init_app(app)
+    # Background refresh jobs; SCHEDULER_ENABLED=1 runs them in this process
+    scheduler.init_app(app)
+    # Password hashing backend and pool, and the /login rate limiter
+    password_hasher.init_app(app)
+    login_limiter.init_app(app)
+    # Cached identity for the Flask-Login user loader
+    user_cache.init_app(app)
+    # Rendered posts for the server-rendered first page of /blog
+    post_cache.init_app(app)
+    # Fingerprinted, precompressed static files (flask build-assets) and the static page cache
+    assets.init_app(app)
+    login_manager.init_app(app)
+    app.register_blueprint(bp)
+    return app
+
+# Identity comes from the user cache, so most requests don't query the user table
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return user_cache.get(int(user_id), lambda user_id: db.session.get(User, user_id))
 
-@app.route('/')
+@bp.route('/')
 def home():
-    return redirect(url_for('introduction_page'))
+    return redirect(url_for('main.introduction_page'))
 
-@app.route('/about')
+@bp.route('/about')
 def introduction_page():
-    return render_template('about.html')
+    return assets.page('about', None, lambda: render_template('about.html'))
 
 # Logout route
-@app.route('/logout', methods=['POST'])
+@bp.route('/logout', methods=['POST'])
 @login_required
 def logout():
+    user_cache.invalidate(current_user.id)
     logout_user()
     return jsonify(success=True)
 
 # Profile page route, requires login
-@app.route('/profile')
+@bp.route('/profile')
 @login_required
 def profile_page():
     return render_template('profile.html')
 
-# Blog page route
-@app.route('/blog')
+# Blog page route, with the first page of posts rendered in (see post_cache.py)
+@bp.route('/blog')
 def blog_page():
-    return render_template('blog.html')
+    # Revalidated like /get_blogs, from the feed version alone
+    etag = feed.feed_etag(session.get('_user_id'), 'blog', assets.manifest['version'])
+    if request.if_none_match.contains_weak(etag):
+        response = current_app.response_class(status=304)
+    else:
+        # Read before the posts, so the live feed replays whatever commits in between
+        last_event_id = latest_event_id()
+        blogs, next_cursor = feed.load_page(None, current_app.config['BLOG_PAGE_SIZE'])
+        current_user_id = current_user.id if current_user.is_authenticated else None
+        page = [blog for blog, user in blogs]
+        replies = feed.load_reply_previews(page)
+        user_votes = feed.load_user_votes(current_user_id, page)
+        render_post = get_template_attribute('blog_post.html', 'blog_post')
+        posts = [
+            post_cache.get(feed.serialize_blog(blog, user, None, replies.get(blog.id, ()), vote_counts(blog),
+                                               user_votes.get(blog.id, 0)), current_user_id, render_post)
+            for blog, user in blogs
+        ]
+        response = current_app.response_class(render_template(
+            'blog.html', posts=posts, current_user_id=current_user_id, next_cursor=next_cursor,
+            last_event_id=last_event_id))
 
-# Blog page route
-@app.route('/references')
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+# References page route
+@bp.route('/references')
 def references_page():
-    return render_template('references.html')
+    return assets.page('references', None, lambda: render_template('references.html'))
+
+# Liveness: the process is up and answering requests
+@bp.route('/healthz')
+def healthz():
+    return jsonify(status='ok')
 
-# Get current user route
-@app.route('/current_user')
+# Readiness: the database answers and has been migrated, so this worker can take traffic
+@bp.route('/readyz')
+def readyz():
+    try:
+        missing = migrations.missing_tables()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        return jsonify(ready=False, database=f"unavailable: {e.__class__.__name__}"), 503
+    if missing:
+        return jsonify(ready=False, database=f"missing tables {', '.join(missing)}; run flask --app app migrate"), 503
+    return jsonify(ready=True, database='ok')
+
+# Who is logged in, if anyone (/check_login is the old name, kept for cached pages)
+@bp.route('/current_user')
+@bp.route('/check_login')
 def get_current_user():
     if current_user.is_authenticated:
-        return jsonify(display_name=current_user.display_name)
+        return jsonify(logged_in=True, user_id=current_user.id, display_name=current_user.display_name)
     else:
-        return jsonify(display_name=None)
+        return jsonify(logged_in=False, user_id=None, display_name=None)
+
+# Hit ratio of the user cache
+@bp.route('/user_cache/stats')
+def user_cache_stats():
+    return jsonify(user_cache.stats())
 
-# Map page route
-@app.route('/map')
+# Hit ratio of the rendered post cache
+@bp.route('/post_cache/stats')
+def post_cache_stats():
+    return jsonify(post_cache.stats())
+
+# Map page route, served straight from the generated artifact (see map.create_map)
+@bp.route('/map')
 def map_page():
-    return render_template('map.html')
+    # map.py paths are relative to the working directory, like the rest of the app's data files
+    map_path = os.path.abspath(map_builder.MAP_OUTPUT_PATH)
+    if not os.path.exists(map_path):
+        map_builder.create_map()
+    # Cached until create_map replaces the file
+    def read_map():
+        with open(map_path, 'rb') as f:
+            return f.read()
+    stat = os.stat(map_path)
+    response = assets.page('map', (stat.st_mtime_ns, stat.st_size), read_map)
+    if response is None:
+        response = send_file(map_path, mimetype='text/html', conditional=True)
+    return response
+
+# Overlay scripts for the map page, fetched the first time each layer is switched on
+@bp.route('/map/layers/<path:filename>')
+def map_layer_script(filename):
+    return assets.send_fingerprinted(os.path.abspath(map_builder.MAP_LAYER_DIR), filename)
+
+# Vector tiles for the map's GeoJSON overlays
+@bp.route('/tiles/<layer>/<int:z>/<int:x>/<int:y>')
+def vector_tile(layer, z, x, y):
+    if layer not in tiles.TILE_SOURCES or not tiles.is_valid_tile(z, x, y):
+        abort(404)
+    body = tiles.render_tile(layer, z, x, y)
+    if body is None:
+        abort(404)
+
+    response = current_app.response_class(body, mimetype='application/geo+json')
+    response.headers['Cache-Control'] = 'public, max-age=3600'
+    response.add_etag()
+    return response.make_conditional(request)
+
+# Drought impact sites binned into hexagons for the map's clustered layer
+@bp.route('/clusters/drought_impact/<int:z>/<int:x>/<int:y>')
+def drought_clusters(z, x, y):
+    if not tiles.is_valid_tile(z, x, y):
+        abort(404)
+    body = hexbins.render_tile(z, x, y)
+    if body is None:
+        abort(404)
+
+    response = current_app.response_class(body, mimetype='application/geo+json')
+    response.headers['Cache-Control'] = 'public, max-age=3600'
+    response.add_etag()
+    return response.make_conditional(request)
+
+# Cached proxy for the map's WMS overlays (?<GetMap parameters>) and basemap tiles
+@bp.route('/proxy/<layer>')
+@bp.route('/proxy/<layer>/<int:z>/<int:x>/<int:y>')
+def proxy_tile(layer, z=None, x=None, y=None):
+    if layer not in tile_proxy.upstreams:
+        abort(404)
+    try:
+        tile = tile_proxy.get(layer, request.args.to_dict(), (z, x, y) if z is not None else None)
+    except ValueError as e:
+        return jsonify(success=False, message=str(e)), 400
+    except UpstreamError as e:
+        return jsonify(success=False, message=str(e)), 502
+
+    response = current_app.response_class(tile.body, content_type=tile.content_type)
+    response.headers['Cache-Control'] = f'public, max-age={tile.max_age}'
+    response.headers['X-Cache'] = tile.cache_status
+    response.add_etag()
+    return response.make_conditional(request)
+
+# Hit ratio and upstream time saved by the tile proxy
+@bp.route('/proxy/stats')
+def proxy_stats():
+    return jsonify(tile_proxy.stats())
+
+# Durations and outcomes of the background jobs
+@bp.route('/jobs/stats')
+def job_stats():
+    return jsonify(scheduler.stats())
+
+# Which species ranges, vegetation zones and drought impacts fall in a drawn shape.
+# Body: a GeoJSON geometry, Feature or FeatureCollection; ?layers=a,b limits the layers
+@bp.route('/api/query', methods=['POST'])
+def spatial_query():
+    try:
+        geometry = spatial.parse_geometry(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify(success=False, message=str(e)), 400
+
+    layers = request.args.get('layers')
+    layers = layers.split(',') if layers else None
+    if layers and not set(layers) <= set(spatial.QUERY_LAYERS):
+        return jsonify(success=False, message=f"Unknown layer, expected {sorted(spatial.QUERY_LAYERS)}"), 400
+
+    return jsonify(success=True, layers=spatial.query(geometry, layers))
 
 # Blog operations
-@app.route('/get_blogs')
+@bp.route('/get_blogs')
 def get_blogs():
-    blogs = db.session.query(Blog, User).join(User, Blog.user_id == User.id).all()
-    current_user_id = current_user.id if current_user.is_authenticated else None
-    blogs_data = [{'id': blog.id, 'title': blog.title, 'content': blog.content, 'username': user.display_name, 'user_id': blog.user_id} for blog, user in blogs]
+    # Query parameters: ?cursor=<last seen id>&limit=<page size>&summary=<chars>
+    cursor = request.args.get('cursor', type=int)
+    limit = feed.parse_page_size(request.args.get('limit', type=int))
+    summary_length = request.args.get('summary', type=int)
+    if summary_length is not None and summary_length < 1:
+        return jsonify(success=False, message="summary must be at least 1 character"), 400
+
+    # The ETag only depends on the feed version and the request, so a matching
+    # If-None-Match is answered after one single-row query (and no user load)
+    etag = feed.feed_etag(session.get('_user_id'), cursor, limit, summary_length)
+    if request.if_none_match.contains_weak(etag):
+        response = current_app.response_class(status=304)
+    else:
+        blogs, next_cursor = feed.load_page(cursor, limit)
+        current_user_id = current_user.id if current_user.is_authenticated else None
+        page = [blog for blog, user in blogs]
+        replies = feed.load_reply_previews(page)
+        user_votes = feed.load_user_votes(current_user_id, page)
+        blogs_data = [
+            feed.serialize_blog(blog, user, summary_length, replies.get(blog.id, ()), vote_counts(blog), user_votes.get(blog.id, 0))
+            for blog, user in blogs
+        ]
+        response = jsonify(blogs=blogs_data, current_user_id=current_user_id, next_cursor=next_cursor)
 
-    return jsonify(blogs=blogs_data, current_user_id=current_user_id)
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
-@app.route('/create_blog', methods=['POST'])
+@bp.route('/create_blog', methods=['POST'])
 @login_required
 def create_blog():
     data = request.get_json()
     new_blog = Blog(content=data['content'], user_id=current_user.id, title=data['title'])
     db.session.add(new_blog)
+    db.session.flush()  # assigns the id the event carries
+    publish('created', feed.serialize_blog(new_blog, current_user, vote_counts=(0, 0)))
     db.session.commit()
     return jsonify(success=True)
 
-@app.route('/edit_blog/<int:blog_id>', methods=['POST'])
+@bp.route('/edit_blog/<int:blog_id>', methods=['POST'])
 @login_required
 def edit_blog(blog_id):
     blog = Blog.query.get_or_404(blog_id)
@@ -89,11 +316,13 @@ def edit_blog(blog_id):
 
     blog.content = data['content']
     blog.title = data['title']
+    publish('edited', {'id': blog.id, 'title': blog.title, 'content': blog.content})
 
     db.session.commit()
+    post_cache.invalidate(blog_id)
     return jsonify(success=True)
 
-@app.route('/delete_blog/<int:blog_id>', methods=['POST'])
+@bp.route('/delete_blog/<int:blog_id>', methods=['POST'])
 @login_required
 def delete_blog(blog_id):
     blog = Blog.query.get_or_404(blog_id)
@@ -101,61 +330,264 @@ def delete_blog(blog_id):
         return jsonify(success=False), 403  # Forbidden if user doesn't own the blog
 
     db.session.delete(blog)
+    publish('deleted', {'id': blog_id})
     db.session.commit()
+    post_cache.invalidate(blog_id)
     return jsonify(success=True)
 
+# Set the current user's vote on a blog: {"vote": "like" | "dislike" | "none"}
+@bp.route('/vote_blog/<int:blog_id>', methods=['POST'])
+@login_required
+def vote_blog(blog_id):
+    blog = Blog.query.get_or_404(blog_id)
+    data = request.get_json()
+    if data.get('vote') not in VOTE_VALUES:
+        return jsonify(success=False, message='Vote must be like, dislike or none'), 400
+
+    if record_vote(current_user.id, blog_id, VOTE_VALUES[data['vote']], coalesce=current_app.config['VOTE_COALESCING']) is None:
+        return jsonify(success=False, message='Vote conflicted with another request, try again'), 409
+
+    db.session.refresh(blog)
+    likes, dislikes = vote_counts(blog)
+    return jsonify(success=True, likes=likes, dislikes=dislikes, vote=VOTE_VALUES[data['vote']])
+
+# Full-text search: /search_blogs?q=<terms>&offset=<n>&limit=<page size>
+@bp.route('/search_blogs')
+def search_blogs():
+    terms = request.args.get('q', '')
+    offset = max(0, request.args.get('offset', 0, type=int))
+    limit = feed.parse_page_size(request.args.get('limit', type=int))
+
+    results = search.search_blogs(terms, limit + 1, offset)
+    next_offset = offset + limit if len(results) > limit else None
+    return jsonify(results=results[:limit], next_offset=next_offset)
+
+# Stream every user and blog as NDJSON (?tables=user,blog), for users named in BULK_ADMINS
+@bp.route('/admin/export')
+def admin_export():
+    if not bulk.is_admin():
+        return jsonify(success=False, message='Only bulk admins can export'), 403
+    try:
+        tables = bulk.parse_tables(request.args.get('tables'))
+    except ValueError as e:
+        return jsonify(success=False, message=str(e)), 400
+
+    response = current_app.response_class(stream_with_context(bulk.export_lines(tables)), mimetype='application/x-ndjson')
+    response.headers['Content-Disposition'] = 'attachment; filename=export.ndjson'
+    return response
+
+# Load an NDJSON body in the export format; posting it again skips the rows already in
+@bp.route('/admin/import', methods=['POST'])
+def admin_import():
+    if not bulk.is_admin():
+        return jsonify(success=False, message='Only bulk admins can import'), 403
+    try:
+        report = bulk.import_data(request.stream)
+    except ValueError as e:
+        return jsonify(success=False, message=str(e)), 400
+    return jsonify(success=True, **report)
+
+# Reply operations
+@bp.route('/get_replies/<int:blog_id>')
+def get_replies(blog_id):
+    Blog.query.get_or_404(blog_id)
+    cursor = request.args.get('cursor', type=int)
+    limit = feed.parse_page_size(request.args.get('limit', type=int))
+    replies, next_cursor = feed.reply_page(blog_id, cursor, limit)
+    return jsonify(replies=replies, next_cursor=next_cursor)
+
+@bp.route('/add_reply/<int:blog_id>', methods=['POST'])
+@login_required
+def add_reply(blog_id):
+    Blog.query.get_or_404(blog_id)
+    data = request.get_json()
+
+    reply = Reply(blog_id=blog_id, user_id=current_user.id, content=data['content'])
+    db.session.add(reply)
+    # Increment in SQL so concurrent replies can't overwrite each other's count
+    Blog.query.filter_by(id=blog_id).update({Blog.reply_count: Blog.reply_count + 1})
+    db.session.commit()
+    return jsonify(success=True, reply=feed.serialize_reply(reply, current_user))
+
+# Refuse a login or signup while the client is rate limited or password hashing is saturated
+def busy_response(message, retry_after=1, status=503):
+    response = jsonify(success=False, message=message)
+    response.status_code = status
+    response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
 # User signup route
-@app.route('/signup', methods=['POST'])
+@bp.route('/signup', methods=['POST'])
 def signup():
     data = request.get_json()
     if User.query.filter_by(display_name=data['display_name']).first():
         return jsonify(success=False, message='Display name already exists')
     
     new_user = User(display_name=data['display_name'])
-    new_user.set_password(data['password'])
+    try:
+        new_user.set_password(data['password'])
+    except HasherBusy as e:
+        return busy_response(str(e))
     db.session.add(new_user)
     db.session.commit()
     
     return jsonify(success=True)
 
 # User login route (for modal login)
-@app.route('/login', methods=['POST'])
+@bp.route('/login', methods=['POST'])
 def login():
     data = request.get_json()
+    retry_after = login_limiter.check(request.remote_addr, data['display_name'])
+    if retry_after:
+        return busy_response('Too many login attempts, try again later', retry_after, 429)
+
     user = User.query.filter_by(display_name=data['display_name']).first()
-    
-    if user and user.check_password(data['password']):
-        login_user(user)
-        return jsonify(success=True)
-    
+    try:
+        if user and user.check_password(data['password']):
+            # Upgrade hashes made with older parameters while we have the password
+            if user.password_needs_rehash():
+                user.set_password(data['password'])
+                db.session.commit()
+            login_limiter.succeeded(data['display_name'])
+            login_user(user)
+            return jsonify(success=True)
+    except HasherBusy as e:
+        return busy_response(str(e))
+
     return jsonify(success=False)
 
-@app.route('/update_profile', methods=['POST'])
+@bp.route('/update_profile', methods=['POST'])
 @login_required
 def update_profile():
     data = request.get_json()
-    
+    # current_user is a cached copy, so change the row itself
+    user = db.session.get(User, current_user.id)
+
     if data.get('display_name'):
         # Check if the new display name is already taken by another user
-        if User.query.filter_by(display_name=data['display_name']).first() and data['display_name'] != current_user.display_name:
+        if User.query.filter_by(display_name=data['display_name']).first() and data['display_name'] != user.display_name:
             return jsonify(success=False, message="Display name already exists")
-        current_user.display_name = data['display_name']
+        user.display_name = data['display_name']
 
     if data.get('password'):
-        current_user.set_password(data['password'])  # Hash the new password
+        try:
+            user.set_password(data['password'])  # Hash the new password
+        except HasherBusy as e:
+            db.session.rollback()
+            return busy_response(str(e))
 
     db.session.commit()
+    user_cache.invalidate(user.id)
     return jsonify(success=True)
 
 
-# Check if user is logged in
-@app.route('/check_login')
-def check_login():
-    return jsonify(logged_in=current_user.is_authenticated)
+# Convert databases created before replies had their own table:
+#   flask --app app migrate-replies
+@bp.cli.command('migrate-replies')
+def migrate_replies_command():
+    """Move pickled Blog.replies lists into the reply table."""
+    converted = migrations.migrate_pickled_replies()
+    print(f"Converted {converted} replies.")
+
+# Re-index every blog for search, e.g. after restoring a database:
+#   flask --app app rebuild-search
+@bp.cli.command('rebuild-search')
+def rebuild_search_command():
+    """Rebuild the full-text search index from the blog table."""
+    search.create_search_index()
+    search.rebuild_search_index()
+    print("Search index rebuilt.")
+
+# Store newsroom articles published since the last run:
+#   flask --app app scrape-news
+@bp.cli.command('scrape-news')
+def scrape_news_command():
+    """Fetch new articles from the police newsroom."""
+    scrape.print_report(scrape.scrape_news())
+
+# Run the background jobs on their intervals as a separate worker process:
+#   flask --app app run-scheduler
+@bp.cli.command('run-scheduler')
+def run_scheduler_command():
+    """Run the scrape, layer rebuild and map jobs on their intervals."""
+    print(f"Scheduling {', '.join(f'{name} every {interval:g}s' for name, interval in scheduler.intervals.items() if interval > 0)}")
+    try:
+        scheduler.run_forever()
+    except KeyboardInterrupt:
+        pass
+
+# Run one background job now, e.g. flask --app app run-job regenerate_map
+@bp.cli.command('run-job')
+@click.argument('name', type=click.Choice(sorted(scheduler.jobs)))
+def run_job_command(name):
+    """Run one background job now."""
+    outcome = scheduler.run(name)
+    if outcome is None:
+        print(f"Job {name} is already running.")
+    else:
+        print(json.dumps(outcome, indent=2))
+
+# Push live feed changes to browsers over Server-Sent Events, alongside the web server:
+#   flask --app app serve-events
+@bp.cli.command('serve-events')
+@click.option('--host', default='0.0.0.0')
+@click.option('--port', type=int, default=None, help='defaults to EVENTS_PORT')
+def serve_events_command(host, port):
+    """Serve /events, fanning committed feed changes out to every open blog page."""
+    try:
+        EventHub(current_app._get_current_object()).run(host, port or current_app.config['EVENTS_PORT'])
+    except KeyboardInterrupt:
+        pass
+
+# Back up users and blogs to NDJSON, or - for stdout:
+#   flask --app app export-data backup.ndjson
+@bp.cli.command('export-data')
+@click.argument('path', default='-')
+@click.option('--tables', default='', help='comma-separated, default user,blog')
+def export_data_command(path, tables):
+    """Stream users and blogs to an NDJSON file."""
+    try:
+        tables = bulk.parse_tables(tables)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--tables')
+    if path == '-':
+        report = bulk.export_data(sys.stdout, tables)
+    else:
+        with open(path, 'w', encoding='utf-8') as f:
+            report = bulk.export_data(f, tables)
+    print(bulk.format_report('Exported', report), file=sys.stderr)
+
+# Load an NDJSON export; rerunning after an interruption resumes from PATH.checkpoint:
+#   flask --app app import-data backup.ndjson
+@bp.cli.command('import-data')
+@click.argument('path')
+@click.option('--checkpoint', default=None, help='defaults to PATH.checkpoint')
+def import_data_command(path, checkpoint):
+    """Bulk-insert users and blogs from an NDJSON file in resumable chunks."""
+    checkpoint = checkpoint or path + '.checkpoint'
+    with open(path, encoding='utf-8') as f:
+        try:
+            report = bulk.import_data(f, checkpoint, progress=lambda report: print(
+                f"  line {report['lines']:,d}: " + bulk.format_report('imported', report)))
+        except ValueError as e:
+            raise click.ClickException(str(e))
+    print(bulk.format_report('Imported', report))
+
+# Rebuild static/dist after changing anything in static/:
+#   flask --app app build-assets
+@bp.cli.command('build-assets')
+def build_assets_command():
+    """Write fingerprinted, compressed and resized copies of the static files."""
+    print_build_report(build_assets(current_app.static_folder), current_app.static_folder)
+    assets.reload()
 
-# Create the necessary tables if they don't exist yet
-with app.app_context():
-    db.create_all()
+# Create missing tables and run the data migrations, once per deploy before starting the server:
+#   flask --app app migrate
+@bp.cli.command('migrate')
+def migrate_command():
+    """Create or upgrade the database schema."""
+    converted = migrations.upgrade()
+    print(f"Schema is up to date ({converted} replies converted).")
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    create_app().run(debug=True)
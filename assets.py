@@ -0,0 +1,372 @@
+"""Fingerprinted, precompressed static assets and cached static pages.
+
+Build the assets after changing anything in static/:
+
+    flask --app app build-assets
+
+This writes static/dist/ with a copy of every asset named by a hash of
+its content (app.3f9a1c2e7b.js), gzip and brotli variants of the text
+assets, resized JPEG/PNG and WebP variants of the raster images, and
+manifest.json mapping original names to all of these. References to
+/static/<name> inside CSS and JS are rewritten to the fingerprinted URLs.
+
+At run time url_for('static', filename=...) returns the fingerprinted URL
+when the asset is in the manifest (url_for('static', filename='x.jpg', w=640)
+picks the smallest variant at least 640px wide), and those URLs are served
+with a one-year immutable Cache-Control, choosing br, gzip or identity from
+Accept-Encoding. Without a build everything falls back to plain /static.
+
+Pages that are the same for every visitor (about, references and the
+generated map) are rendered once per version and kept in memory with their
+compressed forms, and are revalidated by ETag.
+"""
+import gzip
+import hashlib
+import io
+import json
+import mimetypes
+import os
+import re
+import threading
+
+from flask import abort, request, send_file
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:  # no .br variants
+    brotli = None
+
+try:
+    from PIL import Image
+except ImportError:  # no resized image variants
+    Image = None
+
+DIST_DIR = 'dist'
+MANIFEST_NAME = 'manifest.json'
+
+ASSET_EXTENSIONS = {'.js', '.css', '.svg', '.png', '.jpg', '.jpeg', '.webp', '.ico', '.woff2'}
+COMPRESSIBLE = {'.js', '.css', '.svg', '.ico', '.json', '.html'}
+RASTER = {'.png', '.jpg', '.jpeg'}
+
+# Widths of the resized image variants (only those smaller than the original are made)
+IMAGE_WIDTHS = (160, 320, 640, 960, 1280, 1920)
+
+ONE_YEAR = 365 * 24 * 3600
+
+# Encodings in order of preference: (Accept-Encoding token, file suffix)
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def _fingerprint(name, content):
+    stem, ext = os.path.splitext(name)
+    return f'{stem}.{hashlib.sha256(content).hexdigest()[:10]}{ext}'
+
+
+def _gzip(content):
+    return gzip.compress(content, compresslevel=9, mtime=0)
+
+
+# Attributes that hold nothing but numbers: path data, point lists, coordinates and lengths
+_SVG_NUMERIC_ATTRIBUTE = re.compile(
+    r'(\s(?:d|points|viewBox|transform|[xy][12]?|c[xy]|r[xy]?|width|height|stroke-width)=")([^"]*)(")')
+# A number with more than 2 decimals, unless it has an exponent
+_SVG_LONG_DECIMAL = re.compile(r'-?\d*\.\d{3,}(?![\deE])')
+
+
+def _round_svg_number(match):
+    # Always with a point, so a following ".5" can't run into it
+    return f'{float(match.group(0)):.2f}'
+
+
+def _minify_svg(content):
+    """Round path data and numeric attributes to 2 decimals and drop the indentation traced SVGs are full of."""
+    text = content.decode('utf-8')
+    text = _SVG_NUMERIC_ATTRIBUTE.sub(
+        lambda m: m.group(1) + _SVG_LONG_DECIMAL.sub(_round_svg_number, m.group(2)) + m.group(3), text)
+    text = re.sub(r'\s*\n\s*', '\n', text)
+    return text.encode('utf-8')
+
+
+def _write(path, content):
+    if not os.path.exists(path):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+
+def _write_compressed(path, content):
+    """Write the .br and .gz variants of content next to path; returns the encodings kept."""
+    encodings = []
+    for encoding, suffix, compressed in (('br', '.br', brotli.compress(content) if brotli else None),
+                                         ('gzip', '.gz', _gzip(content))):
+        # Only worth keeping if it saves something
+        if compressed is not None and len(compressed) < len(content) * 0.95:
+            _write(path + suffix, compressed)
+            encodings.append(encoding)
+    return encodings
+
+
+def write_fingerprinted(directory, name, content):
+    """Write content (bytes) to directory under a content-hashed version of name, with compressed variants.
+
+    Returns the file name, to serve with Assets.send_fingerprinted.
+    """
+    filename = _fingerprint(name, content)
+    _write(os.path.join(directory, filename), content)
+    if os.path.splitext(name)[1].lower() in COMPRESSIBLE:
+        _write_compressed(os.path.join(directory, filename), content)
+    return filename
+
+
+def _save_image(image, fmt):
+    out = io.BytesIO()
+    if fmt == 'JPEG':
+        image.convert('RGB').save(out, 'JPEG', quality=82, optimize=True, progressive=True)
+    elif fmt == 'WEBP':
+        image.save(out, 'WEBP', quality=80, method=6)
+    else:
+        image.save(out, fmt, optimize=True)
+    return out.getvalue()
+
+
+def build_assets(static_dir):
+    """Write static_dir/dist and its manifest; returns the manifest."""
+    dist = os.path.join(static_dir, DIST_DIR)
+    os.makedirs(dist, exist_ok=True)
+    names = sorted(
+        os.path.relpath(os.path.join(root, name), static_dir).replace(os.sep, '/')
+        for root, dirs, files in os.walk(static_dir)
+        if os.path.relpath(root, static_dir).split(os.sep)[0] != DIST_DIR
+        for name in files if os.path.splitext(name)[1].lower() in ASSET_EXTENSIONS
+    )
+    # Images first, then CSS, then JS, so references can be rewritten to already-built files
+    order = {'.css': 1, '.js': 2}
+    names.sort(key=lambda name: order.get(os.path.splitext(name)[1].lower(), 0))
+
+    files = {}
+    for name in names:
+        ext = os.path.splitext(name)[1].lower()
+        with open(os.path.join(static_dir, name), 'rb') as f:
+            content = f.read()
+        if ext in ('.css', '.js'):
+            content = _rewrite_references(content, files)
+        if ext == '.svg':
+            content = _minify_svg(content)
+
+        entry = {'path': f'{DIST_DIR}/{_fingerprint(name, content)}', 'bytes': len(content), 'encodings': []}
+        _write(os.path.join(static_dir, entry['path']), content)
+        if ext in COMPRESSIBLE:
+            entry['encodings'] = _write_compressed(os.path.join(static_dir, entry['path']), content)
+        if ext in RASTER and Image is not None:
+            entry.update(_build_variants(name, os.path.join(static_dir, name), static_dir))
+        files[name] = entry
+
+    manifest = {'version': hashlib.sha256(json.dumps(files, sort_keys=True).encode()).hexdigest()[:10],
+                'files': files}
+    # Drop outputs of earlier builds
+    keep = {MANIFEST_NAME}
+    for entry in files.values():
+        keep.add(os.path.basename(entry['path']))
+        keep.update(os.path.basename(entry['path']) + suffix for _, suffix in ENCODINGS)
+        for variant in entry.get('variants', []):
+            keep.update(os.path.basename(variant[key]) for key in ('path', 'webp'))
+    for name in os.listdir(dist):
+        if name not in keep:
+            os.remove(os.path.join(dist, name))
+
+    tmp_path = os.path.join(dist, MANIFEST_NAME + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_path, os.path.join(dist, MANIFEST_NAME))
+    return manifest
+
+
+def _build_variants(name, path, static_dir):
+    """Resized copies of an image, each as its own format and as WebP."""
+    with Image.open(path) as image:
+        image.load()
+        width, height = image.size
+        fmt = 'PNG' if image.format == 'PNG' else 'JPEG'
+        stem, ext = os.path.splitext(name)
+        variants = []
+        for target in [w for w in IMAGE_WIDTHS if w < width] + [width]:
+            resized = image if target == width else image.resize(
+                (target, max(1, round(height * target / width))), Image.LANCZOS)
+            variant = {'width': target}
+            for key, variant_fmt, variant_ext in (('path', fmt, ext), ('webp', 'WEBP', '.webp')):
+                content = _save_image(resized, variant_fmt)
+                variant[key] = f'{DIST_DIR}/{_fingerprint(f"{stem}-{target}w{variant_ext}", content)}'
+                _write(os.path.join(static_dir, variant[key]), content)
+            variants.append(variant)
+    return {'width': width, 'height': height, 'variants': variants}
+
+
+_REFERENCE = re.compile(r'/static/([\w./-]+?)(?:\?w=(\d+))?(?=["\'\s)])')
+
+
+def _rewrite_references(content, files):
+    """Point /static/<name> (optionally ?w=<width>) at the built files."""
+    def replace(match):
+        entry = files.get(match.group(1))
+        if entry is None:
+            return match.group(0)
+        return '/static/' + _variant(entry, int(match.group(2) or 0))['path']
+    return _REFERENCE.sub(replace, content.decode('utf-8')).encode('utf-8')
+
+
+def _variant(entry, width=0, webp=False):
+    """The smallest variant of entry at least width wide (the original if width is 0)."""
+    variants = entry.get('variants')
+    if not variants or not width:
+        return entry
+    chosen = next((variant for variant in variants if variant['width'] >= width), variants[-1])
+    return {'path': chosen['webp' if webp else 'path']}
+
+
+class Assets:
+    """Serve fingerprinted assets and cache pages that don't depend on the visitor."""
+
+    def __init__(self, app=None):
+        self.manifest = {'version': None, 'files': {}}
+        self.static_dir = None
+        self.enabled = False
+        self._pages = {}  # key -> (version, etag, {encoding: body})
+        self._pages_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('ASSETS_ENABLED', os.environ.get('ASSETS_ENABLED', '1') == '1')
+        app.config.setdefault('PAGE_CACHE_ENABLED', True)
+        # Pages larger than this (e.g. a map with every feature inline) are streamed from disk instead
+        app.config.setdefault('PAGE_CACHE_MAX_BYTES', 32 * 2 ** 20)
+        self.app = app
+        self.static_dir = app.static_folder
+        self.reload()
+        if 'static_dist' not in app.view_functions:
+            app.add_url_rule(f'{app.static_url_path}/{DIST_DIR}/<path:filename>', 'static_dist', self.send_asset)
+            app.url_defaults(self._fingerprint_url)
+            app.add_template_global(self.static_srcset)
+
+    def reload(self):
+        """Read the manifest written by build_assets, if there is one."""
+        path = os.path.join(self.static_dir, DIST_DIR, MANIFEST_NAME)
+        self.enabled = self.app.config['ASSETS_ENABLED'] and os.path.exists(path)
+        if self.enabled:
+            with open(path) as f:
+                self.manifest = json.load(f)
+        else:
+            self.manifest = {'version': None, 'files': {}}
+        with self._pages_lock:
+            self._pages.clear()
+
+    def _fingerprint_url(self, endpoint, values):
+        if endpoint != 'static' or not self.enabled:
+            return
+        entry = self.manifest['files'].get(values.get('filename'))
+        if entry is not None:
+            values['filename'] = _variant(entry, int(values.pop('w', 0)))['path']
+
+    def static_srcset(self, filename, webp=False):
+        """A srcset listing the resized variants of an image ('' without a build)."""
+        entry = self.manifest['files'].get(filename) if self.enabled else None
+        if not entry or not entry.get('variants'):
+            return ''
+        prefix = self.app.static_url_path
+        return ', '.join(f"{prefix}/{variant['webp' if webp else 'path']} {variant['width']}w"
+                         for variant in entry['variants'])
+
+    def _negotiate(self, available):
+        """Pick the preferred encoding the client accepts from available, or None."""
+        for encoding, _ in ENCODINGS:
+            if encoding in available and request.accept_encodings[encoding]:
+                return encoding
+        return None
+
+    def send_asset(self, filename):
+        return self.send_fingerprinted(os.path.join(self.static_dir, DIST_DIR), filename)
+
+    def send_fingerprinted(self, directory, filename):
+        """Serve a content-named file from directory as immutable, precompressed when the client accepts it."""
+        path = safe_join(directory, filename)
+        if path is None or not os.path.isfile(path):
+            abort(404)
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        encoding = self._negotiate([encoding for encoding, suffix in ENCODINGS if os.path.exists(path + suffix)])
+        if encoding is not None:
+            path += dict(ENCODINGS)[encoding]
+        response = send_file(path, mimetype=mimetype, conditional=True, max_age=ONE_YEAR)
+        if encoding is not None:
+            response.content_encoding = encoding
+        # send_file names the file after the .br/.gz it read
+        del response.headers['Content-Disposition']
+        response.vary.add('Accept-Encoding')
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+
+    def page(self, key, version, render):
+        """Respond with a page that is the same for every visitor.
+
+        render() returns the page as str or bytes; it is called again only
+        when version changes. Returns None if the page is too large to keep.
+        """
+        if not self.app.config['PAGE_CACHE_ENABLED']:
+            body = render()
+            return self._page_response({None: body.encode() if isinstance(body, str) else body}, None)
+        version = (version, self.manifest['version'])
+        with self._pages_lock:
+            cached = self._pages.get(key)
+        if cached is None or cached[0] != version:
+            body = render()
+            body = body.encode('utf-8') if isinstance(body, str) else body
+            if len(body) > self.app.config['PAGE_CACHE_MAX_BYTES']:
+                return None
+            bodies = {None: body, 'gzip': gzip.compress(body, compresslevel=6)}
+            if brotli is not None:
+                bodies['br'] = brotli.compress(body, quality=5)
+            cached = (version, hashlib.sha256(body).hexdigest()[:16], bodies)
+            with self._pages_lock:
+                self._pages[key] = cached
+        return self._page_response(cached[2], cached[1])
+
+    def _page_response(self, bodies, etag):
+        encoding = self._negotiate(bodies)
+        response = self.app.response_class(bodies[encoding], mimetype='text/html')
+        if etag is not None:
+            # Weak: the same page is sent with different encodings
+            response.set_etag(f'{etag}-{encoding or "identity"}', weak=True)
+            response.cache_control.no_cache = True
+            response.cache_control.public = True
+        if encoding is not None:
+            response.content_encoding = encoding
+        response.vary.add('Accept-Encoding')
+        return response.make_conditional(request)
+
+
+assets = Assets()
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Build static/dist: fingerprinted, compressed and resized assets.")
+    parser.add_argument('--static-dir', default='static')
+    args = parser.parse_args()
+    print_build_report(build_assets(args.static_dir), args.static_dir)
+
+
+def print_build_report(manifest, static_dir):
+    """Print each asset's size before and after compression."""
+    for name, entry in manifest['files'].items():
+        path = os.path.join(static_dir, entry['path'])
+        smallest = min([os.path.getsize(path)] + [os.path.getsize(path + suffix) for encoding, suffix in ENCODINGS
+                                                  if encoding in entry['encodings']])
+        variants = f"  {len(entry.get('variants', []))} sizes" if entry.get('variants') else ''
+        print(f"{name:<14} {os.path.getsize(os.path.join(static_dir, name)):>10,} -> {smallest:>10,} bytes "
+              f"{' '.join(entry['encodings']):<8}{variants}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+"""Time to first byte and to the whole first page of /blog, rendered by the server.
+
+Seeds --blogs blogs (the newest with a few replies each) in a temporary
+database and serves the app over HTTP from a thread. For BLOG_PAGE_SIZE 50
+and 500, loads the feed the way a browser does on a first view:
+
+* before  the empty page the feed used to be, then /get_blogs for the same
+          posts (100 per request at most), as blog.js fetched them; the
+          posts are not on screen until blog.js has also built them, which
+          isn't timed here
+* cold    /blog with the post cache cleared before every request
+* warm    /blog with every post already cached
+
+and reports the p50 time to the response headers (TTFB) and to the last
+byte of the posts, logged in as one of the authors.
+
+Then checks that the page shows the same posts as /get_blogs, that edits
+(here or in another process), renames and deletes show up on the next
+load, that titles and content are escaped, that only the author gets the
+Edit buttons, that the page tells the live feed where to resume and that
+an unchanged page is answered with 304. Exits 1 if a check fails.
+"""
+import argparse
+import re
+import sys
+import threading
+import time
+
+import requests
+from flask import render_template_string
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from benchmarks.common import make_app, percentile, seed_blogs, use_temp_database
+
+use_temp_database()
+
+from assets import assets  # noqa: E402
+from feed_events import latest_event_id  # noqa: E402
+from models import db, Blog, Reply  # noqa: E402
+from post_cache import post_cache  # noqa: E402
+
+app = make_app()
+
+# The page /blog served before it was rendered with its posts
+LEGACY_SHELL = """<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Community Blogs</title>
+    <script src="https://cdn.tailwindcss.com"></script>
+    <link rel="icon" href="{{ url_for('static', filename='hack.svg') }}" type="image/svg+xml">
+</head>
+<body data-events-url="{{ config.EVENTS_URL }}">
+    <div id="app"></div>
+    <script src="{{ url_for('static', filename='blog.js') }}"></script>
+</body>
+</html>"""
+
+app.add_url_rule('/legacy_blog', 'legacy_blog',
+                 lambda: assets.page('legacy_blog', None, lambda: render_template_string(LEGACY_SHELL)))
+
+POST_IDS = re.compile(r'<div class="[^"]*blog-post-(\d+)" data-blog-id')
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log(self, *args):
+        pass
+
+
+def fetch(session, url):
+    """(ms to the response headers, ms to the last byte, bytes, response)."""
+    start = time.perf_counter()
+    response = session.get(url, stream=True)
+    ttfb = time.perf_counter() - start
+    return ttfb * 1000, (time.perf_counter() - start) * 1000, len(response.content), response
+
+
+def load_before(session, base, size):
+    """The empty page, then the JSON for size posts; the last item is the ids listed."""
+    start = time.perf_counter()
+    ttfb, _, total, _ = fetch(session, base + '/legacy_blog')
+    ids, cursor = [], None
+    while len(ids) < size:
+        url = f'{base}/get_blogs?limit={min(100, size - len(ids))}' + (f'&cursor={cursor}' if cursor else '')
+        response = session.get(url)
+        total += len(response.content)
+        ids += [blog['id'] for blog in response.json()['blogs']]
+        cursor = response.json()['next_cursor']
+        if cursor is None:
+            break
+    return ttfb, (time.perf_counter() - start) * 1000, total, ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--blogs', type=int, default=20000)
+    parser.add_argument('--content', type=int, default=1000, help='characters per blog')
+    parser.add_argument('--repeat', type=int, default=30)
+    args = parser.parse_args()
+
+    failures = []
+
+    def check(condition, message):
+        print(f"{'ok  ' if condition else 'FAIL'} {message}")
+        if not condition:
+            failures.append(message)
+
+    with app.app_context():
+        seed_blogs(db, args.blogs, content_length=args.content)
+        # Two replies on each of the newest posts, so the footers have a preview to show
+        newest = range(max(1, args.blogs - 999), args.blogs + 1)
+        db.session.execute(Reply.__table__.insert(), [
+            {'blog_id': blog_id, 'user_id': n + 1, 'content': f'reply {n} to {blog_id}'} for blog_id in newest for n in range(2)
+        ])
+        db.session.query(Blog).filter(Blog.id.in_(newest)).update({Blog.reply_count: 2})
+        db.session.commit()
+
+    server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_port}'
+    # The author of the newest post; seed_blogs hands posts out to users in turn
+    author_id = (args.blogs - 1) % 100 + 1
+    session = requests.Session()
+    session.post(base + '/login', json={'display_name': f'user{author_id - 1}', 'password': 'benchmark1'}).raise_for_status()
+
+    print(f"{args.blogs:,d} blogs of {args.content:,d} characters, p50 of {args.repeat} loads")
+    print(f"{'posts':>5} {'case':<7} {'requests':>8} {'ttfb':>10} {'all posts':>10} {'bytes':>11}")
+    results = {}
+    for size in (50, 500):
+        app.config['BLOG_PAGE_SIZE'] = size
+        fetch(session, base + '/blog')  # compile the templates
+        before = [load_before(session, base, size) for _ in range(args.repeat)]
+        cold, warm = [], []
+        for _ in range(args.repeat):
+            post_cache.clear()
+            cold.append(fetch(session, base + '/blog'))
+        for _ in range(args.repeat):
+            warm.append(fetch(session, base + '/blog'))
+        for label, timings, requests_made in (('before', before, 1 + -(-size // 100)), ('cold', cold, 1), ('warm', warm, 1)):
+            ttfb = percentile([t[0] for t in timings], 50)
+            full = percentile([t[1] for t in timings], 50)
+            results[size, label] = full
+            print(f"{size:>5} {label:<7} {requests_made:>8} {ttfb:>8.2f}ms {full:>8.2f}ms {timings[-1][2]:>11,d}")
+        results[size, 'ids'] = ([int(i) for i in POST_IDS.findall(warm[-1][3].text)], before[-1][3])
+    print()
+    stats = post_cache.stats()
+    print(f"post cache: {stats['hits']:,d} hits, {stats['misses']:,d} misses, {stats['size']:,d} posts cached")
+    print()
+
+    for size in (50, 500):
+        rendered, listed = results[size, 'ids']
+        check(len(rendered) == size and rendered == listed, f"{size} posts: /blog shows the posts /get_blogs lists")
+        check(results[size, 'warm'] < results[size, 'cold'],
+              f"{size} posts: cached {results[size, 'cold']:.2f} -> {results[size, 'warm']:.2f}ms")
+        check(results[size, 'warm'] < results[size, 'before'],
+              f"{size} posts: first view {results[size, 'before']:.2f} -> {results[size, 'warm']:.2f}ms")
+
+    app.config['BLOG_PAGE_SIZE'] = 20
+    newest = args.blogs
+
+    def page():
+        return session.get(base + '/blog').text
+
+    def post_html(html, blog_id):
+        match = re.search(rf'<div class="[^"]*blog-post-{blog_id}" data-blog-id.*?Reply</button>\s*</div>\s*</div>', html, re.S)
+        return match.group(0) if match else ''
+
+    html = page()
+    owned = [int(i) for i in re.findall(r'onclick="editBlog\((\d+)\)"', html)]
+    with app.app_context():
+        authored = [blog_id for blog_id, user_id in db.session.query(Blog.id, Blog.user_id).order_by(Blog.id.desc()).limit(20)
+                    if user_id == author_id]
+    check(owned == authored and owned, f"only the author's posts have Edit buttons: {owned}")
+    check(session.get(base + '/blog', headers={'If-None-Match': session.get(base + '/blog').headers['ETag']}).status_code == 304,
+          "an unchanged page is answered with 304")
+
+    session.post(f'{base}/edit_blog/{newest}', json={'title': '<script>alert(1)</script>', 'content': 'edited & "quoted"'})
+    post = post_html(page(), newest)
+    check('value="&lt;script&gt;alert(1)&lt;/script&gt;"' in post and 'edited &amp; &#34;quoted&#34;</textarea>' in post,
+          "an edit shows on the next load, escaped")
+    check(post_cache.stats()['invalidated'] == 1, "edit_blog invalidates the cached post")
+
+    # An edit made by another process only changes the row
+    with app.app_context():
+        db.session.query(Blog).filter(Blog.id == newest).update({Blog.content: 'edited elsewhere'})
+        db.session.commit()
+    stale = post_cache.stats()['stale']
+    check('edited elsewhere</textarea>' in post_html(page(), newest) and post_cache.stats()['stale'] == stale + 1,
+          "an edit from another process is re-rendered, not served stale")
+
+    session.post(base + '/update_profile', json={'old_password': 'benchmark1', 'display_name': 'renamed'})
+    check('<strong>renamed</strong>' in post_html(page(), newest), "a renamed author shows on the next load")
+
+    session.post(f'{base}/delete_blog/{newest}')
+    check(post_html(page(), newest) == '' and post_cache.stats()['invalidated'] == 2,
+          "a deleted post is gone and dropped from the cache")
+    with app.app_context():
+        head = latest_event_id()
+    check(head > 0 and f'data-last-event-id="{head}"' in page(), f"the page resumes the live feed from event {head}")
+
+    server.shutdown()
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+"""Rows/sec and memory of the NDJSON bulk export and import.
+
+Seeds --blogs blogs by --users users in a temporary database, then:
+
+* exports them to a file with bulk.export_data, tracking peak memory
+* imports the file into a second, empty database, interrupting it halfway
+  through and resuming from the checkpoint, as a killed import-data would
+* imports it again, which must skip every row
+
+and checks that exporting the imported database reproduces the file byte
+for byte, that memory stays flat (anonymous memory, sampled while each
+pass runs, grows by less than --max-mb however many rows there are; the
+memory-mapped database file is left out, as the kernel can drop it), that imported blogs are searchable and that
+/admin/export and /admin/import only answer BULK_ADMINS. Last, it imports
+new users each followed by their blogs in small batches with SQLite's
+foreign keys on, so blogs fill a batch while their users are pending.
+Exits 1 if a check fails.
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+
+from benchmarks.common import make_app, seed_blogs, use_temp_database
+
+source_path = use_temp_database()
+
+import bulk  # noqa: E402
+from models import db, Blog, User  # noqa: E402
+import search  # noqa: E402
+
+ADMIN = 'user0'
+
+
+class Interrupted(Exception):
+    pass
+
+
+def anon_rss_mb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('RssAnon:'):
+                return int(line.split()[1]) / 1024
+
+
+class MemoryPeak:
+    """Highest anonymous memory seen while the block runs, sampled every 20ms, less where it started."""
+
+    def __enter__(self):
+        self.start = self.peak = anon_rss_mb()
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def _sample(self):
+        while not self._done.wait(0.02):
+            self.peak = max(self.peak, anon_rss_mb())
+
+    def __exit__(self, *exc):
+        self._done.set()
+        self._thread.join()
+        self.growth = self.peak - self.start
+
+
+def interrupt_after(lines, count):
+    """Yield the first count lines, then fail like a killed process."""
+    for i, line in enumerate(lines):
+        if i == count:
+            raise Interrupted
+        yield line
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--blogs', type=int, default=1_000_000)
+    parser.add_argument('--users', type=int, default=10_000)
+    parser.add_argument('--content', type=int, default=500, help='characters per blog')
+    parser.add_argument('--chunk-rows', type=int, default=None, help='rows per import transaction, default BULK_CHUNK_ROWS')
+    parser.add_argument('--max-mb', type=float, default=96, help="SQLite's page cache alone may take 64 MB")
+    args = parser.parse_args()
+
+    failures = []
+
+    def check(condition, message):
+        print(f"{'ok  ' if condition else 'FAIL'} {message}")
+        if not condition:
+            failures.append(message)
+
+    workdir = tempfile.mkdtemp(prefix='bench-bulk-')
+    export_path = os.path.join(workdir, 'export.ndjson')
+    reexport_path = os.path.join(workdir, 'reexport.ndjson')
+    checkpoint = export_path + '.checkpoint'
+    target_path = os.path.join(workdir, 'target.db')
+    total = args.blogs + args.users
+
+    # Each executemany batch would count as a slow query
+    config = {'BULK_ADMINS': [ADMIN], 'METRICS_ENABLED': False}
+    if args.chunk_rows:
+        config['BULK_CHUNK_ROWS'] = args.chunk_rows
+    source = make_app(config)
+    with source.app_context():
+        start = time.perf_counter()
+        seed_blogs(db, args.blogs, n_users=args.users, content_length=args.content,
+                   make_content=lambda i: f'post {i} ' + 'drought ' * (args.content // 8))
+        print(f"seeded {args.blogs:,d} blogs and {args.users:,d} users in {time.perf_counter() - start:.1f}s")
+
+        with MemoryPeak() as memory, open(export_path, 'w', encoding='utf-8') as f:
+            exported = bulk.export_data(f, None)
+        export_growth = memory.growth
+    size = os.path.getsize(export_path)
+    print(bulk.format_report('exported', exported) + f"; {size / 1e6:,.0f} MB, peak memory +{export_growth:.0f} MB")
+
+    target = make_app(dict(config, SQLALCHEMY_DATABASE_URI='sqlite:///' + target_path))
+    with target.app_context():
+        with MemoryPeak() as memory:
+            with open(export_path, encoding='utf-8') as f:
+                try:
+                    bulk.import_data(interrupt_after(f, total // 2), checkpoint)
+                except Interrupted:
+                    db.session.rollback()
+            resume_line = bulk._read_checkpoint(checkpoint)
+            partial = db.session.query(Blog).count()
+            with open(export_path, encoding='utf-8') as f:
+                imported = bulk.import_data(f, checkpoint)
+        import_growth = memory.growth
+        stored = db.session.query(User).count() + db.session.query(Blog).count()
+        print(bulk.format_report('imported', imported) + f"; peak memory +{import_growth:.0f} MB")
+
+        with open(export_path, encoding='utf-8') as f:
+            again = bulk.import_data(f, checkpoint)
+        print(bulk.format_report('imported again:', again))
+
+        with open(reexport_path, 'w', encoding='utf-8') as f:
+            bulk.export_data(f, None)
+        hits = search.search_blogs('drought', 5)
+    print()
+
+    check(exported['rows'] == {'user': args.users, 'blog': args.blogs}, f"exported {exported['rows']}")
+    check(resume_line > 0 and not os.path.exists(checkpoint),
+          f"interrupted at line {total // 2:,d} with {partial:,d} blogs committed; resumed after line {resume_line:,d}")
+    resumed = sum(imported['rows'].values()) + sum(imported['skipped'].values())
+    check(imported.get('resumed_from_line') == resume_line and resumed == total - resume_line and stored == total,
+          f"the resumed import read the remaining {resumed:,d} lines; {stored:,d} rows stored")
+    check(sum(again['rows'].values()) == 0 and sum(again['skipped'].values()) == total,
+          f"importing again skipped all {total:,d} rows")
+    with open(export_path, 'rb') as a, open(reexport_path, 'rb') as b:
+        same = True
+        while same:
+            chunk_a, chunk_b = a.read(1 << 20), b.read(1 << 20)
+            same = chunk_a == chunk_b
+            if not chunk_a:
+                break
+    check(same, "exporting the imported database reproduces the export byte for byte")
+    check(export_growth < args.max_mb and import_growth < args.max_mb,
+          f"peak memory grew {export_growth:.0f} MB exporting and {import_growth:.0f} MB importing (limit {args.max_mb:g})")
+    check(len(hits) == 5, "imported blogs are in the search index")
+
+    client = target.test_client()
+    check(client.get('/admin/export').status_code == 403, "anonymous /admin/export is refused")
+    client.post('/login', json={'display_name': ADMIN, 'password': 'benchmark1'})
+    response = client.get('/admin/export?tables=user')
+    with open(export_path, encoding='utf-8') as f:
+        users = ''.join(line for _, line in zip(range(args.users), f))
+    check(response.status_code == 200 and response.get_data(as_text=True) == users,
+          "/admin/export?tables=user streams the user lines")
+    body = io.BytesIO(b'{"type": "blog", "title": "Posted", "content": "in bulk", "user_id": 1}\n' * 3)
+    response = client.post('/admin/import', data=body, content_type='application/x-ndjson')
+    check(response.get_json().get('rows') == {'user': 0, 'blog': 3}, f"/admin/import: {response.get_json()}")
+    response = client.post('/admin/import', data=b'{"type": "reply"}\n', content_type='application/x-ndjson')
+    check(response.status_code == 400, f"a bad line is refused: {response.get_json()['message']}")
+
+    with target.app_context():
+        # Each new user followed by two of their blogs, so the blogs fill a batch first
+        lines = []
+        for user_id in range(args.users + 1, args.users + 11):
+            lines.append(json.dumps({'type': 'user', 'id': user_id, 'display_name': f'new{user_id}', 'password_hash': 'x'}))
+            lines += [json.dumps({'type': 'blog', 'title': 'New', 'content': 'post', 'user_id': user_id})] * 2
+        db.session.execute(text('PRAGMA foreign_keys = ON'))
+        try:
+            interleaved = bulk.import_data(lines, batch_size=4)
+        except (ValueError, IntegrityError) as e:
+            db.session.rollback()
+            interleaved = {'rows': str(e)}
+        db.session.execute(text('PRAGMA foreign_keys = OFF'))
+    check(interleaved['rows'] == {'user': 10, 'blog': 20},
+          f"30 interleaved user and blog lines in batches of 4 with foreign keys on: {interleaved['rows']}")
+
+    for path in (export_path, reexport_path, target_path, source_path):
+        os.remove(path)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
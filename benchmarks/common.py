@@ -0,0 +1,132 @@
+"""Shared helpers for the benchmark scripts in this package.
+
+Run benchmarks from the repository root, e.g. ``python -m benchmarks.get_blogs``.
+"""
+import json
+import os
+import random
+import resource
+import tempfile
+import time
+
+from werkzeug.security import generate_password_hash
+
+# Tiles covering the initial map view (zoom 4, centered on Canada) of a ~1280x800 window
+INITIAL_VIEW_TILES = [(4, x, y) for x in range(1, 6) for y in range(3, 7)]
+
+
+def use_temp_database():
+    """Point the app at a throwaway SQLite file. Call before importing app."""
+    fd, path = tempfile.mkstemp(suffix='.db', prefix='bench-')
+    os.close(fd)
+    os.remove(path)
+    os.environ['DATABASE_URL'] = 'sqlite:///' + path
+    return path
+
+
+def make_app(config=None):
+    """Build the app and create its schema. Call after use_temp_database()."""
+    from app import create_app
+    import migrations
+
+    app = create_app(config)
+    with app.app_context():
+        migrations.upgrade()
+    return app
+
+
+def seed_blogs(db, n_blogs, n_users=100, content_length=1000, batch_size=10000, make_content=None):
+    """Insert n_users users and n_blogs blogs using executemany batches.
+
+    make_content(i) can supply per-blog text; by default every blog gets the
+    same content_length characters of filler.
+    """
+    from models import User, Blog
+
+    password_hash = generate_password_hash('benchmark1')
+    db.session.execute(User.__table__.insert(), [
+        {'display_name': f'user{i}', 'password_hash': password_hash} for i in range(n_users)
+    ])
+    content = ('lorem ipsum ' * (content_length // 12 + 1))[:content_length]
+    for start in range(0, n_blogs, batch_size):
+        db.session.execute(Blog.__table__.insert(), [
+            {'title': f'Post {i}', 'content': make_content(i) if make_content else content, 'user_id': i % n_users + 1, 'likes': 0, 'dislikes': 0}
+            for i in range(start, min(start + batch_size, n_blogs))
+        ])
+    db.session.commit()
+
+
+def write_map_layers(directory, polygons, vertices):
+    """Write random blob-shaped polygons over Canada as both GeoJSON overlays of the map."""
+    import shapely
+    import map as map_builder
+
+    rng = random.Random(7)
+    species_names = [name for name, _ in map_builder.SPECIES_POPULATION_COLOR_MAP]
+    zones = list(map_builder.VEGETATION_COLOR_MAP)
+    species, vegetation = [], []
+    for i in range(polygons):
+        center = shapely.Point(rng.uniform(-140, -55), rng.uniform(42, 75))
+        blob = center.buffer(rng.uniform(0.5, 4), quad_segs=max(1, vertices // 4))
+        geometry = json.loads(shapely.to_geojson(blob))
+        species.append({'type': 'Feature', 'geometry': geometry, 'properties': {
+            'CommName_E': rng.choice(species_names), 'Population_E': None,
+            'COSEWIC_Status': rng.randint(1, 5), 'SARA_Status': 'Schedule 1'}})
+        vegetation.append({'type': 'Feature', 'geometry': geometry, 'properties': {
+            'level_1': 'Zone', 'level_2': rng.choice(zones)}})
+
+    os.makedirs(os.path.join(directory, 'static'))
+    os.makedirs(os.path.join(directory, 'templates'))
+    for path, features in ((map_builder.PRIORITY_SPECIES_FILE_PATH, species),
+                           (map_builder.VEGETATION_ZONES_FILE_PATH, vegetation)):
+        with open(os.path.join(directory, path), 'w') as f:
+            json.dump({'type': 'FeatureCollection', 'features': features}, f)
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers."""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def time_calls(fn, repeat):
+    """Call fn repeat times and return the per-call latencies in milliseconds."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def print_latency(label, timings, extra=''):
+    print(f"{label:<40} p50={percentile(timings, 50):8.2f}ms  p99={percentile(timings, 99):8.2f}ms  {extra}")
+
+
+def _status_mb(key):
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(key + ':'):
+                return int(line.split()[1]) / 1024
+    raise OSError(key)
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process in MB.
+
+    Reads VmHWM where available: ru_maxrss carries over across exec, so a
+    subprocess would report its parent's peak if that was higher.
+    """
+    try:
+        return _status_mb('VmHWM')
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def current_rss_mb():
+    """Resident memory of this process right now in MB (None where /proc is unavailable)."""
+    try:
+        return _status_mb('VmRSS')
+    except OSError:
+        return None
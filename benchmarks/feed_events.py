@@ -0,0 +1,279 @@
+"""Fan-out latency and memory of the live feed event hub.
+
+Starts the hub (flask --app app serve-events) on a temporary database,
+connects --subscribers simulated browsers to /events from --clients
+processes, then edits a blog --events times through the app, --interval
+seconds apart. Every edit carries its send time, so each subscriber
+records how long each event took to reach it. Reports the latency
+percentiles over every delivery, the hub's CPU time per event and its
+resident memory and thread count before and after the subscribers
+connected. On a small machine the subscriber processes compete with the
+hub for CPU, which shows up in the latencies but not in the hub's CPU time.
+
+Then checks resuming: a subscriber that disconnects and comes back with
+Last-Event-ID gets exactly the created/edited/deleted/votes events it
+missed, in order, and one that was away longer than the replay window
+gets a reset event. Last, with the hub stopped, checks that the writers
+keep the table to about EVENTS_REPLAY rows themselves and that nothing is
+written with live updates off. Exits 1 if a check fails.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import resource
+import socket
+import subprocess
+import sys
+import time
+
+import requests
+
+from benchmarks.common import make_app, percentile, seed_blogs, use_temp_database
+
+use_temp_database()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+EVENTS_PORT = free_port()
+os.environ['EVENTS_PORT'] = str(EVENTS_PORT)
+
+from feed_events import feed_events  # noqa: E402
+from models import db, Blog, FeedEvent  # noqa: E402
+from votes import vote_buffer  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STATS_URL = f'http://127.0.0.1:{EVENTS_PORT}/events/stats'
+
+
+def hub_status(pid):
+    """(resident KB, threads) of a process, from /proc."""
+    fields = {}
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            name, _, value = line.partition(':')
+            fields[name] = value.split()
+    return int(fields['VmRSS'][0]), int(fields['Threads'][0])
+
+
+def cpu_seconds(pid):
+    """User plus system CPU time a process has used."""
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+async def read_frames(reader):
+    """Yield (id, event, data) for each event on an SSE stream, skipping comments."""
+    event_id = kind = None
+    data = []
+    while True:
+        line = (await reader.readline()).decode().rstrip('\n')
+        if not line and reader.at_eof():
+            return
+        if line.startswith(':'):
+            continue
+        if line == '':
+            if data or kind:
+                yield event_id, kind or 'message', '\n'.join(data)
+            kind, data = None, []
+            continue
+        name, _, value = line.partition(': ')
+        if name == 'id':
+            event_id = int(value)
+        elif name == 'event':
+            kind = value
+        elif name == 'data':
+            data.append(value)
+
+
+async def subscribe(port, last_event_id=None):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port, limit=1 << 20)
+    head = f'GET /events HTTP/1.1\r\nHost: localhost\r\nAccept: text/event-stream\r\n'
+    if last_event_id is not None:
+        head += f'Last-Event-ID: {last_event_id}\r\n'
+    writer.write(head.encode() + b'\r\n')
+    while (await reader.readline()) not in (b'\r\n', b''):
+        pass
+    return reader, writer
+
+
+def run_subscribers(port, connections, expected, timeout):
+    """One client process: connections subscribers, each waiting for expected edit events.
+
+    Returns (latencies in ms, subscribers that saw every event in order).
+    """
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    latencies, complete = [], 0
+
+    async def one():
+        nonlocal complete
+        reader, writer = await subscribe(port)
+        ids = []
+        try:
+            async for event_id, kind, data in read_frames(reader):
+                if kind != 'edited':
+                    continue
+                latencies.append((time.time() - float(json.loads(data)['content'].split('=')[1])) * 1000)
+                ids.append(event_id)
+                if len(ids) == expected:
+                    break
+        finally:
+            writer.close()
+        if ids == sorted(ids) and len(ids) == expected:
+            complete += 1
+
+    async def main():
+        tasks = []
+        for i in range(connections):
+            tasks.append(asyncio.ensure_future(one()))
+            if i % 100 == 99:
+                await asyncio.sleep(0.01)  # don't overflow the listen backlog
+        await asyncio.wait(tasks, timeout=timeout)
+    asyncio.run(main())
+    return latencies, complete
+
+
+def collect(port, last_event_id, count, quiet=0.5):
+    """Reconnect with last_event_id and return the events replayed, waiting quiet seconds for strays."""
+    async def main():
+        reader, writer = await subscribe(port, last_event_id)
+        events = []
+        frames = read_frames(reader)
+        try:
+            while True:
+                wait = 5 if len(events) < count else quiet
+                event_id, kind, data = await asyncio.wait_for(frames.__anext__(), wait)
+                events.append((event_id, kind, json.loads(data)))
+        except (asyncio.TimeoutError, StopAsyncIteration):
+            pass
+        writer.close()
+        return events
+    return asyncio.run(main())
+
+
+def first_event(port, last_event_id=None):
+    return collect(port, last_event_id, 1, quiet=0)[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--subscribers', type=int, default=2000)
+    parser.add_argument('--clients', type=int, default=2, help='subscriber processes')
+    parser.add_argument('--events', type=int, default=50)
+    parser.add_argument('--interval', type=float, default=0.05)
+    args = parser.parse_args()
+
+    failures = []
+
+    def check(condition, message):
+        print(f"{'ok  ' if condition else 'FAIL'} {message}")
+        if not condition:
+            failures.append(message)
+
+    app = make_app()
+    with app.app_context():
+        seed_blogs(db, 10, n_users=1)
+    author = app.test_client()
+    author.post('/login', json={'display_name': 'user0', 'password': 'benchmark1'})
+
+    hub = subprocess.Popen([sys.executable, '-m', 'flask', '--app', 'app', 'serve-events', '--host', '127.0.0.1'],
+                           cwd=ROOT, env=dict(os.environ), stdout=subprocess.DEVNULL)
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                requests.get(STATS_URL, timeout=1)
+                break
+            except requests.ConnectionError:
+                if time.monotonic() > deadline or hub.poll() is not None:
+                    raise RuntimeError('the event hub did not start')
+                time.sleep(0.2)
+        idle_rss, idle_threads = hub_status(hub.pid)
+
+        per_client = args.subscribers // args.clients
+        timeout = 30 + args.events * args.interval * 2
+        with multiprocessing.Pool(args.clients) as pool:
+            pending = pool.starmap_async(run_subscribers, [(EVENTS_PORT, per_client, args.events, timeout)] * args.clients)
+            connected = 0
+            while connected < per_client * args.clients and time.monotonic() < deadline + 60:
+                connected = requests.get(STATS_URL).json()['clients']
+                time.sleep(0.2)
+            rss, threads = hub_status(hub.pid)
+            cpu_before = cpu_seconds(hub.pid)
+            for i in range(args.events):
+                author.post('/edit_blog/1', json={'title': 'Live', 'content': f'sent={time.time()!r}'})
+                time.sleep(args.interval)
+            results = pending.get()
+            hub_cpu = cpu_seconds(hub.pid) - cpu_before
+        latencies = [ms for client_latencies, _ in results for ms in client_latencies]
+        complete = sum(count for _, count in results)
+
+        print(f"{connected:,d} subscribers, {args.events} events {args.interval * 1000:g}ms apart, "
+              f"{len(latencies):,d} deliveries")
+        print(f"fan-out latency p50 {percentile(latencies, 50):.1f}ms, p95 {percentile(latencies, 95):.1f}ms, "
+              f"p99 {percentile(latencies, 99):.1f}ms, max {max(latencies):.1f}ms")
+        print(f"hub CPU {hub_cpu / args.events * 1000:.1f}ms per event sent to every subscriber")
+        print(f"hub memory {idle_rss:,d} KB idle, {rss:,d} KB with {connected:,d} connections "
+              f"({(rss - idle_rss) * 1024 / max(connected, 1):,.0f} bytes each); {threads} threads")
+        print()
+        check(connected == per_client * args.clients, f"{connected:,d} subscribers connected")
+        check(complete == connected, f"{complete:,d} subscribers got all {args.events} events in order")
+        check(threads <= idle_threads + 2, f"hub threads: {idle_threads} idle, {threads} with every subscriber")
+        check((rss - idle_rss) * 1024 / max(connected, 1) < 64 * 1024, "under 64 KB of hub memory per connection")
+
+        # Resuming gets exactly what was missed, in order
+        token = first_event(EVENTS_PORT)[0]
+        author.post('/edit_blog/2', json={'title': 'Missed', 'content': 'one'})
+        author.post('/create_blog', json={'title': 'Missed', 'content': 'two'})
+        author.post('/delete_blog/3')
+        author.post('/vote_blog/4', json={'vote': 'like'})
+        vote_buffer.flush()
+        events = collect(EVENTS_PORT, token, 4)
+        check([kind for _, kind, _ in events] == ['edited', 'created', 'deleted', 'votes']
+              and events[-1][2] == {'id': 4, 'likes': 1, 'dislikes': 0},
+              f"resume from {token}: {[(event_id, kind) for event_id, kind, _ in events]}")
+        check(collect(EVENTS_PORT, events[-1][0], 0) == [], "resume from the latest event replays nothing")
+
+        # Away for longer than the replay window: told to reload
+        with app.app_context():
+            window = app.config['EVENTS_REPLAY']
+            db.session.execute(FeedEvent.__table__.insert(),
+                               [{'kind': 'edited', 'data': '{"id": 0}'} for _ in range(window + 10)])
+            db.session.commit()
+            head = db.session.query(db.func.max(FeedEvent.id)).scalar()
+        feed_events.wake()
+        while requests.get(STATS_URL).json()['head'] < head:
+            time.sleep(0.1)
+        event_id, kind, _ = first_event(EVENTS_PORT, token)
+        check(kind == 'reset' and event_id == head, f"resume from {token} after {window + 10} events: {kind} at {event_id}")
+        with app.app_context():
+            check(db.session.get(Blog, 3) is None, "the deleted blog is gone")
+    finally:
+        hub.terminate()
+        hub.wait(timeout=10)
+
+    # No hub: the writers prune, and publish nothing with live updates off
+    app.config.update(EVENTS_REPLAY=20, EVENTS_PRUNE_EVERY=10)
+    for i in range(100):
+        author.post('/edit_blog/1', json={'title': 'Unread', 'content': str(i)})
+    with app.app_context():
+        kept = db.session.query(FeedEvent).count()
+    check(kept <= 20 + 10, f"100 edits without the hub leave {kept} events (replay window 20, pruned every 10)")
+    app.config['EVENTS_URL'] = ''
+    author.post('/edit_blog/1', json={'title': 'Unread', 'content': 'off'})
+    with app.app_context():
+        check(db.session.query(FeedEvent).count() == kept, "nothing is published with live updates off")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
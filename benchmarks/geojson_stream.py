@@ -0,0 +1,117 @@
+"""Peak memory and time: json.load versus the streaming GeoJSON pipeline.
+
+Writes a synthetic priority-species FeatureCollection of about --megabytes
+(polygons plus a realistic spread of unused attribute columns), then runs
+each mode in a fresh subprocess so its peak RSS is its own:
+
+* legacy_trim   json.load, preprocess_species_data, drop unused properties, json.dump
+* stream_trim   iter_features -> label_cosewic_status -> project_properties -> write_feature_collection
+* legacy_index  json.load + preprocess_species_data, then build the FeatureIndex used by tiles/queries
+* stream_index  build the same FeatureIndex straight from the stream
+
+A mode that runs out of memory is reported as killed.
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.common import peak_rss_mb
+import map as map_builder
+from geojson_stream import iter_features, project_properties, write_feature_collection
+from layer_cache import layer_from_features
+from spatial import FeatureIndex
+
+MODES = ['legacy_trim', 'stream_trim', 'legacy_index', 'stream_index']
+
+
+def synthetic_species(target_bytes, vertices=60):
+    """Yield species range features until roughly target_bytes of JSON have been produced."""
+    rng = random.Random(3)
+    names = [name for name, _ in map_builder.SPECIES_POPULATION_COLOR_MAP]
+    written, i = 0, 0
+    while written < target_bytes:
+        x, y, r = rng.uniform(-140, -55), rng.uniform(42, 75), rng.uniform(0.1, 2)
+        ring = [[round(x + r * rng.uniform(0.8, 1.2) * (k % 7) / 7, 6), round(y + r * (k % 5) / 5, 6)]
+                for k in range(vertices)]
+        ring.append(ring[0])
+        feature = {'type': 'Feature', 'id': i, 'geometry': {'type': 'Polygon', 'coordinates': [ring]},
+                   'properties': {'CommName_E': rng.choice(names), 'Population_E': None,
+                                  'COSEWIC_Status': rng.randint(1, 5), 'SARA_Status': 'Schedule 1',
+                                  'CommName_F': 'Nom commun', 'SciName': 'Genus species', 'Taxon_E': 'Birds',
+                                  'Eco_Type': 'Terrestrial', 'Notes': 'Range derived from survey data. ' * 4,
+                                  'Shape_Area': r * r, 'Shape_Length': r * 6, 'GlobalID': f'{i:032x}'}}
+        written += len(json.dumps(feature, separators=(',', ':'))) + 2
+        i += 1
+        yield feature
+
+
+def run_mode(mode, source, target):
+    if mode == 'legacy_trim':
+        data = map_builder.preprocess_species_data(map_builder.load_local_geojson(source))
+        for feature in data['features']:
+            feature['properties'] = {field: feature['properties'].get(field) for field in map_builder.SPECIES_FIELDS}
+        with open(target, 'w') as f:
+            json.dump(data, f)
+        return len(data['features'])
+    if mode == 'stream_trim':
+        features = project_properties(map_builder.label_cosewic_status(iter_features(source)),
+                                      map_builder.SPECIES_FIELDS)
+        return write_feature_collection(features, target)
+    if mode == 'legacy_index':
+        data = map_builder.preprocess_species_data(map_builder.load_local_geojson(source))
+        return len(FeatureIndex(layer_from_features(data['features'])).ids)
+    if mode == 'stream_index':
+        features = project_properties(map_builder.label_cosewic_status(iter_features(source)),
+                                      map_builder.SPECIES_FIELDS)
+        return len(FeatureIndex(layer_from_features(features)).ids)
+    raise ValueError(mode)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--megabytes', type=int, default=500)
+    parser.add_argument('--modes', default=','.join(MODES))
+    parser.add_argument('--worker', nargs=3, metavar=('MODE', 'SOURCE', 'TARGET'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        start = time.perf_counter()
+        count = run_mode(*args.worker)
+        print(json.dumps({'features': count, 'seconds': time.perf_counter() - start,
+                          'peak_rss_mb': peak_rss_mb()}))
+        return
+
+    directory = tempfile.mkdtemp(prefix='bench-geojson-')
+    source = os.path.join(directory, 'species.geojson')
+    start = time.perf_counter()
+    count = write_feature_collection(synthetic_species(args.megabytes * 1024 * 1024), source)
+    print(f"wrote {count:,} features, {os.path.getsize(source) / 2 ** 20:,.0f} MB "
+          f"in {time.perf_counter() - start:.1f}s")
+
+    # Baseline for the interpreter and imports alone
+    baseline = subprocess.run([sys.executable, '-c', 'import map, spatial; '
+                               'from benchmarks.common import peak_rss_mb; print(peak_rss_mb())'],
+                              capture_output=True, text=True, check=True)
+    print(f"{'imports only':<14} peak RSS {float(baseline.stdout):8.0f} MB")
+
+    for mode in args.modes.split(','):
+        target = os.path.join(directory, f'{mode}.geojson')
+        result = subprocess.run([sys.executable, '-m', 'benchmarks.geojson_stream', '--worker', mode, source, target],
+                                capture_output=True, text=True)
+        if result.returncode != 0:
+            reason = 'killed (out of memory?)' if result.returncode < 0 else result.stderr.strip().splitlines()[-1]
+            print(f"{mode:<14} {reason}")
+            continue
+        stats = json.loads(result.stdout.strip().splitlines()[-1])
+        out = f"  output {os.path.getsize(target) / 2 ** 20:6.0f} MB" if os.path.exists(target) else ''
+        print(f"{mode:<14} peak RSS {stats['peak_rss_mb']:8.0f} MB  time {stats['seconds']:7.1f}s  "
+              f"{stats['features']:,} features{out}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""Compare the old unpaginated /get_blogs with the keyset-paginated feed.
+
+Seeds a temporary database (100k blogs by default) and reports p50/p99
+latency and response size for the full dump, the first page, a deep page
+and a conditional request answered with 304. Then checks that a blog
+written by another process, as another gunicorn worker would, changes the
+ETag. Exits 1 if it doesn't.
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+from benchmarks.common import use_temp_database, seed_blogs, time_calls, print_latency, make_app
+
+use_temp_database()
+
+from flask import jsonify  # noqa: E402
+from models import db, Blog, User  # noqa: E402
+
+app = make_app()
+
+
+def legacy_get_blogs():
+    """The original endpoint: join every blog to its user and return them all."""
+    blogs = db.session.query(Blog, User).join(User, Blog.user_id == User.id).all()
+    blogs_data = [{'id': blog.id, 'title': blog.title, 'content': blog.content, 'username': user.display_name, 'user_id': blog.user_id} for blog, user in blogs]
+    return jsonify(blogs=blogs_data, current_user_id=None)
+
+
+app.add_url_rule('/legacy_get_blogs', 'legacy_get_blogs', legacy_get_blogs)
+
+
+WRITE_IN_ANOTHER_PROCESS = """
+from app import create_app
+from models import db, Blog
+with create_app().app_context():
+    db.session.add(Blog(title='Elsewhere', content='written by another worker', user_id=1))
+    db.session.commit()
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--blogs', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--legacy-repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with app.app_context():
+        seed_blogs(db, args.blogs)
+    client = app.test_client()
+
+    def run(label, url, repeat, headers=None):
+        sizes = []
+
+        def call():
+            response = client.get(url, headers=headers)
+            sizes.append(len(response.data))
+            return response
+
+        timings = time_calls(call, repeat)
+        print_latency(label, timings, f"bytes={sizes[-1]}")
+
+    print(f"{args.blogs} blogs")
+    run('legacy /get_blogs (everything)', '/legacy_get_blogs', args.legacy_repeat)
+    run('paginated first page', '/get_blogs', args.repeat)
+    run('paginated first page, summary=200', '/get_blogs?summary=200', args.repeat)
+    run('paginated deep page', f'/get_blogs?cursor={args.blogs // 2}', args.repeat)
+
+    etag = client.get('/get_blogs').headers['ETag']
+    run('conditional request (304)', '/get_blogs', args.repeat, headers={'If-None-Match': etag})
+    print()
+
+    # Another worker process writes a blog; this one must stop answering 304
+    subprocess.run([sys.executable, '-c', WRITE_IN_ANOTHER_PROCESS], check=True, env=dict(os.environ),
+                   cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    status = client.get('/get_blogs', headers={'If-None-Match': etag}).status_code
+    print(f"{'ok  ' if status == 200 else 'FAIL'} a blog written by another process changes the ETag ({status})")
+    refused = [client.get(f'/get_blogs?summary={length}').status_code for length in (0, -1)]
+    print(f"{'ok  ' if refused == [400, 400] else 'FAIL'} summary=0 and summary=-1 are refused ({refused})")
+    if status != 200 or refused != [400, 400]:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+"""Build time and tile latency of the drought impact hexagon bins.
+
+Generates --points synthetic impact sites clustered over Canada (with
+S/L/SL impact codes), then:
+
+* times the projection and the binning of every zoom in HEX_ZOOMS, and
+  saving and reloading the .npz
+* builds the pyramid the way the app does, from a spatial.FeatureIndex
+* requests --requests /clusters tiles around random sites at zooms 2-18
+  through the test client, cold and again from the render cache
+
+and checks that every level accounts for every point, that each point
+lands in the hexagon whose centre is nearest, that dominant classes match
+a brute-force count and that the tiles of a zoom together hold every cell
+exactly once. Exits 1 if a check fails.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.common import make_app, percentile, use_temp_database
+
+use_temp_database()
+os.environ['PYRAMID_DIR'] = tempfile.mkdtemp(prefix='bench-hexbins-')
+
+import shapely  # noqa: E402
+
+import hexbins  # noqa: E402
+import layer_cache  # noqa: E402
+import spatial  # noqa: E402
+
+app = make_app()
+
+CLASSES = np.array(['S', 'L', 'SL'])
+
+
+def synthetic_sites(n, seed):
+    """(lon/lat array, impact codes) for n sites in clusters over southern Canada."""
+    rng = np.random.default_rng(seed)
+    centers = np.column_stack([rng.uniform(-130, -60, 60), rng.uniform(43, 60, 60)])
+    spread = rng.uniform(0.05, 3, 60)
+    cluster = rng.integers(0, len(centers), n)
+    lonlat = centers[cluster] + rng.normal(size=(n, 2)) * spread[cluster, None]
+    # Each cluster leans towards one class, so dominant classes vary across the map
+    lean = rng.integers(0, 3, len(centers))
+    impacts = np.where(rng.random(n) < 0.6, lean[cluster], rng.integers(0, 3, n))
+    return lonlat, CLASSES[impacts]
+
+
+def nearest_centre_ok(level, xy):
+    """Whether each point's hexagon centre is at least as near as those of its six neighbours."""
+    q, r = hexbins.hex_cells(xy, level.size)
+    own = np.hypot(*(hexbins.hex_centers(q, r, level.size) - xy).T)
+    for dq, dr in ((1, 0), (-1, 0), (0, 1), (0, -1), (1, -1), (-1, 1)):
+        other = np.hypot(*(hexbins.hex_centers(q + dq, r + dr, level.size) - xy).T)
+        if np.any(own > other + 1e-6):
+            return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--points', type=int, default=1_000_000)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    failures = []
+
+    def check(condition, message):
+        print(f"{'ok  ' if condition else 'FAIL'} {message}")
+        if not condition:
+            failures.append(message)
+
+    lonlat, impacts = synthetic_sites(args.points, args.seed)
+
+    start = time.perf_counter()
+    xy = hexbins.lonlat_to_web_mercator(lonlat)
+    project_seconds = time.perf_counter() - start
+    classes, codes = np.unique(impacts, return_inverse=True)
+    levels, build_seconds = {}, {}
+    for zoom in hexbins.HEX_ZOOMS:
+        start = time.perf_counter()
+        levels[zoom] = hexbins.HexLevel.build(zoom, xy, codes, len(classes))
+        build_seconds[zoom] = time.perf_counter() - start
+    built = hexbins.HexPyramid(classes, levels)
+
+    # The app builds from the drought FeatureIndex; a placeholder file stands in for the GeoJSON
+    fd, source = tempfile.mkstemp(suffix='.geojson', prefix='bench-drought-')
+    os.close(fd)
+    spatial.LAYER_SOURCES['drought_impact'] = source
+    start = time.perf_counter()
+    index = spatial.FeatureIndex(layer_cache.LayerData(shapely.points(lonlat), [{'IMPACT': code} for code in impacts],
+                                                       list(range(args.points))))
+    index_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    hexbins.rebuild(index)
+    rebuild_seconds = time.perf_counter() - start
+    size = os.path.getsize(hexbins.cache_path())
+    start = time.perf_counter()
+    loaded = hexbins.HexPyramid.load(hexbins.cache_path(), os.stat(source))
+    load_seconds = time.perf_counter() - start
+
+    print(f"{args.points:,d} points; projection {project_seconds * 1000:.0f}ms")
+    print(f"{'zoom':>4} {'hex km':>8} {'cells':>10} {'largest':>8} {'build':>9}")
+    for zoom, level in levels.items():
+        print(f"{zoom:4d} {level.size * hexbins.SQRT3 / 1000:8.2f} {len(level.counts):10,d} {level.max_count:8,d} "
+              f"{build_seconds[zoom] * 1000:7.0f}ms")
+    print(f"all levels {sum(build_seconds.values()):.2f}s; from a FeatureIndex (built in {index_seconds:.2f}s) "
+          f"including save {rebuild_seconds:.2f}s; {size:,d} bytes on disk, reloaded in {load_seconds * 1000:.0f}ms")
+    print()
+
+    check(all(int(level.counts.sum()) == args.points for level in levels.values()),
+          f"every level counts all {args.points:,d} points")
+    sample = np.random.default_rng(args.seed).choice(args.points, 20000, replace=False)
+    check(all(nearest_centre_ok(level, xy[sample]) for level in levels.values()),
+          "sampled points fall in the hexagon with the nearest centre at every zoom")
+    level = levels[6]
+    q, r = hexbins.hex_cells(xy, level.size)
+    busiest = np.argsort(level.counts)[-20:]
+    dominant_ok = True
+    for cell in busiest:
+        inside = (q == level.q[cell]) & (r == level.r[cell])
+        counts = np.bincount(codes[inside], minlength=len(classes))
+        dominant_ok &= bool((counts == level.class_counts[cell]).all() and counts.argmax() == level.dominant[cell])
+    check(dominant_ok, "class counts and dominant class of the 20 busiest z6 cells match a brute-force count")
+    check(all(np.array_equal(loaded.levels[z].class_counts, built.levels[z].class_counts)
+              and np.array_equal(loaded.levels[z].q, built.levels[z].q) for z in levels),
+          "the pyramid built from the FeatureIndex, saved and reloaded, matches the direct build")
+
+    client = app.test_client()
+    features = 0
+    for x in range(8):
+        for y in range(8):
+            response = client.get(f'/clusters/drought_impact/3/{x}/{y}')
+            tile = response.get_json()
+            features += sum(feature['properties']['count'] for feature in tile['features'])
+    check(features == args.points, f"the 64 z3 tiles hold {features:,d} sites between them")
+    check(client.get('/clusters/drought_impact/3/8/0').status_code == 404, "tiles outside the grid are 404")
+
+    # Tiles around random sites, as a user panning and zooming over the data would request them
+    rng = np.random.default_rng(args.seed + 1)
+    requests_ = []
+    for _ in range(args.requests):
+        z = int(rng.integers(2, 19))
+        lon, lat = lonlat[rng.integers(args.points)]
+        n = 2 ** z
+        x = int((lon + 180) / 360 * n)
+        y = int((1 - np.arcsinh(np.tan(np.radians(lat))) / np.pi) / 2 * n)
+        requests_.append(f'/clusters/drought_impact/{z}/{x}/{y}')
+    hexbins._render_tile.cache_clear()
+    print(f"{'pass':<6} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8} {'largest tile':>13} {'hexagons':>9}")
+    for label in ('cold', 'warm'):
+        times, largest, most = [], 0, 0
+        for url in requests_:
+            start = time.perf_counter()
+            response = client.get(url)
+            times.append((time.perf_counter() - start) * 1000)
+            largest = max(largest, len(response.data))
+            if label == 'cold':
+                most = max(most, len(response.get_json()['features']))
+        print(f"{label:<6} {percentile(times, 50):6.2f}ms {percentile(times, 95):6.2f}ms {percentile(times, 99):6.2f}ms "
+              f"{max(times):6.2f}ms {largest:13,d} {most if label == 'cold' else '':>9}")
+        if label == 'cold':
+            cold_p95, cold_most = percentile(times, 95), most
+    print()
+    check(cold_p95 < 50, f"cold tile p95 {cold_p95:.1f}ms")
+    check(cold_most <= 64, f"at most {cold_most} hexagons in one tile")
+
+    os.remove(source)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
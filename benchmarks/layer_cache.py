@@ -0,0 +1,84 @@
+"""Cold-start load time and peak RSS: GeoJSON versus the binary layer cache.
+
+Writes a synthetic priority species layer of about --megabytes, builds its
+layer_cache file, then loads the layer in fresh subprocesses three ways:
+
+* json     json.load + preprocess_species_data, then shapes from the dicts (the original loader)
+* stream   the streaming GeoJSON pipeline (what runs when the cache is stale)
+* cache    layer_cache.load_layer with a fresh cache file
+
+Each subprocess is a new interpreter, but the OS page cache is warm, so the
+numbers measure parsing and decoding rather than disk reads. The cache's
+peak includes its memory-mapped file pages, which are released (and
+shared with the page cache) once the load finishes.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+from shapely.geometry import shape
+
+from benchmarks.common import current_rss_mb, peak_rss_mb
+from benchmarks.geojson_stream import synthetic_species
+from geojson_stream import write_feature_collection
+import layer_cache
+import map as map_builder
+
+MODES = ['json', 'stream', 'cache']
+
+
+def run_mode(mode):
+    if mode == 'json':
+        data = map_builder.preprocess_species_data(map_builder.load_local_geojson(map_builder.PRIORITY_SPECIES_FILE_PATH))
+        geometries = np.array([shape(feature['geometry']) for feature in data['features']], dtype=object)
+        return geometries
+    if mode == 'stream':
+        return layer_cache.layer_from_features(map_builder.stream_species_features()).geometries
+    if mode == 'cache':
+        return map_builder.load_species_layer().geometries
+    raise ValueError(mode)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--megabytes', type=int, default=200)
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        start = time.perf_counter()
+        data = run_mode(args.worker)
+        print(json.dumps({'features': len(data), 'seconds': time.perf_counter() - start,
+                          'peak_rss_mb': peak_rss_mb(), 'rss_mb': current_rss_mb()}))
+        return
+
+    repo = os.getcwd()
+    os.chdir(tempfile.mkdtemp(prefix='bench-layer-cache-'))
+    os.makedirs('static')
+    count = write_feature_collection(synthetic_species(args.megabytes * 1024 * 1024),
+                                     map_builder.PRIORITY_SPECIES_FILE_PATH)
+    start = time.perf_counter()
+    map_builder.load_species_layer()
+    print(f"{count:,} features: GeoJSON {os.path.getsize(map_builder.PRIORITY_SPECIES_FILE_PATH) / 2 ** 20:,.0f} MB, "
+          f"cache {os.path.getsize(layer_cache.cache_path('priority_species')) / 2 ** 20:,.0f} MB "
+          f"(built in {time.perf_counter() - start:.1f}s)")
+
+    env = dict(os.environ, PYTHONPATH=repo)
+    for mode in MODES:
+        result = subprocess.run([sys.executable, '-m', 'benchmarks.layer_cache', '--worker', mode],
+                                capture_output=True, text=True, env=env)
+        if result.returncode != 0:
+            print(f"{mode:<7} failed: {result.stderr.strip().splitlines()[-1]}")
+            continue
+        stats = json.loads(result.stdout.strip().splitlines()[-1])
+        print(f"{mode:<7} load {stats['seconds']:7.2f}s  peak RSS {stats['peak_rss_mb']:7.0f} MB  "
+              f"RSS after load {stats['rss_mb']:7.0f} MB  {stats['features']:,} features")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,257 @@
+"""Throughput and latency under gunicorn, from 1 to N worker processes.
+
+Seeds a temporary database, then for each --workers count starts
+gunicorn (gunicorn.conf.py, --threads threads per worker), waits for
+/readyz and drives it for --seconds with --concurrency keep-alive
+connections from a small asyncio HTTP client, spread over --clients
+processes so the client isn't the bottleneck. Each request is picked at
+random from a weighted mix of /get_blogs, /map and /login (a seeded user
+with the right password; the login rate limiter is turned off so every
+attempt is hashed).
+
+    python -m benchmarks.load_test --workers 1,2,4,8 --concurrency 64
+
+If the map hasn't been generated a stand-in page of --map-kb KB is
+served. Also checks that create_app leaves the schema alone and that
+/readyz reports an unmigrated database. Exits 1 if a check fails.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+from benchmarks.common import make_app, percentile, seed_blogs, use_temp_database
+
+use_temp_database()
+
+import map as map_builder  # noqa: E402
+import migrations  # noqa: E402
+from models import db  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PASSWORD = 'benchmark1'
+N_USERS = 100
+
+
+def scenario(weights):
+    """(name, method, path, body) requests in proportion to weights."""
+    requests_ = [('/get_blogs', 'GET', '/get_blogs', None), ('/map', 'GET', '/map', None)]
+    requests_ += [('/login', 'POST', '/login', json.dumps({'display_name': f'user{i}', 'password': PASSWORD}).encode())
+                  for i in range(N_USERS)]
+    logins = weights['/login'] / N_USERS
+    return requests_, [weights['/get_blogs'], weights['/map']] + [logins] * N_USERS
+
+
+async def _request(reader, writer, method, path, body):
+    """Send one request on a keep-alive connection; returns (status, body bytes, keep alive)."""
+    head = f'{method} {path} HTTP/1.1\r\nHost: localhost\r\nAccept-Encoding: gzip, br\r\n'
+    if body is not None:
+        head += f'Content-Type: application/json\r\nContent-Length: {len(body)}\r\n'
+    writer.write(head.encode() + b'\r\n' + (body or b''))
+    status = int((await reader.readline()).split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    if 'content-length' in headers:
+        size = int(headers['content-length'])
+        await reader.readexactly(size)
+    elif headers.get('transfer-encoding') == 'chunked':
+        size = 0
+        while True:
+            chunk = int((await reader.readline()).strip(), 16)
+            await reader.readexactly(chunk + 2)
+            size += chunk
+            if chunk == 0:
+                break
+    else:
+        size = len(await reader.read())
+        headers['connection'] = 'close'
+    return status, size, headers.get('connection', '').lower() != 'close'
+
+
+async def _connection(port, deadline, weights, results, seed):
+    rng = random.Random(seed)
+    requests_, request_weights = scenario(weights)
+    reader = writer = None
+    while time.perf_counter() < deadline:
+        name, method, path, body = rng.choices(requests_, request_weights)[0]
+        start = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            status, size, keep_alive = await _request(reader, writer, method, path, body)
+        except (OSError, ValueError, IndexError, asyncio.IncompleteReadError):
+            status, size, keep_alive = 'error', 0, False
+        results.append((name, status, (time.perf_counter() - start) * 1000, size))
+        if not keep_alive and writer is not None:
+            writer.close()
+            reader = writer = None
+    if writer is not None:
+        writer.close()
+
+
+def run_client(port, connections, seconds, weights, seed):
+    """One client process: connections concurrent keep-alive loops. Returns the request log."""
+    results = []
+
+    async def main():
+        deadline = time.perf_counter() + seconds
+        await asyncio.gather(*(_connection(port, deadline, weights, results, seed * 1000 + i)
+                               for i in range(connections)))
+    asyncio.run(main())
+    return results
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(workers, threads, log):
+    port = free_port()
+    wsgi = "app:create_app({'LOGIN_RATE_LIMIT': False})"
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '-w', str(workers),
+                               '--threads', str(threads), '-b', f'127.0.0.1:{port}', wsgi],
+                              cwd=ROOT, stdout=log, stderr=log)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f'http://127.0.0.1:{port}/readyz', timeout=1).status_code == 200:
+                return server, port
+        except requests.ConnectionError:
+            pass
+        if server.poll() is not None:
+            break
+        time.sleep(0.2)
+    server.kill()
+    raise RuntimeError(f'gunicorn with {workers} workers did not become ready; see {log.name}')
+
+
+def stop_server(server):
+    server.send_signal(signal.SIGTERM)  # graceful: workers finish their requests
+    server.wait(timeout=60)
+
+
+def load(port, args, weights):
+    per_client = max(1, args.concurrency // args.clients)
+    with multiprocessing.Pool(args.clients) as pool:
+        # Warm up the workers (page cache, connection pools) before measuring
+        pool.starmap(run_client, [(port, per_client, 1, weights, i) for i in range(args.clients)])
+        logs = pool.starmap(run_client, [(port, per_client, args.seconds, weights, i + 100)
+                                         for i in range(args.clients)])
+    return [record for log in logs for record in log]
+
+
+def summarize(records, seconds):
+    """Per endpoint: (requests/s, error count, p50, p95, p99)."""
+    summary = {}
+    for name in sorted({record[0] for record in records}) + ['all']:
+        selected = [r for r in records if name in ('all', r[0])]
+        ok = [r[2] for r in selected if r[1] == 200]
+        errors = len(selected) - len(ok)
+        summary[name] = (len(ok) / seconds, errors) + ((percentile(ok, 50), percentile(ok, 95), percentile(ok, 99))
+                                                       if ok else (0, 0, 0))
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', default=f'1,{multiprocessing.cpu_count()}',
+                        help='comma-separated gunicorn worker counts')
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--clients', type=int, default=max(1, min(4, multiprocessing.cpu_count() // 2)))
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--blogs', type=int, default=2000)
+    parser.add_argument('--mix', default='/get_blogs=70,/map=20,/login=10',
+                        help='request weights')
+    parser.add_argument('--map-kb', type=int, default=500)
+    args = parser.parse_args()
+    weights = {name: float(weight) for name, weight in (item.split('=') for item in args.mix.split(','))}
+    worker_counts = sorted({int(n) for n in args.workers.split(',')})
+
+    failures = []
+
+    def check(condition, message):
+        print(f"{'ok  ' if condition else 'FAIL'} {message}")
+        if not condition:
+            failures.append(message)
+
+    # Creating the app no longer creates tables; /readyz says so until the migration runs
+    fd, unmigrated = tempfile.mkstemp(suffix='.db', prefix='bench-unmigrated-')
+    os.close(fd)
+    from app import create_app
+    fresh = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + unmigrated})
+    with fresh.app_context():
+        missing = migrations.missing_tables()
+    client = fresh.test_client()
+    not_ready = client.get('/readyz')
+    check(missing and not_ready.status_code == 503 and client.get('/healthz').status_code == 200,
+          f"unmigrated database: /healthz 200, /readyz {not_ready.status_code} ({not_ready.get_json()['database']})")
+    with fresh.app_context():
+        migrations.upgrade()
+    check(client.get('/readyz').status_code == 200, "after migrate: /readyz 200")
+    os.remove(unmigrated)
+
+    app = make_app()
+    with app.app_context():
+        seed_blogs(db, args.blogs, n_users=N_USERS)
+    stand_in = None
+    if not os.path.exists(os.path.join(ROOT, map_builder.MAP_OUTPUT_PATH)):
+        fd, stand_in = tempfile.mkstemp(suffix='.html', prefix='bench-map-')
+        with os.fdopen(fd, 'w') as f:
+            f.write('<!DOCTYPE html><html><body><script>var features = [')
+            f.write(',\n'.join(f'{{"type": "Feature", "id": {i}, "geometry": {{"type": "Point", '
+                               f'"coordinates": [-114.{i:06d}, 51.{i * 7:06d}]}}}}'
+                               for i in range(args.map_kb * 1024 // 90)))
+            f.write(']</script></body></html>')
+        os.environ['MAP_OUTPUT_PATH'] = stand_in
+
+    print(f"\n{args.concurrency} connections from {args.clients} client process(es), {args.seconds:g}s per run, "
+          f"{args.threads} threads per worker, mix {args.mix}, {multiprocessing.cpu_count()} CPU(s)")
+    print(f"{'workers':>7} {'endpoint':<11} {'req/s':>8} {'errors':>7} {'p50':>9} {'p95':>9} {'p99':>9}")
+    log = tempfile.NamedTemporaryFile('w', prefix='bench-gunicorn-', suffix='.log', delete=False)
+    totals = {}
+    try:
+        for workers in worker_counts:
+            server, port = start_server(workers, args.threads, log)
+            try:
+                records = load(port, args, weights)
+            finally:
+                stop_server(server)
+            summary = summarize(records, args.seconds)
+            for name, (rate, errors, p50, p95, p99) in summary.items():
+                print(f"{workers:7d} {name:<11} {rate:8.1f} {errors:7d} {p50:7.1f}ms {p95:7.1f}ms {p99:7.1f}ms")
+            totals[workers] = summary['all']
+            check(summary['all'][1] <= len(records) * 0.01,
+                  f"{workers} worker(s): {summary['all'][1]} of {len(records)} requests failed")
+    finally:
+        log.close()
+        if stand_in:
+            os.remove(stand_in)
+
+    base = totals[worker_counts[0]][0]
+    print('\nscaling: ' + ', '.join(f"{workers} worker(s) {rate:.0f} req/s ({rate / base:.2f}x)"
+                                   for workers, (rate, *_) in totals.items()))
+    print(f"gunicorn log: {log.name}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+"""Read latency during a login storm.
+
+Serves the app from a threaded HTTP server, then measures /get_blogs
+latency from --readers threads, first alone and then while --attackers
+threads post /login as fast as they can (right and wrong passwords, a few
+accounts). Three configurations:
+
+* unbounded  one hashing thread per attacker, no rate limit (how logins used to run)
+* pool       PASSWORD_HASH_WORKERS hashing threads, no rate limit
+* limited    the pool plus the per-IP / per-account token buckets
+
+Also checks that a user whose hash was made with old parameters is
+re-hashed with the current method on login, and that only wrong passwords
+use up an account's attempts. Exits 1 if a check fails.
+"""
+import argparse
+import sys
+import threading
+import time
+
+import requests
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from benchmarks.common import percentile, seed_blogs, use_temp_database, make_app
+
+use_temp_database()
+
+from models import db, User  # noqa: E402
+from passwords import password_hasher  # noqa: E402
+from ratelimit import login_limiter  # noqa: E402
+
+app = make_app()
+
+PASSWORD = 'benchmark1'
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log(self, *args):
+        pass
+
+
+def configure(workers, rate_limit, attackers):
+    password_hasher.configure(app.config['PASSWORD_HASH_METHOD'], workers, attackers)
+    app.config['LOGIN_RATE_LIMIT'] = rate_limit
+    login_limiter.init_app(app)
+
+
+def load(base, readers, attackers, seconds):
+    """Return (read latencies in ms, login status counts) for seconds of load."""
+    stop = threading.Event()
+    timings, statuses, lock = [], {}, threading.Lock()
+
+    def reader():
+        session = requests.Session()
+        while not stop.is_set():
+            start = time.perf_counter()
+            session.get(base + '/get_blogs').raise_for_status()
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                timings.append(elapsed)
+
+    def attacker(index):
+        session = requests.Session()
+        n = 0
+        while not stop.is_set():
+            password = PASSWORD if n % 4 == 0 else 'wrong-password'
+            response = session.post(base + '/login', json={'display_name': f'storm{(index + n) % 5}',
+                                                          'password': password})
+            with lock:
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            n += 1
+
+    threads = [threading.Thread(target=reader) for _ in range(readers)]
+    threads += [threading.Thread(target=attacker, args=(i,)) for i in range(attackers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return timings, statuses
+
+
+def report(label, timings, statuses, seconds):
+    logins = ' '.join(f'{status}:{count / seconds:.1f}/s' for status, count in sorted(statuses.items()))
+    print(f"{label:<22} reads/s={len(timings) / seconds:7.1f}  p50={percentile(timings, 50):7.2f}ms  "
+          f"p95={percentile(timings, 95):7.2f}ms  p99={percentile(timings, 99):8.2f}ms  logins {logins or '-'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--blogs', type=int, default=2000)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--attackers', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=8)
+    args = parser.parse_args()
+
+    failures = []
+
+    def check(condition, message):
+        print(f"{'ok  ' if condition else 'FAIL'} {message}")
+        if not condition:
+            failures.append(message)
+
+    with app.app_context():
+        seed_blogs(db, args.blogs)
+        for i in range(5):
+            user = User(display_name=f'storm{i}')
+            user.set_password(PASSWORD)
+            db.session.add(user)
+        db.session.commit()
+
+    server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_port}'
+    workers = app.config['PASSWORD_HASH_WORKERS']
+
+    # Rehash on login: a hash with other parameters is replaced by one made with the current method
+    method = app.config['PASSWORD_HASH_METHOD']
+    password_hasher.configure('pbkdf2:sha256:50000', workers, 64)
+    with app.app_context():
+        legacy = User(display_name='legacy')
+        legacy.set_password(PASSWORD)
+        db.session.add(legacy)
+        db.session.commit()
+    password_hasher.configure(method, workers, 64)
+    ok = requests.post(base + '/login', json={'display_name': 'legacy', 'password': PASSWORD}).json()['success']
+    with app.app_context():
+        stored = User.query.filter_by(display_name='legacy').first().password_hash
+    check(ok and stored.startswith(method + '$') and not password_hasher.needs_rehash(stored),
+          f"pbkdf2 hash re-hashed on login -> {stored.split('$')[0]}")
+
+    # Only wrong passwords count against an account
+    configure(workers, True, 64)
+    owner = [requests.post(base + '/login', json={'display_name': 'storm0', 'password': PASSWORD}).status_code
+             for _ in range(10)]
+    guesses = [requests.post(base + '/login', json={'display_name': 'storm1', 'password': 'wrong'}).status_code
+               for _ in range(6)]
+    check(owner == [200] * 10 and guesses == [200] * 5 + [429],
+          f"10 right passwords: {owner.count(429)} refused; 6 wrong ones: {guesses.count(429)} refused")
+
+    print(f"\n{args.readers} readers, {args.attackers} attackers, {args.seconds:g}s per phase, "
+          f"{method}, {workers} hashing worker(s)")
+    results = {}
+    for mode, pool_workers, rate_limit in [('unbounded', args.attackers, False), ('pool', workers, False),
+                                           ('limited', workers, True)]:
+        configure(pool_workers, rate_limit, args.attackers)
+        quiet, _ = load(base, args.readers, 0, args.seconds / 2)
+        storm, statuses = load(base, args.readers, args.attackers, args.seconds)
+        report(f'{mode}: reads only', quiet, {}, args.seconds / 2)
+        report(f'{mode}: login storm', storm, statuses, args.seconds)
+        results[mode] = (percentile(quiet, 95), percentile(storm, 95), statuses)
+
+    limited_quiet, limited_storm, statuses = results['limited']
+    check(statuses.get(429, 0) > 0, f"rate limiter refused {statuses.get(429, 0)} login attempts")
+    check(limited_storm < results['unbounded'][1],
+          f"read p95 during the storm: {results['unbounded'][1]:.1f}ms unbounded -> {limited_storm:.1f}ms limited")
+    server.shutdown()
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""First-paint weight of the map page: every overlay up front versus lazy layers.
+
+Writes synthetic species and vegetation layers (plus the repository's
+drought impact sites) into a temporary working directory and builds
+map.html with MAP_LAZY_LAYERS off and on, for both MAP_VECTOR_SOURCE
+modes. For each build it replays what a browser fetches before the first
+paint of the initial zoom-4 view: the page, the scripts of the overlays
+shown on open, the vector tiles they request and the WMS and basemap
+tiles. Local responses are fetched through the test client with
+Accept-Encoding: gzip and their bytes counted; WMS and basemap tiles come
+from upstream servers, so only their requests are counted.
+
+Then checks that every overlay is still in the LayerControl, that each
+layer script is served gzipped, immutable and revalidatable, that scripts
+of the previous build stay available and older ones are pruned, and that
+the draw-to-query hook runs after the map exists. Exits 1 if a check fails.
+"""
+import argparse
+import os
+import re
+import shutil
+import sys
+import tempfile
+
+from benchmarks.common import INITIAL_VIEW_TILES, make_app, use_temp_database, write_map_layers
+
+use_temp_database()
+
+import map as map_builder  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GZIP = {'Accept-Encoding': 'gzip'}
+
+app = make_app()
+
+
+def lazy_urls(html):
+    """{layer: script url} of the lazy overlays in a map page."""
+    return dict(re.findall(r'new LazyMapLayer\("(\w+)", "([^"]+)"', html))
+
+
+def first_paint(client, lazy):
+    """(requests, local bytes, upstream tile requests) before the initial view is drawn."""
+    response = client.get('/map', headers=GZIP)
+    with open(map_builder.MAP_OUTPUT_PATH, encoding='utf-8') as f:
+        html = f.read()
+    requests, local_bytes, upstream = 1, len(response.data), 0
+    fragments, _ = map_builder.build_layers()
+    for layer, fragment in zip(map_builder.MAP_LAYERS, fragments):
+        if fragment is None or (lazy and layer.name not in map_builder.MAP_DEFAULT_LAYERS):
+            continue
+        if lazy:
+            requests += 1
+            local_bytes += len(client.get(lazy_urls(html)[layer.name], headers=GZIP).data)
+        script = ''.join(rendered for _, rendered in fragment['script'])
+        if 'L.tileLayer.wms(' in script:
+            upstream += len(INITIAL_VIEW_TILES)
+        for template in re.findall(r'L\.Util\.template\("([^"]+)"', script):
+            for z, x, y in INITIAL_VIEW_TILES:
+                requests += 1
+                local_bytes += len(client.get(template.format(z=z, x=x, y=y)).data)
+    # Basemap tiles, one set per base layer added on open
+    upstream += len(re.findall(r'tile_layer_\w+\.addTo\(map_canada\)', html)) * len(INITIAL_VIEW_TILES)
+    return requests + upstream, local_bytes, upstream, html
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--polygons', type=int, default=300)
+    parser.add_argument('--vertices', type=int, default=2000, help='vertices per polygon')
+    args = parser.parse_args()
+
+    failures = []
+
+    def check(condition, message):
+        print(f"{'ok  ' if condition else 'FAIL'} {message}")
+        if not condition:
+            failures.append(message)
+
+    os.chdir(tempfile.mkdtemp(prefix='bench-map-layers-'))
+    write_map_layers('.', args.polygons, args.vertices)
+    shutil.copy(os.path.join(ROOT, map_builder.DROUGHT_IMPACT_FILE_PATH), map_builder.DROUGHT_IMPACT_FILE_PATH)
+    print(f"{args.polygons} polygons x {args.vertices} vertices per layer; first paint of the zoom-4 view "
+          f"({len(INITIAL_VIEW_TILES)} tiles)")
+    print(f"{'build':<14} {'page':>12} {'requests':>9} {'upstream':>9} {'local bytes':>14}")
+
+    client = app.test_client()
+    results = {}
+    for mode in ('tiles', 'inline'):
+        for lazy in (False, True):
+            map_builder.MAP_VECTOR_SOURCE = mode
+            map_builder.MAP_LAZY_LAYERS = lazy
+            map_builder.create_map()
+            requests, local_bytes, upstream, html = first_paint(client, lazy)
+            results[mode, lazy] = (requests, local_bytes)
+            label = f"{mode} {'lazy' if lazy else 'eager'}"
+            print(f"{label:<14} {len(html.encode()):>12,d} {requests:>9d} {upstream:>9d} {local_bytes:>14,d}")
+    print()
+
+    # What switching each overlay on costs (the inline build, lazy, is the last one made)
+    scripts = lazy_urls(html)
+    print(f"{'layer':<20} {'script':>12} {'gzipped':>10}")
+    for name, url in scripts.items():
+        raw, gzipped = client.get(url).data, client.get(url, headers=GZIP).data
+        print(f"{name:<20} {len(raw):>12,d} {len(gzipped):>10,d}")
+    print()
+
+    for mode in ('tiles', 'inline'):
+        (eager_requests, eager_bytes), (lazy_requests, lazy_bytes) = results[mode, False], results[mode, True]
+        check(lazy_requests < eager_requests and lazy_bytes < eager_bytes,
+              f"{mode}: first paint {eager_requests} -> {lazy_requests} requests, "
+              f"{eager_bytes:,d} -> {lazy_bytes:,d} local bytes")
+
+    layers = [layer.name for layer in map_builder.MAP_LAYERS]
+    check(list(scripts) == layers and all(re.search(rf'"[^"]+" : lazy_layer_{name},', html) for name in layers),
+          f"all {len(layers)} overlays are in the LayerControl")
+    check(html.index("map_canada.on('draw:created', function (e)") > html.index('var map_canada = L.map('),
+          "the draw-to-query hook runs after the map is created")
+
+    url = scripts['priority_species']
+    response = client.get(url, headers=GZIP)
+    check(response.status_code == 200 and response.content_encoding == 'gzip'
+          and 'immutable' in response.headers['Cache-Control']
+          and response.headers['Content-Type'].startswith('text/javascript'),
+          f"{url}: {response.content_encoding}, {response.headers['Cache-Control']}")
+    check(client.get(url, headers=dict(GZIP, **{'If-None-Match': response.get_etag()[0]})).status_code == 304,
+          "layer scripts revalidate with their ETag")
+    check(client.get(map_builder.MAP_LAYER_URL + 'priority_species.0000000000.js').status_code == 404,
+          "unknown scripts are 404")
+
+    # Each build keeps the scripts of the one before, for pages opened before it
+    fragments, _ = map_builder.build_layers()
+    generations = []
+    for i in range(3):
+        fragments[0]['script'].append(['rebuild', f'// build {i}\n'])
+        generations.append(map_builder.write_layer_scripts(fragments)['priority_species'])
+    served = [client.get(url).status_code for url in generations]
+    check(served == [404, 200, 200], f"after three builds the scripts of each answer {served}")
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""Initial map weight with inlined GeoJSON versus tile-loaded overlays.
+
+Writes synthetic national-scale species and vegetation layers (large,
+high-vertex polygons) into a temporary working directory, builds map.html
+in both MAP_VECTOR_SOURCE modes and reports:
+
+* page bytes, and the time to JSON-parse the inlined data (a stand-in for
+  the browser's parse cost before the map becomes interactive);
+* for tiles, the requests, bytes, cold server time and parse time of the
+  tiles covering the initial zoom-4 view of Canada.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from benchmarks.common import INITIAL_VIEW_TILES, use_temp_database, make_app, write_map_layers
+
+use_temp_database()
+
+import map as map_builder  # noqa: E402
+import tiles  # noqa: E402
+
+app = make_app()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--polygons', type=int, default=300)
+    parser.add_argument('--vertices', type=int, default=2000, help='vertices per polygon')
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix='bench-map-'))
+    write_map_layers('.', args.polygons, args.vertices)
+    print(f"{args.polygons} polygons x {args.vertices} vertices per layer")
+
+    for mode in ('inline', 'tiles'):
+        map_builder.MAP_VECTOR_SOURCE = mode
+        start = time.perf_counter()
+        map_builder.create_map(force=True)
+        build = time.perf_counter() - start
+        page_bytes = os.path.getsize(map_builder.MAP_OUTPUT_PATH)
+        print(f"{mode:<7} map.html {page_bytes:>14,} bytes  build {build * 1000:8.0f} ms")
+
+    start = time.perf_counter()
+    for path in (map_builder.PRIORITY_SPECIES_FILE_PATH, map_builder.VEGETATION_ZONES_FILE_PATH):
+        with open(path) as f:
+            json.load(f)
+    print(f"inline  parse of embedded GeoJSON       {(time.perf_counter() - start) * 1000:8.0f} ms")
+
+    client = app.test_client()
+    tiles.reset()
+    for layer in tiles.TILE_SOURCES:
+        tiles.get_index(layer)  # index load happens once at startup, not per page view
+    total_bytes, server_time, parse_time = 0, 0.0, 0.0
+    for layer in tiles.TILE_SOURCES:
+        for z, x, y in INITIAL_VIEW_TILES:
+            start = time.perf_counter()
+            body = client.get(f'/tiles/{layer}/{z}/{x}/{y}').data
+            server_time += time.perf_counter() - start
+            start = time.perf_counter()
+            json.loads(body)
+            parse_time += time.perf_counter() - start
+            total_bytes += len(body)
+    requests = len(INITIAL_VIEW_TILES) * len(tiles.TILE_SOURCES)
+    print(f"tiles   initial view: {requests} requests {total_bytes:>14,} bytes  "
+          f"server {server_time * 1000:8.0f} ms (cold)  parse {parse_time * 1000:6.0f} ms")
+
+
+if __name__ == '__main__':
+    main()
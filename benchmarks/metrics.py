@@ -0,0 +1,127 @@
+"""Cost and correctness of the request metrics.
+
+Times --requests GETs of /get_blogs and /about with METRICS_ENABLED off
+and on (best of --rounds), then checks that:
+
+* the query counts in /metrics match a separate SQLAlchemy event counter
+* a statement slower than SLOW_QUERY_MS is printed and counted
+* /metrics is well-formed Prometheus text
+* sums past a million keep every digit
+* ?__profile=1 returns a cProfile report for an admin and is ignored for others
+
+Exits 1 if a check fails.
+"""
+import argparse
+import contextlib
+import io
+import re
+import sys
+import time
+
+from sqlalchemy import event, text
+
+from benchmarks.common import seed_blogs, use_temp_database, make_app
+
+use_temp_database()
+
+from models import db  # noqa: E402
+from metrics import Histogram, metrics  # noqa: E402
+
+SAMPLE = re.compile(r'^[a-z_]+(\{([a-z]+="[^"]*",?)*\})? -?[0-9.e+-]+$|^[a-z_]+_bucket\{.*le="\+Inf".*\} \d+$')
+
+
+def rate(client, url, n):
+    client.get(url)  # warm up
+    start = time.perf_counter()
+    for _ in range(n):
+        assert client.get(url).status_code == 200
+    return n / (time.perf_counter() - start)
+
+
+def sample(exposition, name, **labels):
+    """The value of one sample from /metrics, or None."""
+    for line in exposition.splitlines():
+        if line.startswith(name + '{') and all(f'{key}="{value}"' in line for key, value in labels.items()):
+            return float(line.rsplit(' ', 1)[1])
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--blogs', type=int, default=2000)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    failures = []
+
+    def check(condition, message):
+        print(f"{'ok  ' if condition else 'FAIL'} {message}")
+        if not condition:
+            failures.append(message)
+
+    plain = make_app({'METRICS_ENABLED': False})
+    with plain.app_context():
+        seed_blogs(db, args.blogs)
+    app = make_app({'METRICS_ADMINS': ['admin'], 'SLOW_QUERY_MS': 50})
+    # Interleaved rounds, best of each, so drift over the run doesn't favour either side
+    results = {}
+    for _ in range(args.rounds):
+        for url in ('/get_blogs', '/about'):
+            for label, instance in (('off', plain), ('on', app)):
+                results[url, label] = max(results.get((url, label), 0), rate(instance.test_client(), url, args.requests))
+
+    print(f"{'endpoint':<12} {'metrics off':>12} {'metrics on':>12} {'overhead':>9}")
+    for url in ('/get_blogs', '/about'):
+        off, on = results[url, 'off'], results[url, 'on']
+        print(f"{url:<12} {off:10.0f}/s {on:10.0f}/s {(1 / on - 1 / off) * 1e6:7.0f}us")
+    print()
+
+    # Query counts agree with an independent counter
+    metrics.reset()
+    counted = []
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', lambda *a: counted.append(1))
+    client = app.test_client()
+    for _ in range(10):
+        client.get('/get_blogs')
+    exposition = client.get('/metrics').get_data(as_text=True)
+    recorded = sample(exposition, 'db_queries_per_request_sum', endpoint='main.get_blogs')
+    check(recorded == len(counted) and sample(exposition, 'http_requests_total', endpoint='main.get_blogs',
+                                             status=200) == 10,
+          f"10 requests: /metrics counted {recorded:g} queries, the event counter {len(counted)}")
+
+    # Slow statements are logged and counted
+    out = io.StringIO()
+    with app.test_request_context('/get_blogs'), contextlib.redirect_stdout(out):
+        app.preprocess_request()
+        db.session.execute(text('WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 2000000) '
+                                'SELECT COUNT(*) FROM n')).scalar()
+    exposition = metrics.render()
+    check('Slow query' in out.getvalue() and sample(exposition, 'db_slow_queries_total', endpoint='main.get_blogs') == 1,
+          f"slow query logged: {out.getvalue().strip()[:80]}...")
+
+    bad = [line for line in exposition.splitlines() if line and not line.startswith('#') and not SAMPLE.match(line)]
+    check(not bad, f"/metrics: {len(exposition.splitlines())} lines, {len(bad)} malformed {bad[:1]}")
+
+    # Cumulative sums keep their precision however large they get
+    histogram = Histogram((1,))
+    for value in (1234567.125, 0.000001):
+        histogram.observe(value)
+    written = float([line for line in histogram.lines('x', 'a="b"') if line.startswith('x_sum')][0].split()[-1])
+    check(written == 1234567.125 + 0.000001, f"a sum of 1234567.125 + 0.000001 is written as {written!r}")
+
+    # Profiling is for admins only
+    for name in ('admin', 'reader'):
+        client = app.test_client()
+        client.post('/signup', json={'display_name': name, 'password': 'benchmark1'})
+        client.post('/login', json={'display_name': name, 'password': 'benchmark1'})
+        response = client.get('/get_blogs?__profile=1')
+        profiled = response.mimetype == 'text/plain' and 'cumulative' in response.get_data(as_text=True)
+        check(profiled == (name == 'admin'), f"?__profile=1 as {name}: {'report' if profiled else 'normal response'}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""Mixed read/write load: threads reading /get_blogs while others create posts.
+
+With no --profile the script runs itself once per storage profile in a
+fresh process (the profile is fixed when the app is created) and prints
+the results side by side:
+
+    python -m benchmarks.mixed_load --readers 8 --writers 4 --seconds 10
+"""
+import argparse
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from benchmarks.common import percentile
+
+PROFILES = ('baseline', 'tuned')
+
+
+def run_profile(args):
+    from benchmarks.common import use_temp_database, seed_blogs, make_app
+    use_temp_database()
+    os.environ['STORAGE_PROFILE'] = args.profile
+
+    from models import db
+    app = make_app()
+
+    with app.app_context():
+        seed_blogs(db, args.blogs)
+
+    stop = threading.Event()
+    read_timings, write_timings, errors = [], [], []
+
+    def reader():
+        client = app.test_client()
+        while not stop.is_set():
+            start = time.perf_counter()
+            response = client.get('/get_blogs')
+            read_timings.append((time.perf_counter() - start) * 1000)
+            if response.status_code != 200:
+                errors.append(response.status_code)
+
+    def writer(index):
+        client = app.test_client()
+        client.post('/signup', json={'display_name': f'writer{index}', 'password': 'benchmark1'})
+        client.post('/login', json={'display_name': f'writer{index}', 'password': 'benchmark1'})
+        while not stop.is_set():
+            start = time.perf_counter()
+            response = client.post('/create_blog', json={'title': 'Load test', 'content': 'x' * 500})
+            write_timings.append((time.perf_counter() - start) * 1000)
+            if response.status_code != 200:
+                errors.append(response.status_code)
+
+    threads = [threading.Thread(target=reader) for _ in range(args.readers)]
+    threads += [threading.Thread(target=writer, args=(i,)) for i in range(args.writers)]
+    for t in threads:
+        t.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+
+    reads, writes = len(read_timings), len(write_timings)
+    print(f"{args.profile:<9} reads/s={reads / args.seconds:8.1f}  read p50={percentile(read_timings or [0], 50):7.2f}ms "
+          f"p99={percentile(read_timings or [0], 99):7.2f}ms  writes/s={writes / args.seconds:7.1f}  "
+          f"write p99={percentile(write_timings or [0], 99):7.2f}ms  errors={len(errors)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--profile', choices=PROFILES)
+    parser.add_argument('--blogs', type=int, default=5000)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=10)
+    args = parser.parse_args()
+
+    if args.profile:
+        run_profile(args)
+        return
+
+    print(f"{args.readers} readers, {args.writers} writers, {args.seconds}s, {args.blogs} seeded blogs")
+    for profile in PROFILES:
+        command = [sys.executable, '-m', 'benchmarks.mixed_load', '--profile', profile,
+                   '--blogs', str(args.blogs), '--readers', str(args.readers),
+                   '--writers', str(args.writers), '--seconds', str(args.seconds)]
+        subprocess.run(command, check=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+"""Background job scheduler checks.
+
+* single-flight: a run overlapping one still going, from another thread or
+  another process, is skipped, and a scheduled run soon after another
+  process's run is too;
+* the scheduler loop runs due jobs and /jobs/stats reports their runs,
+  durations and failures;
+* the generated map page is swapped in atomically: readers polling it while
+  it is rewritten never see a partial file;
+* spatial.refresh() rebuilds only layers whose source file changed, and
+  queries keep being answered from the old index while it does;
+* a refresh run by another process (the scheduler) reaches this one's
+  queries and drought impact tiles without refreshing here, and while one
+  query reloads the layer the others are answered from the old index.
+
+Exits 1 if any check fails.
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.common import use_temp_database, make_app
+
+use_temp_database()
+os.environ['SCHEDULER_LOCK_DIR'] = tempfile.mkdtemp(prefix='bench-jobs-')
+os.environ['LAYER_CACHE_DIR'] = tempfile.mkdtemp(prefix='bench-jobs-layers-')
+os.environ['PYRAMID_DIR'] = tempfile.mkdtemp(prefix='bench-jobs-pyramids-')
+
+import hexbins  # noqa: E402
+import map as map_builder  # noqa: E402
+import spatial  # noqa: E402
+from scheduler import Job, Scheduler  # noqa: E402
+
+app = make_app()
+
+SLOW_SECONDS = 0.5
+
+
+def slow_job():
+    time.sleep(SLOW_SECONDS)
+    return {'slept': SLOW_SECONDS}
+
+
+def failing_job():
+    raise RuntimeError("upstream unavailable")
+
+
+TEST_JOBS = [Job('slow', slow_job), Job('failing', failing_job)]
+
+
+def make_scheduler(intervals):
+    app.config['SCHEDULER_INTERVALS'] = intervals
+    return Scheduler(app, TEST_JOBS)
+
+
+# The scheduler's refresh, in a process of its own; argv[1] is the drought source
+REFRESH_IN_ANOTHER_PROCESS = """
+import sys
+import spatial
+spatial.DROUGHT_IMPACT_FILE_PATH = spatial.LAYER_SOURCES['drought_impact'] = sys.argv[1]
+print(spatial.refresh(), end='')
+"""
+
+
+def drought_collection(n, offset=0):
+    return {'type': 'FeatureCollection', 'features': [
+        {'type': 'Feature', 'id': i, 'properties': {'OBJECTID': i, 'IMPACT': 'D1'},
+         'geometry': {'type': 'Point', 'coordinates': [-114 + offset + i * 0.01, 51]}} for i in range(n)]}
+
+
+def main():
+    failures = []
+
+    def check(condition, message):
+        print(f"{'ok  ' if condition else 'FAIL'} {message}")
+        if not condition:
+            failures.append(message)
+
+    # Single-flight within a process
+    scheduler = make_scheduler({'slow': 3600, 'failing': 3600})
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(scheduler.run('slow'))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    ran = [result for result in results if result is not None]
+    check(len(ran) == 1 and scheduler.stats()['slow']['skipped'] == 3,
+          f"4 overlapping runs in one process -> {len(ran)} ran, {scheduler.stats()['slow']['skipped']} skipped")
+
+    # Single-flight across processes: another process holds the job's lock
+    holder = subprocess.Popen([sys.executable, '-c', (
+        'import fcntl, sys, time; f = open(sys.argv[1], "a"); fcntl.flock(f, fcntl.LOCK_EX); '
+        'print("locked", flush=True); time.sleep(2)'), scheduler._locks['slow'].path], stdout=subprocess.PIPE, text=True)
+    holder.stdout.readline()
+    check(scheduler.run('slow') is None, "run while another process holds the lock -> skipped")
+    holder.wait()
+
+    # A scheduled run right after any process's run is skipped; a manual one isn't
+    check(scheduler.run('slow', scheduled=True) is None and scheduler.run('slow') is not None,
+          "scheduled run within the interval of the last run skipped, manual run allowed")
+
+    # The loop runs due jobs and the stats endpoint reports them
+    scheduler = make_scheduler({'slow': 0.3, 'failing': 0.3})
+    for name in scheduler.jobs:
+        if os.path.exists(scheduler._status_path(name)):
+            os.remove(scheduler._status_path(name))
+    scheduler.start()
+    time.sleep(2)
+    scheduler.stop()
+    stats = scheduler.stats()
+    check(stats['slow']['runs'] >= 2 and stats['slow']['succeeded'] == stats['slow']['runs'],
+          f"loop ran 'slow' {stats['slow']['runs']} times in 2s, mean {stats['slow']['mean_seconds']:.2f}s")
+    check(stats['failing']['failed'] >= 2 and 'upstream unavailable' in stats['failing']['last']['error'],
+          f"failing job recorded {stats['failing']['failed']} failures: {stats['failing']['last']['error']}")
+    response = app.test_client().get('/jobs/stats')
+    check(response.status_code == 200 and set(response.get_json()) == {'scrape_news', 'rebuild_layers', 'regenerate_map'},
+          f"/jobs/stats lists {sorted(response.get_json())}")
+
+    # Atomic swap: readers never see a half-written page
+    page = os.path.join(tempfile.mkdtemp(prefix='bench-jobs-page-'), 'map.html')
+    marker = '</html>\n'
+
+    def write_slowly(f, n):
+        for _ in range(200):
+            f.write(f'<p>{n}</p>' * 500)
+            f.flush()
+        f.write(marker)
+
+    map_builder._write_atomic(page, lambda f: write_slowly(f, 0))
+    partial, reads, stop = [], [0], threading.Event()
+
+    def reader():
+        while not stop.is_set():
+            with open(page) as f:
+                if not f.read().endswith(marker):
+                    partial.append(1)
+            reads[0] += 1
+
+    readers = [threading.Thread(target=reader) for _ in range(4)]
+    for thread in readers:
+        thread.start()
+    for n in range(1, 20):
+        map_builder._write_atomic(page, lambda f: write_slowly(f, n))
+    stop.set()
+    for thread in readers:
+        thread.join()
+    leftovers = [name for name in os.listdir(os.path.dirname(page)) if name.endswith('.tmp')]
+    check(not partial and not leftovers, f"{reads[0]} reads during 19 rewrites, {len(partial)} partial, "
+                                         f"{len(leftovers)} temp files left")
+
+    # Layer refresh: only changed sources are rebuilt, and queries are answered meanwhile
+    source = os.path.join(tempfile.mkdtemp(prefix='bench-jobs-src-'), 'drought.geojson')
+    with open(source, 'w') as f:
+        json.dump(drought_collection(1000), f)
+    spatial.DROUGHT_IMPACT_FILE_PATH = spatial.LAYER_SOURCES['drought_impact'] = source
+    spatial.reset()
+    area = {'type': 'Polygon', 'coordinates': [[[-115.005, 50], [-100.005, 50], [-100.005, 52], [-115.005, 52], [-115.005, 50]]]}
+    with app.app_context():
+        first = spatial.refresh()
+        second = spatial.refresh()
+        check('drought_impact' in first and second == [], f"first refresh rebuilt {first}, second {second}")
+        before = spatial.query(spatial.parse_geometry(area), ['drought_impact'])['drought_impact']['count']
+
+        with open(source, 'w') as f:
+            json.dump(drought_collection(2000, offset=-5), f)
+        answered = []
+        refresher = threading.Thread(target=lambda: answered.append(spatial.refresh()))
+        refresher.start()
+        while not spatial._build_locks['drought_impact'].locked() and refresher.is_alive():
+            time.sleep(0.001)  # let the refresh get to the changed layer before querying it
+        counts = set()
+        while refresher.is_alive():
+            counts.add(spatial.query(spatial.parse_geometry(area), ['drought_impact'])['drought_impact']['count'])
+        refresher.join()
+        after = spatial.query(spatial.parse_geometry(area), ['drought_impact'])['drought_impact']['count']
+    check(answered == [['drought_impact']] and before == 1000 and after == 1500,
+          f"changed source -> rebuilt {answered[0]}, matches {before} -> {after}")
+    check(counts <= {before, after}, f"queries during the rebuild saw {sorted(counts)}")
+
+    # The web workers never run refresh() themselves
+    def tile_sites():
+        tile = json.loads(hexbins.render_tile(0, 0, 0))
+        return sum(feature['properties']['count'] for feature in tile['features'])
+
+    with app.app_context():
+        sites_before = tile_sites()
+    with open(source, 'w') as f:
+        json.dump(drought_collection(1200, offset=-10), f)
+    refreshed = subprocess.run([sys.executable, '-c', REFRESH_IN_ANOTHER_PROCESS, source], env=dict(os.environ),
+                               cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                               capture_output=True, text=True, check=True).stdout.splitlines()[-1]
+    with app.app_context():
+        elsewhere = spatial.query(spatial.parse_geometry(area), ['drought_impact'])['drought_impact']['count']
+        sites_after = tile_sites()
+    check(elsewhere == 300 and (sites_before, sites_after) == (2000, 1200),
+          f"refresh in another process ({refreshed}) -> matches {after} -> {elsewhere}, "
+          f"tile sites {sites_before} -> {sites_after}")
+
+    # A worker reloading a changed layer keeps answering other queries from the old index
+    with open(source, 'w') as f:
+        json.dump(drought_collection(20000, offset=-100), f)
+    with app.app_context():
+        reloaded, started = [], time.perf_counter()
+        reloader = threading.Thread(target=lambda: reloaded.append(spatial.get_index('drought_impact')))
+        reloader.start()
+        while not spatial._build_locks['drought_impact'].locked() and reloader.is_alive():
+            time.sleep(0.001)
+        counts, slowest = set(), 0
+        while reloader.is_alive():
+            start = time.perf_counter()
+            counts.add(spatial.query(spatial.parse_geometry(area), ['drought_impact'])['drought_impact']['count'])
+            slowest = max(slowest, time.perf_counter() - start)
+        reloader.join()
+        reload_seconds = time.perf_counter() - started
+        latest = spatial.query(spatial.parse_geometry(area), ['drought_impact'])['drought_impact']['count']
+    check(counts <= {elsewhere, latest} and elsewhere in counts and latest == 1500 and slowest < reload_seconds / 2,
+          f"during a {reload_seconds * 1000:.0f}ms reload, queries saw {sorted(counts)}, "
+          f"slowest {slowest * 1000:.1f}ms; then {latest}")
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
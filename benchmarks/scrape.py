@@ -0,0 +1,207 @@
+"""News scraper against a local stand-in newsroom.
+
+Starts a small HTTP server that serves a listing page in the newsroom's
+markup and one page per article after --latency ms, with ETags honoured on
+every page and a 503 on the first request for one article. Then:
+
+* checks that a first run stores every recent article (retrying the 503),
+  skips articles older than RECENT_DAYS, that a rerun costs one 304 on the
+  listing, and that after new articles are posted only those are fetched;
+* times the old approach (bare requests.get per article, one after another)
+  against scrape_news() with a pooled session and --workers threads.
+
+Exits 1 if any check fails.
+"""
+import argparse
+import hashlib
+import sys
+import threading
+import time
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from bs4 import BeautifulSoup
+
+from benchmarks.common import use_temp_database, make_app
+
+use_temp_database()
+
+from models import db, NewsArticle, ScrapedPage  # noqa: E402
+import scrape  # noqa: E402
+
+app = make_app()
+
+FLAKY_ARTICLE = 3
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, articles, latency, old_articles=5):
+        super().__init__(('127.0.0.1', 0), StandInHandler)
+        self.articles = articles
+        self.old_articles = old_articles
+        self.latency = latency
+        self.requests = {}
+        self.flaky = {FLAKY_ARTICLE}
+        self.lock = threading.Lock()
+
+    def count(self, path, status):
+        with self.lock:
+            self.requests[(path, status)] = self.requests.get((path, status), 0) + 1
+
+    def total(self, status=None, prefix=''):
+        with self.lock:
+            return sum(n for (path, s), n in self.requests.items()
+                       if (status is None or s == status) and path.startswith(prefix))
+
+    def published(self, i):
+        """Article i was posted (articles - 1 - i) // 4 days ago; the old ones at the end, 200 days ago."""
+        if i >= self.articles:
+            return date.today() - timedelta(days=200)
+        return date.today() - timedelta(days=(self.articles - 1 - i) // 4)
+
+    def listing(self):
+        items = []
+        for i in reversed(range(self.articles + self.old_articles)):
+            published = self.published(i)
+            items.append(f'<li class="pp_item"><div class="pp_date"><div class="pp_date_day">{published.day}</div>'
+                         f'<div class="pp_date_month">{published.strftime("%b")}</div></div>'
+                         f'<div class="pp_title"><a class="td_headlines" href="/news/{i}">Police update {i}</a>'
+                         f'</div></li>')
+        return f'<html><body><ul>{"".join(items)}</ul></body></html>'
+
+    def article(self, i):
+        return (f'<html><head><meta name="date" content="{self.published(i).isoformat()}"></head><body>'
+                f'<div class="pp-overflow-hidden pp-min-width-5"><p>Officers responded to call {i}.</p>'
+                f'<p>{"Details follow. " * 40}</p></div></body></html>')
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        if self.path == '/newsroom':
+            body = self.server.listing()
+        elif self.path.startswith('/news/') and self.path[6:].isdigit():
+            i = int(self.path[6:])
+            with self.server.lock:
+                flaky = i in self.server.flaky
+                self.server.flaky.discard(i)
+            if flaky:
+                return self.reply(503, b'')
+            body = self.server.article(i)
+        else:
+            return self.reply(404, b'')
+        body = body.encode()
+        etag = '"' + hashlib.md5(body).hexdigest() + '"'
+        if self.headers.get('If-None-Match') == etag:
+            return self.reply(304, b'', etag)
+        self.reply(200, body, etag)
+
+    def reply(self, status, body, etag=None):
+        # Counted first: a client can see the whole response as soon as the headers are flushed
+        self.server.count(self.path, status)
+        self.send_response(status)
+        if etag:
+            self.send_header('ETag', etag)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def sequential_scrape(listing_url):
+    """The old scrape.py: bare requests.get for the listing and then each article in turn."""
+    soup = BeautifulSoup(requests.get(listing_url).content, 'html.parser')
+    articles = []
+    for headline in soup.find_all('a', class_='td_headlines'):
+        url = requests.compat.urljoin(listing_url, headline['href'])
+        response = requests.get(url)
+        if response.status_code == 200:
+            articles.append(scrape.parse_article(response.content))
+    return articles
+
+
+def clear_store():
+    NewsArticle.query.delete()
+    ScrapedPage.query.delete()
+    db.session.commit()
+    db.session.expunge_all()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--articles', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=scrape.MAX_WORKERS)
+    parser.add_argument('--latency', type=float, default=50, help='stand-in server latency in ms')
+    args = parser.parse_args()
+
+    server = StandInServer(args.articles, args.latency / 1000)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    listing_url = f'http://127.0.0.1:{server.server_address[1]}/newsroom'
+    failures = []
+
+    def check(condition, message):
+        print(f"{'ok  ' if condition else 'FAIL'} {message}")
+        if not condition:
+            failures.append(message)
+
+    with app.app_context():
+        clear_store()
+
+        # First run: every recent article is stored, the 503 is retried, year-old articles are skipped
+        report = scrape.scrape_news(listing_url, workers=args.workers)
+        stored = NewsArticle.query.count()
+        check(report['fetched'] == args.articles and stored == args.articles and report['failed'] == 0,
+              f"first run stored {stored} of {args.articles} recent articles, {report['failed']} failed")
+        flaky_url = listing_url.replace('/newsroom', f'/news/{FLAKY_ARTICLE}')
+        check(server.total(503) == 1 and NewsArticle.query.filter_by(url=flaky_url).count() == 1,
+              "article answering 503 once was retried and stored")
+        check(report['listed'] - report['recent'] == server.old_articles,
+              f"{report['listed'] - report['recent']} articles older than {scrape.RECENT_DAYS} days skipped")
+        sample = NewsArticle.query.filter_by(url=listing_url.replace('/newsroom', '/news/0')).first()
+        check(sample is not None and sample.published == server.published(0) and 'call 0' in sample.body,
+              "article title, date and body parsed")
+
+        # Rerun with nothing new: one conditional request for the listing
+        before = server.total()
+        report = scrape.scrape_news(listing_url, workers=args.workers)
+        check(report['listing'] == 'not modified' and server.total() - before == 1,
+              f"rerun made {server.total() - before} request(s), listing {report['listing']}")
+
+        # New articles posted: only those are fetched
+        server.articles += 10
+        before = server.total(prefix='/news/')
+        report = scrape.scrape_news(listing_url, workers=args.workers)
+        check(report['fetched'] == 10 and server.total(prefix='/news/') - before == 10,
+              f"after 10 new posts: fetched {report['fetched']}, "
+              f"{server.total(prefix='/news/') - before} article request(s)")
+        server.articles -= 10
+
+        # Throughput: the old sequential loop versus the pooled, concurrent scraper
+        start = time.perf_counter()
+        sequential = sequential_scrape(listing_url)
+        sequential_seconds = time.perf_counter() - start
+        clear_store()
+        report = scrape.scrape_news(listing_url, workers=args.workers)
+
+    pages = args.articles + server.old_articles
+    print(f"\n{pages} listed articles, stand-in latency {args.latency:.0f} ms")
+    print(f"{'sequential requests.get':<28} {sequential_seconds:6.2f}s  {len(sequential) / sequential_seconds:7.1f} articles/s"
+          f"  ({len(sequential)} fetched, old ones included)")
+    print(f"{f'scrape_news ({args.workers} workers)':<28} {report['seconds']:6.2f}s  "
+          f"{report['fetched'] / report['seconds']:7.1f} articles/s  ({report['fetched']} fetched)")
+
+    server.shutdown()
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""FTS5 search versus LIKE '%term%' scans.
+
+Seeds a temporary database (100k blogs by default) with random text and
+compares ranked FTS5 queries, the /search_blogs endpoint and the LIKE scan
+the app would otherwise need, for a rare, a common and a two-word query.
+"""
+import argparse
+import random
+
+from benchmarks.common import use_temp_database, seed_blogs, time_calls, print_latency, make_app
+
+use_temp_database()
+
+from sqlalchemy import text  # noqa: E402
+from models import db  # noqa: E402
+import search  # noqa: E402
+
+app = make_app()
+
+VOCABULARY = [f'word{i}' for i in range(5000)] + ['caribou', 'wildfire', 'drought', 'habitat', 'bison']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--blogs', type=int, default=100000)
+    parser.add_argument('--words', type=int, default=150, help='words per blog')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    weights = [1] * 5000 + [2, 2, 2, 20, 1]
+
+    def make_content(i):
+        return ' '.join(rng.choices(VOCABULARY, weights, k=args.words))
+
+    with app.app_context():
+        seed_blogs(db, args.blogs, make_content=make_content)
+    client = app.test_client()
+
+    print(f"{args.blogs} blogs, {args.words} words each")
+    for terms in ('bison', 'habitat', 'caribou wildfire'):
+        with app.app_context():
+            fts = time_calls(lambda: search.search_blogs(terms, 20), args.repeat)
+
+            like_sql = 'SELECT id FROM blog WHERE ' + ' AND '.join(
+                f"(title LIKE :w{i} OR content LIKE :w{i})" for i in range(len(terms.split()))
+            ) + ' LIMIT 20'
+            params = {f'w{i}': f'%{word}%' for i, word in enumerate(terms.split())}
+            like = time_calls(lambda: db.session.execute(text(like_sql), params).all(), args.repeat)
+
+            count_like = 'SELECT COUNT(*) FROM blog WHERE ' + like_sql.split(' WHERE ')[1].replace(' LIMIT 20', '')
+            like_all = time_calls(lambda: db.session.execute(text(count_like), params).scalar(), max(1, args.repeat // 4))
+
+        endpoint = time_calls(lambda: client.get(f'/search_blogs?q={terms}'), args.repeat)
+        print_latency(f"'{terms}' FTS5 ranked top 20", fts)
+        print_latency(f"'{terms}' /search_blogs", endpoint)
+        print_latency(f"'{terms}' LIKE first 20 (unranked)", like)
+        print_latency(f"'{terms}' LIKE full scan (to rank)", like_all)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""Spatial query throughput: STRtree + prepared geometries versus a brute-force loop.
+
+Writes synthetic species/vegetation polygons and drought impact points
+(EPSG:3857, like the real file) into a temporary working directory, then
+runs the same random query shapes through spatial.query and through a
+loop that tests every feature of every layer, checks that both give the
+same answer, and reports queries/sec. It also times /api/query end to end.
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+import numpy as np
+import shapely
+
+from benchmarks.common import print_latency, time_calls, write_map_layers
+from benchmarks.map_tiles import app  # an app on a temporary database
+
+import spatial  # noqa: E402
+
+
+def write_drought_points(path, n_points):
+    rng = np.random.default_rng(7)
+    lon = rng.uniform(-140, -55, n_points)
+    lat = rng.uniform(42, 75, n_points)
+    x = np.radians(lon) * spatial.EARTH_RADIUS
+    y = np.log(np.tan(np.pi / 4 + np.radians(lat) / 2)) * spatial.EARTH_RADIUS
+    features = [{'type': 'Feature', 'id': i + 1, 'geometry': {'type': 'Point', 'coordinates': [x[i], y[i]]},
+                 'properties': {'OBJECTID': i + 1, 'IMPACT': 'LMS'[i % 3]}} for i in range(n_points)]
+    with open(path, 'w') as f:
+        json.dump({'type': 'FeatureCollection', 'crs': {'type': 'name', 'properties': {'name': 'EPSG:3857'}},
+                   'features': features}, f)
+
+
+def random_queries(n, seed=11):
+    """Boxes and drawn-polygon-like shapes from a few km to a few hundred km across."""
+    rng = random.Random(seed)
+    shapes = []
+    for i in range(n):
+        x, y, size = rng.uniform(-135, -60), rng.uniform(44, 72), rng.uniform(0.05, 4)
+        if i % 2:
+            shapes.append(shapely.box(x, y, x + size, y + size * 0.6))
+        else:
+            shapes.append(shapely.Point(x, y).buffer(size / 2, quad_segs=4))
+    return shapes
+
+
+def brute_force(indexes, geometry):
+    """Test every feature of every layer, as a loop without an index would."""
+    return {layer: [i for i, feature in enumerate(index.geometries) if feature.intersects(geometry)]
+            for layer, index in indexes.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--polygons', type=int, default=3000)
+    parser.add_argument('--vertices', type=int, default=200, help='vertices per polygon')
+    parser.add_argument('--points', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix='bench-spatial-'))
+    write_map_layers('.', args.polygons, args.vertices)
+    write_drought_points(spatial.DROUGHT_IMPACT_FILE_PATH, args.points)
+    print(f"{args.polygons} polygons x {args.vertices} vertices per layer, {args.points} drought points")
+
+    start = time.perf_counter()
+    indexes = {layer: spatial.get_index(layer) for layer in spatial.QUERY_LAYERS}
+    print(f"index build (once per process)   {(time.perf_counter() - start) * 1000:8.0f} ms")
+
+    queries = random_queries(args.queries)
+    brute_queries = queries[:max(1, args.queries // 10)]  # the loop is too slow for the full set
+
+    start = time.perf_counter()
+    expected = [brute_force(indexes, geometry) for geometry in brute_queries]
+    brute_rate = len(brute_queries) / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    results = [spatial.query(geometry, limit=10 ** 9) for geometry in queries]
+    indexed_rate = len(queries) / (time.perf_counter() - start)
+
+    for want, got in zip(expected, results):
+        for layer, hits in want.items():
+            assert [f['id'] for f in got[layer]['features']] == [indexes[layer].ids[i] for i in hits], layer
+    hits = sum(r[layer]['count'] for r in results for layer in r) / len(results)
+    print(f"brute force    {brute_rate:10.1f} queries/sec")
+    print(f"STRtree        {indexed_rate:10.1f} queries/sec  ({indexed_rate / brute_rate:.0f}x, "
+          f"{hits:.0f} hits per query, results match)")
+
+    client = app.test_client()
+    bodies = iter([json.loads(shapely.to_geojson(geometry)) for geometry in queries])
+    timings = time_calls(lambda: client.post('/api/query', json=next(bodies)), len(queries))
+    print_latency('POST /api/query', timings)
+
+
+if __name__ == '__main__':
+    main()
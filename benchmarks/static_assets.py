@@ -0,0 +1,257 @@
+"""Bytes transferred and server CPU per page load, before and after the asset pipeline.
+
+Loads /about, /references, /blog and /map the way a browser would: the
+page, then every local stylesheet, script, icon and image it references
+(the img/srcset candidate a --viewport px wide screen would pick, and
+/static URLs inside the scripts), with Accept-Encoding: gzip, br. A
+simulated browser cache keeps ETags and Last-Modified dates and skips
+URLs marked immutable. Each page is loaded as a first visit (empty
+cache) and as a repeat visit.
+
+* before  plain /static files and render_template on every request (ASSETS_ENABLED and the page cache off)
+* after   fingerprinted, precompressed assets and the in-memory page cache
+
+Runs build-assets first unless --no-build. Server CPU is process time
+spent in the in-process test client's requests (not in decompressing
+the responses), averaged over --repeat loads; the cold row is the first
+load after start-up, which renders and compresses the page once. If the
+map hasn't been generated, a stand-in page of --map-kb KB is used.
+Also checks that SVG minifying rounds only path data and numeric
+attributes. Exits 1 if a check fails.
+"""
+import argparse
+import gzip
+import os
+import re
+import sys
+import tempfile
+import time
+
+import brotli
+
+from benchmarks.common import make_app, use_temp_database
+
+use_temp_database()
+
+from assets import _minify_svg, assets, build_assets, print_build_report  # noqa: E402
+import map as map_builder  # noqa: E402
+
+app = make_app()
+
+PAGES = ('/about', '/references', '/blog', '/map')
+ACCEPT = {'Accept-Encoding': 'gzip, br'}
+
+_ATTRIBUTE = re.compile(r'<(?:img|script|link|source)\b[^>]*>', re.I)
+_URL = re.compile(r'/static/[^"\'\s)>]+')
+
+
+def decode(response):
+    encoding = response.headers.get('Content-Encoding')
+    if encoding == 'br':
+        return brotli.decompress(response.data)
+    if encoding == 'gzip':
+        return gzip.decompress(response.data)
+    return response.data
+
+
+def pick_srcset(srcset, width):
+    """The candidate a browser would load for a slot width px wide."""
+    candidates = sorted((int(w[:-1]), url) for url, w in (part.split() for part in srcset.split(',')))
+    return next((url for w, url in candidates if w >= width), candidates[-1][1])
+
+
+def page_assets(html, viewport):
+    """Local URLs the page makes the browser fetch."""
+    urls, chose_source = [], False
+    for tag in _ATTRIBUTE.findall(html):
+        srcset = re.search(r'srcset="([^"]+)"', tag)
+        if tag.lower().startswith('<source'):
+            # The first <source> a browser supports wins over the <img> after it
+            if srcset and not chose_source:
+                urls.append(pick_srcset(srcset.group(1), viewport))
+                chose_source = True
+            continue
+        if tag.lower().startswith('<img') and chose_source:
+            chose_source = False
+            continue
+        if srcset:
+            urls.append(pick_srcset(srcset.group(1), viewport))
+            continue
+        match = re.search(r'(?:src|href)="(/static/[^"]+)"', tag)
+        if match:
+            urls.append(match.group(1))
+    return urls
+
+
+class Browser:
+    """Fetch a page and its assets, remembering validators like a browser cache."""
+
+    def __init__(self, client, viewport):
+        self.client = client
+        self.viewport = viewport
+        self.cache = {}  # url -> (immutable, etag, last_modified, decoded body)
+
+    def get(self, url, stats):
+        immutable, etag, last_modified, body = self.cache.get(url, (False, None, None, None))
+        if immutable:
+            stats['cached'] += 1
+            return body
+        headers = dict(ACCEPT)
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        start = time.process_time()
+        response = self.client.get(url, headers=headers)
+        stats['cpu'] += time.process_time() - start
+        stats['requests'] += 1
+        stats['bytes'] += len(response.data) + sum(len(k) + len(v) + 4 for k, v in response.headers.items())
+        if response.status_code == 304:
+            stats['not_modified'] += 1
+            return body
+        assert response.status_code == 200, (url, response.status_code)
+        body = decode(response)
+        self.cache[url] = ('immutable' in response.headers.get('Cache-Control', ''), response.headers.get('ETag'),
+                           response.headers.get('Last-Modified'), body)
+        return body
+
+    def load(self, page):
+        stats = {'requests': 0, 'bytes': 0, 'not_modified': 0, 'cached': 0, 'cpu': 0}
+        html = self.get(page, stats).decode('utf-8', 'replace')
+        urls = page_assets(html, self.viewport)
+        for url in urls:  # grows as scripts and stylesheets reference more files
+            body = self.get(url, stats)
+            if url.split('?')[0].endswith(('.js', '.css')):
+                urls += [u for u in _URL.findall(body.decode('utf-8', 'replace')) if u not in urls]
+        return stats
+
+
+def measure(page, viewport, repeat):
+    """(cold server stats, first visit stats, repeat visit stats), with server CPU ms per load.
+
+    The cold load is the first one after start-up, which fills the page cache.
+    """
+    cold = Browser(app.test_client(), viewport).load(page)
+    cold['cpu_ms'] = cold['cpu'] * 1000
+    results = [cold]
+    for visit in ('first', 'repeat'):
+        cpu = 0
+        for _ in range(repeat):
+            browser = Browser(app.test_client(), viewport)
+            if visit == 'repeat':
+                browser.load(page)
+            stats = browser.load(page)
+            cpu += stats['cpu']
+        stats['cpu_ms'] = cpu / repeat * 1000
+        results.append(stats)
+    return results
+
+
+def configure(enabled):
+    app.config['ASSETS_ENABLED'] = enabled
+    app.config['PAGE_CACHE_ENABLED'] = enabled
+    assets.init_app(app)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--viewport', type=int, default=800, help="width in px of the about page's image slot")
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--map-kb', type=int, default=2000)
+    parser.add_argument('--no-build', action='store_true')
+    args = parser.parse_args()
+
+    failures = []
+
+    def check(condition, message):
+        print(f"{'ok  ' if condition else 'FAIL'} {message}")
+        if not condition:
+            failures.append(message)
+
+    stand_in = not os.path.exists(map_builder.MAP_OUTPUT_PATH)
+    if stand_in:
+        # Stand-in for the folium page: inline GeoJSON features
+        fd, map_builder.MAP_OUTPUT_PATH = tempfile.mkstemp(suffix='.html', prefix='bench-map-')
+        feature = '{"type": "Feature", "properties": {"name": "Site %d"}, "geometry": {"type": "Point", "coordinates": [-114.%06d, 51.%06d]}},\n'
+        with os.fdopen(fd, 'w') as f:
+            f.write('<!DOCTYPE html><html><head><script src="https://cdn.jsdelivr.net/npm/leaflet.js"></script></head><body><script>var features = [\n')
+            i = 0
+            while f.tell() < args.map_kb * 1024:
+                f.write(feature % (i, i * 7919 % 1000000, i * 104729 % 1000000))
+                i += 1
+            f.write('];</script></body></html>')
+
+    if not args.no_build:
+        print_build_report(build_assets(app.static_folder), app.static_folder)
+        print()
+
+    results = {}
+    for label, enabled in (('before', False), ('after', True)):
+        configure(enabled)
+        for page in PAGES:
+            results[label, page] = measure(page, args.viewport, args.repeat)
+
+    print(f"{'page':<12} {'case':<15} {'requests':>8} {'304s':>5} {'cached':>6} {'bytes':>11} {'server cpu':>11}")
+    totals = {}
+    for page in PAGES:
+        for label in ('before', 'after'):
+            for visit, stats in zip(('cold server', 'first visit', 'repeat visit'), results[label, page]):
+                key = f'{label} {visit}'
+                totals[key] = totals.get(key, 0) + stats['bytes']
+                print(f"{page:<12} {label + ' ' + visit.split()[0]:<15} {stats['requests']:8d} {stats['not_modified']:5d} "
+                      f"{stats['cached']:6d} {stats['bytes']:11,d} {stats['cpu_ms']:9.2f}ms")
+    print()
+    for key, total in totals.items():
+        print(f"all pages, {key:<20} {total:>11,d} bytes")
+    print()
+
+    configure(True)
+    for page in PAGES:
+        _, before_first, before_repeat = results['before', page]
+        _, after_first, after_repeat = results['after', page]
+        check(after_first['bytes'] < before_first['bytes'],
+              f"{page} first visit: {before_first['bytes']:,d} -> {after_first['bytes']:,d} bytes")
+        check(after_repeat['bytes'] < before_repeat['bytes'] and after_repeat['requests'] == 1,
+              f"{page} repeat visit: {before_repeat['bytes']:,d} -> {after_repeat['bytes']:,d} bytes, "
+              f"{after_repeat['requests']} request(s)")
+        check(after_repeat['cpu_ms'] < before_repeat['cpu_ms'],
+              f"{page} repeat visit server cpu: {before_repeat['cpu_ms']:.2f} -> {after_repeat['cpu_ms']:.2f}ms")
+
+    # Every encoding of a fingerprinted file decodes to the same bytes
+    client = app.test_client()
+    with app.test_request_context():
+        from flask import url_for
+        url = url_for('static', filename='hack.svg')
+    variants = {encoding: client.get(url, headers={'Accept-Encoding': encoding}) for encoding in ('br', 'gzip', 'identity')}
+    check(len({decode(response) for response in variants.values()}) == 1
+          and [r.headers.get('Content-Encoding') for r in variants.values()] == ['br', 'gzip', None]
+          and all('immutable' in r.headers['Cache-Control'] for r in variants.values()),
+          f"{url}: br {len(variants['br'].data):,d}, gzip {len(variants['gzip'].data):,d}, "
+          f"identity {len(variants['identity'].data):,d} bytes, immutable")
+
+    # SVG numbers are rounded, not truncated, and only where they are geometry
+    svg = (b'<svg viewBox="0 0 100.12567 50">\n    <path id="p1.2345" fill="#123.456" d="M1.2389 2.0049L7.126.1234Z"/>\n'
+           b'    <text x="10.5678">v1.23456</text>\n</svg>')
+    minified = _minify_svg(svg)
+    check(minified == b'<svg viewBox="0 0 100.13 50">\n<path id="p1.2345" fill="#123.456" d="M1.24 2.00L7.130.12Z"/>\n'
+                      b'<text x="10.57">v1.23456</text>\n</svg>', f"minified SVG: {minified.decode()!r}")
+
+    # A regenerated map is served straight away
+    before = decode(client.get('/map', headers=ACCEPT))
+    with open(map_builder.MAP_OUTPUT_PATH, 'ab') as f:
+        f.write(b'<!-- regenerated -->')
+    check(decode(client.get('/map', headers=ACCEPT)) == before + b'<!-- regenerated -->',
+          "page cache picks up a regenerated map")
+
+    configure(False)
+    with app.test_request_context():
+        check(url_for('static', filename='hack.svg') == '/static/hack.svg', "without a build, /static URLs are unchanged")
+    configure(True)
+    if stand_in:
+        os.remove(map_builder.MAP_OUTPUT_PATH)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
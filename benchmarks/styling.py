@@ -0,0 +1,73 @@
+"""Per-feature style callbacks versus vectorized categorical styling.
+
+For each size, builds synthetic species features and times:
+
+* callback    label_cosewic_status + folium's style mapping, which calls
+              style_species for every feature and groups the ids by style
+              (what folium.GeoJson.render does with a style_function)
+* vectorized  prepare_species_frame on the layer's GeoDataFrame, which
+              computes the label and fill_color columns; PreStyledGeoJson then
+              needs no per-feature Python at render time
+
+Also reports the size of the JS style switch folium would emit for the
+callback path; the vectorized path emits a single expression.
+"""
+import argparse
+import copy
+import time
+
+import numpy as np
+import shapely
+from folium.features import GeoJsonStyleMapper
+
+import layer_cache
+import map as map_builder
+
+
+def synthetic_layer(n, seed=5):
+    """n point features with a realistic mix of species, populations and status codes."""
+    rng = np.random.default_rng(seed)
+    pairs = list(map_builder.SPECIES_POPULATION_COLOR_MAP) + [('Unlisted species', None)]
+    picks = rng.integers(len(pairs), size=n)
+    statuses = rng.integers(1, 7, size=n)
+    properties = [{'CommName_E': pairs[p][0], 'Population_E': pairs[p][1], 'COSEWIC_Status': int(s),
+                   'SARA_Status': 'Schedule 1'} for p, s in zip(picks, statuses)]
+    geometries = shapely.points(rng.uniform(-140, -55, n), rng.uniform(42, 75, n))
+    return layer_cache.LayerData(geometries, properties, list(range(n)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='10000,100000,1000000')
+    args = parser.parse_args()
+
+    for n in (int(size) for size in args.sizes.split(',')):
+        data = synthetic_layer(n)
+        features = [{'type': 'Feature', 'id': i, 'properties': copy.copy(properties), 'geometry': None}
+                    for i, properties in enumerate(data.properties)]
+
+        start = time.perf_counter()
+        features = list(map_builder.label_cosewic_status(features))
+        mapping = GeoJsonStyleMapper({'features': features}, 'feature.id', None).get_style_map(map_builder.style_species)
+        callback = time.perf_counter() - start
+        switch_bytes = sum(len(style) + sum(len(f'case {i}: ') for i in ids)
+                           for style, ids in mapping.items() if style != 'default')
+
+        start = time.perf_counter()
+        frame = layer_cache.layer_frame(data)
+        to_frame = time.perf_counter() - start
+        start = time.perf_counter()
+        frame = map_builder.prepare_species_frame(frame)
+        vectorized = time.perf_counter() - start
+
+        expected = [map_builder.style_species(feature)['fillColor'] for feature in features[:1000]]
+        assert frame['fill_color'].iloc[:1000].tolist() == expected
+        assert frame['COSEWIC_Status_Label'].iloc[:1000].tolist() == [f['properties']['COSEWIC_Status_Label']
+                                                                     for f in features[:1000]]
+        print(f"{n:>9,} features  callback {callback * 1000:9.0f} ms (JS switch {switch_bytes / 2 ** 20:6.1f} MB)  "
+              f"vectorized {vectorized * 1000:7.0f} ms ({callback / vectorized:5.0f}x; "
+              f"+{to_frame * 1000:.0f} ms to build the GeoDataFrame)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+"""Tile proxy against a local stand-in WMS/XYZ server.
+
+Starts a small HTTP server that answers GetMap and {z}/{x}/{y} requests
+with PNG-typed bodies after --latency ms, honours If-None-Match, and counts
+what it was asked for. The proxy's upstreams are pointed at it, then:
+
+* checks that concurrent misses on one tile make a single upstream request,
+  that an expired tile is revalidated with a 304, that a stale tile is served
+  (and labelled STALE) when upstream is down, and that the disk store stays
+  under its byte limit, also when several processes share it;
+* replays a skewed (Zipf-like) panning workload from several threads through
+  /proxy and directly against the stand-in, and reports hit ratio, upstream
+  requests and time saved, and client latency.
+
+Exits 1 if any check fails.
+"""
+import argparse
+import hashlib
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+from benchmarks.common import print_latency, use_temp_database, make_app
+
+use_temp_database()
+os.environ['TILE_PROXY_DIR'] = tempfile.mkdtemp(prefix='bench-tile-proxy-')
+
+from tile_proxy import TileCache, Upstream, tile_proxy  # noqa: E402
+
+app = make_app()
+
+WMS_LAYERS = ['critical_habitat', 'protected_areas', 'wildfire_hotspots']
+XYZ_LAYERS = ['openstreetmap', 'arcgis_imagery']
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency):
+        super().__init__(('127.0.0.1', 0), StandInHandler)
+        self.latency = latency
+        self.requests = {}
+        self.lock = threading.Lock()
+
+    def count(self, path, status):
+        with self.lock:
+            self.requests[(path, status)] = self.requests.get((path, status), 0) + 1
+
+    def total(self, status=None):
+        with self.lock:
+            return sum(n for (_, s), n in self.requests.items() if status is None or s == status)
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        url = urlparse(self.path)
+        if url.path == '/wms' and parse_qs(url.query).get('request', [''])[0].lower() != 'getmap':
+            self.send_response(400)
+            self.end_headers()
+            self.server.count(self.path, 400)
+            return
+        body = b'\x89PNG\r\n\x1a\n' + hashlib.sha256(self.path.encode()).digest() * 300
+        etag = '"' + hashlib.md5(body).hexdigest() + '"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            self.server.count(self.path, 304)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.count(self.path, 200)
+
+    def log_message(self, *args):
+        pass
+
+
+def wms_params(layer, x, y):
+    """GetMap parameters for the zoom-5 tile (x, y), as Leaflet's WMS layer would send them."""
+    size = 40075016.68 / 32
+    west, north = -20037508.34 + x * size, 20037508.34 - y * size
+    return {'service': 'WMS', 'request': 'GetMap', 'version': '1.1.1', 'layers': '0', 'styles': '',
+            'format': 'image/png', 'transparent': 'true', 'width': '256', 'height': '256', 'srs': 'EPSG:3857',
+            'bbox': f'{west},{north - size},{west + size},{north}'}
+
+
+def workload(n, seed=1):
+    """n (layer, x, y) requests over Canada at zoom 5, popular tiles requested far more often."""
+    rng = random.Random(seed)
+    tiles = [(x, y) for x in range(4, 12) for y in range(7, 13)]
+    weights = [1 / (rank + 1) for rank in range(len(tiles))]
+    layers = WMS_LAYERS + XYZ_LAYERS
+    return [(rng.choice(layers), *rng.choices(tiles, weights)[0]) for _ in range(n)]
+
+
+def proxy_path(layer, x, y):
+    if layer in XYZ_LAYERS:
+        return f'/proxy/{layer}/5/{x}/{y}', None
+    return f'/proxy/{layer}', wms_params(layer, x, y)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=3000)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=80, help='stand-in server latency in ms')
+    args = parser.parse_args()
+
+    server = StandInServer(args.latency / 1000)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_address[1]}'
+    upstreams = {layer: Upstream('wms', f'{base}/wms', 3600) for layer in WMS_LAYERS}
+    upstreams.update({layer: Upstream('xyz', base + '/' + layer + '/{z}/{x}/{y}.png', 3600) for layer in XYZ_LAYERS})
+    tile_proxy.upstreams = dict(upstreams)
+    client = app.test_client()
+    failures = []
+
+    def check(condition, message):
+        print(f"{'ok  ' if condition else 'FAIL'} {message}")
+        if not condition:
+            failures.append(message)
+
+    # Coalescing: concurrent misses on one tile share one upstream request
+    before = server.total()
+    with ThreadPoolExecutor(16) as pool:
+        statuses = list(pool.map(lambda _: app.test_client().get('/proxy/openstreetmap/3/1/2').status_code, range(16)))
+    check(statuses == [200] * 16 and server.total() - before == 1,
+          f"16 concurrent misses -> {server.total() - before} upstream request(s)")
+
+    # Revalidation: an expired tile is renewed by a 304, not refetched
+    tile_proxy.upstreams['openstreetmap'] = upstreams['openstreetmap']._replace(ttl=0)
+    response = client.get('/proxy/openstreetmap/3/1/2')
+    check(response.headers['X-Cache'] == 'REVALIDATED' and server.total(304) == 1,
+          f"expired tile -> {response.headers['X-Cache']}, {server.total(304)} upstream 304(s)")
+
+    # Stale-if-error: with upstream unreachable the cached copy is still served
+    tile_proxy.upstreams['openstreetmap'] = Upstream('xyz', 'http://127.0.0.1:9/{z}/{x}/{y}.png', 0)
+    with ThreadPoolExecutor(8) as pool:
+        responses = list(pool.map(lambda _: app.test_client().get('/proxy/openstreetmap/3/1/2'), range(8)))
+    served = sorted({(response.status_code, response.headers['X-Cache']) for response in responses})
+    check(served == [(200, 'STALE')], f"upstream down, 8 concurrent requests -> {served}")
+    check(client.get('/proxy/openstreetmap/3/1/3').status_code == 502, "upstream down, nothing cached -> 502")
+    check(client.get('/proxy/critical_habitat?request=GetCapabilities').status_code == 400,
+          "non-GetMap WMS request -> 400")
+    tile_proxy.upstreams['openstreetmap'] = upstreams['openstreetmap']
+
+    # The disk store keeps to its byte limit, dropping the least recently used tiles
+    store = TileCache(tempfile.mkdtemp(prefix='bench-tile-lru-'), 100_000)
+    for i in range(100):
+        store.put(f'{i:064x}', {'fetched_at': 0, 'content_type': 'image/png'}, b'x' * 9_000)
+        store.get(f'{0:064x}')  # keep tile 0 hot
+    on_disk = sum(os.path.getsize(os.path.join(store.directory, name)) for name in os.listdir(store.directory))
+    check(on_disk <= 100_000 and store.get(f'{0:064x}') is not None and store.get(f'{1:064x}') is None,
+          f"LRU store holds {store.usage()[0]} tiles, {on_disk:,} bytes on disk (limit 100,000), hot tile kept")
+
+    # Two workers sharing one directory share its limit too
+    directory = tempfile.mkdtemp(prefix='bench-tile-shared-')
+    workers = [TileCache(directory, 100_000), TileCache(directory, 100_000)]
+    for i in range(100):
+        workers[i % 2].put(f'{i:064x}', {'fetched_at': 0, 'content_type': 'image/png'}, b'x' * 9_000)
+    tiles, on_disk = workers[0].usage()
+    check(on_disk <= 100_000 and workers[1].get(f'{99:064x}') is not None,
+          f"two stores on one directory hold {tiles} tiles, {on_disk:,} bytes (limit 100,000)")
+
+    # Panning workload, through the proxy and straight to upstream
+    requests_ = workload(args.requests)
+    tile_proxy.reset_stats()
+    upstream_before = server.total()
+
+    def through_proxy(request):
+        path, params = proxy_path(*request)
+        start = time.perf_counter()
+        response = app.test_client().get(path, query_string=params)
+        assert response.status_code == 200, response.data
+        return (time.perf_counter() - start) * 1000
+
+    session = requests.Session()
+
+    def direct(request):
+        layer, x, y = request
+        upstream = upstreams[layer]
+        start = time.perf_counter()
+        if upstream.kind == 'xyz':
+            session.get(upstream.url.format(z=5, x=x, y=y)).raise_for_status()
+        else:
+            session.get(upstream.url, params=wms_params(layer, x, y)).raise_for_status()
+        return (time.perf_counter() - start) * 1000
+
+    with ThreadPoolExecutor(args.threads) as pool:
+        proxied = list(pool.map(through_proxy, requests_))
+    stats = tile_proxy.stats()
+    upstream_used = server.total() - upstream_before
+    with ThreadPoolExecutor(args.threads) as pool:
+        direct_timings = list(pool.map(direct, requests_))
+
+    print(f"\n{len(requests_)} tile requests from {args.threads} threads, upstream latency {args.latency:.0f} ms")
+    print(f"hit ratio {stats['hit_ratio']:.1%} ({stats['hits']} hits, {stats['coalesced']} coalesced, "
+          f"{stats['misses']} misses); upstream requests {upstream_used} instead of {len(requests_)}")
+    print(f"upstream time saved {stats['upstream_seconds_saved']:.1f}s; "
+          f"store {stats['cached_tiles']} tiles, {stats['cached_bytes']:,} bytes")
+    print_latency('direct to upstream', direct_timings)
+    print_latency('through /proxy', proxied)
+    check(upstream_used == stats['misses'], "every proxied miss made exactly one upstream request")
+
+    server.shutdown()
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
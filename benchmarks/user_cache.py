@@ -0,0 +1,113 @@
+"""Requests per second and database queries per request, anonymous vs. logged in.
+
+Runs --requests requests per case against /current_user (identity only)
+and /get_blogs (identity plus the feed) for an anonymous client and for a
+logged-in client with the user cache on (USER_CACHE_TTL) and off (TTL 0),
+counting the SQL statements each request issues.
+
+Also checks that a warm cache answers identity with no queries, and that
+changing the display name, or logging out, is seen on the next request.
+Exits 1 if a check fails.
+"""
+import argparse
+import sys
+import time
+
+from sqlalchemy import event
+
+from benchmarks.common import seed_blogs, use_temp_database, make_app
+
+use_temp_database()
+
+from models import db  # noqa: E402
+from user_cache import user_cache  # noqa: E402
+
+app = make_app()
+
+
+class QueryCounter:
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self.count += 1
+
+
+def logged_in_client():
+    client = app.test_client()
+    client.post('/signup', json={'display_name': 'reader', 'password': 'benchmark1'})
+    assert client.post('/login', json={'display_name': 'reader', 'password': 'benchmark1'}).get_json()['success']
+    return client
+
+
+def measure(client, url, n, counter):
+    """Return (requests per second, queries per request) for n GETs of url."""
+    client.get(url)  # warm up
+    queries = counter.count
+    start = time.perf_counter()
+    for _ in range(n):
+        assert client.get(url).status_code == 200
+    seconds = time.perf_counter() - start
+    return n / seconds, (counter.count - queries) / n
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--blogs', type=int, default=2000)
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+
+    failures = []
+
+    def check(condition, message):
+        print(f"{'ok  ' if condition else 'FAIL'} {message}")
+        if not condition:
+            failures.append(message)
+
+    with app.app_context():
+        seed_blogs(db, args.blogs)
+        counter = QueryCounter(db.engine)
+
+    client = logged_in_client()
+    anonymous = app.test_client()
+
+    # Identity from a warm cache costs no queries, and changes are seen straight away
+    client.get('/current_user')
+    before = counter.count
+    data = client.get('/current_user').get_json()
+    check(counter.count == before and data['logged_in'] and data['display_name'] == 'reader',
+          f"warm cache: /current_user made {counter.count - before} queries")
+    check(client.get('/check_login').get_json() == data, "/check_login answers like /current_user")
+    client.post('/update_profile', json={'display_name': 'renamed'})
+    check(client.get('/current_user').get_json()['display_name'] == 'renamed', "new display name seen after update")
+    client.post('/update_profile', json={'display_name': 'reader'})
+
+    print(f"\n{'case':<34} {'req/s':>8} {'queries/req':>12}")
+    results = {}
+    for url in ('/current_user', '/get_blogs'):
+        for label, ttl, http in (('anonymous', 60, anonymous), ('logged in, cache off', 0, client),
+                                 ('logged in, cache on', 60, client)):
+            app.config['USER_CACHE_TTL'] = ttl
+            user_cache.init_app(app)
+            user_cache.reset_stats()
+            rate, queries = measure(http, url, args.requests, counter)
+            results[url, label] = queries
+            print(f"{url + ' ' + label:<34} {rate:8.0f} {queries:12.2f}")
+    stats = user_cache.stats()
+    print(f"user cache: {stats['hits']} hits, {stats['misses']} misses, hit ratio {stats['hit_ratio']:.1%}")
+
+    check(results['/current_user', 'logged in, cache on'] == 0,
+          "logged-in /current_user with the cache makes no queries")
+    saved = results['/get_blogs', 'logged in, cache off'] - results['/get_blogs', 'logged in, cache on']
+    check(saved == 1, f"logged-in /get_blogs: the cache saves {saved:g} query per request")
+
+    client.post('/logout')
+    check(client.get('/current_user').get_json()['logged_in'] is False and user_cache.stats()['size'] == 0,
+          "logout drops the cached user")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
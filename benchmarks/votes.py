@@ -0,0 +1,146 @@
+"""Many threads voting on one hot post: lost updates and votes/sec.
+
+Runs the same workload three ways against a temporary database:
+
+* naive     - ORM read-modify-write of Blog.likes (shows lost updates)
+* immediate - record_vote(coalesce=False), counter UPDATE in every request
+* coalesced - record_vote(coalesce=True), counters batched by the VoteBuffer
+
+Each voter is a distinct user, so every vote must be counted exactly once.
+Then checks that a flush which fails (a trigger makes the counter UPDATE
+abort) is retried on its own once the database is back, with no further
+votes, and that binding the buffer to several apps registers one exit
+flush. The script exits non-zero if a count or check is wrong.
+"""
+import argparse
+import atexit
+import sys
+import threading
+import time
+
+from sqlalchemy import text
+
+from benchmarks.common import use_temp_database, make_app
+
+use_temp_database()
+
+from models import db, Blog, User, Vote  # noqa: E402
+from votes import VoteBuffer, record_vote, vote_buffer  # noqa: E402
+
+app = make_app()
+
+
+def naive_vote(user_id, blog_id, value):
+    """What a straightforward ORM implementation would do."""
+    blog = db.session.get(Blog, blog_id)
+    db.session.add(Vote(user_id=user_id, blog_id=blog_id, value=value))
+    if value == 1:
+        blog.likes = (blog.likes or 0) + 1
+    else:
+        blog.dislikes = (blog.dislikes or 0) + 1
+    db.session.commit()
+
+
+def run(mode, blog_id, user_ids, threads):
+    errors = []
+
+    def worker(chunk):
+        with app.app_context():
+            for user_id in chunk:
+                value = 1 if user_id % 3 else -1
+                try:
+                    if mode == 'naive':
+                        naive_vote(user_id, blog_id, value)
+                    else:
+                        record_vote(user_id, blog_id, value, coalesce=(mode == 'coalesced'))
+                except Exception as e:
+                    db.session.rollback()
+                    errors.append(e)
+
+    chunks = [user_ids[i::threads] for i in range(threads)]
+    workers = [threading.Thread(target=worker, args=(chunk,)) for chunk in chunks]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    vote_buffer.flush()
+    elapsed = time.perf_counter() - start
+
+    with app.app_context():
+        blog = db.session.get(Blog, blog_id)
+        expected_likes = sum(1 for user_id in user_ids if user_id % 3)
+        expected_dislikes = len(user_ids) - expected_likes
+        lost = (expected_likes - blog.likes) + (expected_dislikes - blog.dislikes)
+    print(f"{mode:<10} {len(user_ids) / elapsed:9.0f} votes/sec  likes={blog.likes}/{expected_likes}  "
+          f"dislikes={blog.dislikes}/{expected_dislikes}  lost={lost}  errors={len(errors)}")
+    return lost == 0 and not errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--voters', type=int, default=3000)
+    parser.add_argument('--threads', type=int, default=16)
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.session.execute(User.__table__.insert(), [
+            {'display_name': f'voter{i}', 'password_hash': 'x'} for i in range(args.voters)
+        ])
+        db.session.add(User(display_name='author', password_hash='x'))
+        db.session.flush()
+        author_id = User.query.filter_by(display_name='author').one().id
+        blogs = [Blog(title=mode, content='hot post', user_id=author_id, likes=0, dislikes=0)
+                 for mode in ('naive', 'immediate', 'coalesced')]
+        db.session.add_all(blogs)
+        db.session.commit()
+        blog_ids = [blog.id for blog in blogs]
+
+    user_ids = list(range(1, args.voters + 1))
+    print(f"{args.voters} voters, {args.threads} threads")
+    run('naive', blog_ids[0], user_ids, args.threads)
+    ok = run('immediate', blog_ids[1], user_ids, args.threads)
+    ok = run('coalesced', blog_ids[2], user_ids, args.threads) and ok
+    print()
+
+    def check(condition, message):
+        print(f"{'ok  ' if condition else 'FAIL'} {message}")
+        return condition
+
+    # A failed flush is retried by itself once the database is back
+    blog_id = blog_ids[2]
+    with app.app_context():
+        db.session.execute(text('CREATE TABLE outage (down INTEGER)'))
+        db.session.execute(text('INSERT INTO outage VALUES (1)'))
+        db.session.execute(text("CREATE TRIGGER refuse_updates BEFORE UPDATE ON blog WHEN EXISTS (SELECT 1 FROM outage) "
+                                "BEGIN SELECT RAISE(ABORT, 'database unavailable'); END"))
+        db.session.commit()
+        likes_before = db.session.get(Blog, blog_id).likes
+    app.config['VOTE_FLUSH_INTERVAL'] = 0.2
+    vote_buffer.add(blog_id, 1, 0)
+    try:
+        vote_buffer.flush()
+        failed = False
+    except Exception:
+        failed = True
+    with app.app_context():
+        db.session.execute(text('DELETE FROM outage'))
+        db.session.commit()
+    time.sleep(1)
+    with app.app_context():
+        likes_after = db.session.get(Blog, blog_id).likes
+    ok = check(failed and likes_after == likes_before + 1 and vote_buffer.pending(blog_id) == (0, 0),
+               f"failed flush retried without another vote: likes {likes_before} -> {likes_after}") and ok
+
+    # One exit flush however many apps the buffer is bound to
+    registered = atexit._ncallbacks()
+    buffer = VoteBuffer()
+    for _ in range(3):
+        buffer.init_app(make_app())
+    ok = check(atexit._ncallbacks() - registered == 1,
+               f"3 init_app calls registered {atexit._ncallbacks() - registered} exit flush(es)") and ok
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
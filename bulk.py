@@ -0,0 +1,273 @@
+"""Bulk export and import of users and blogs as NDJSON.
+
+Each line is one row, tagged with its table:
+
+    {"type": "user", "id": 1, "display_name": "ana", "password_hash": "scrypt:..."}
+    {"type": "blog", "id": 7, "title": "...", "content": "...", "user_id": 1, "likes": 0, ...}
+
+Exports stream each table in id order through a server-side cursor,
+BULK_BATCH_SIZE rows at a time, users before blogs, so memory stays flat
+however large the tables are. Replies and votes are not exported; the
+likes, dislikes and reply_count counters carry over as they were.
+
+Imports insert BULK_BATCH_SIZE rows per executemany and commit every
+BULK_CHUNK_ROWS rows. After each commit the number of lines consumed is
+written to a checkpoint file, so an interrupted import picks up where it
+stopped. Rows whose id already exists are skipped rather than failing,
+which also makes re-running an import (or a commit that outran its
+checkpoint) harmless. Lines without an id get a new one.
+
+    flask --app app export-data backup.ndjson
+    flask --app app import-data backup.ndjson
+
+The same is available over HTTP to the users named in BULK_ADMINS, at
+GET /admin/export and POST /admin/import.
+"""
+import json
+import os
+import time
+
+from flask import current_app
+from flask_login import current_user
+from sqlalchemy import select, text
+from sqlalchemy.exc import IntegrityError
+
+import feed
+from models import db, Blog, User
+from feed_events import publish
+from user_cache import user_cache
+
+# Exported tables in dependency order: blogs refer to users
+TABLES = {'user': User.__table__, 'blog': Blog.__table__}
+
+
+def init_app(app):
+    """Bulk transfer settings and the users allowed to use the /admin endpoints."""
+    app.config.setdefault('BULK_ADMINS', [name for name in os.environ.get('BULK_ADMINS', '').split(',') if name])
+    # Rows per executemany on import, and per cursor fetch on export
+    app.config.setdefault('BULK_BATCH_SIZE', 5000)
+    # Rows per import transaction; the checkpoint advances after each
+    app.config.setdefault('BULK_CHUNK_ROWS', 50000)
+
+
+def is_admin():
+    return current_user.is_authenticated and current_user.display_name in current_app.config['BULK_ADMINS']
+
+
+def parse_tables(names):
+    """Table names from a comma-separated list (all of them when empty), in export order."""
+    if not names:
+        return list(TABLES)
+    names = names.split(',') if isinstance(names, str) else names
+    unknown = set(names) - set(TABLES)
+    if unknown:
+        raise ValueError(f"Unknown table {', '.join(sorted(unknown))}, expected {', '.join(TABLES)}")
+    return [name for name in TABLES if name in names]
+
+
+# Export
+
+def export_lines(tables=None, batch_size=None, counts=None):
+    """Yield NDJSON text, one chunk of lines per cursor fetch.
+
+    counts, if given, is filled in with the rows written per table.
+    """
+    batch_size = batch_size or current_app.config['BULK_BATCH_SIZE']
+    for name in parse_tables(tables):
+        table = TABLES[name]
+        result = db.session.execute(select(table).order_by(table.c.id),
+                                    execution_options={'yield_per': batch_size})
+        for rows in result.partitions():
+            if counts is not None:
+                counts[name] = counts.get(name, 0) + len(rows)
+            yield ''.join(json.dumps({'type': name, **row._mapping}, ensure_ascii=False) + '\n' for row in rows)
+        result.close()
+    db.session.rollback()  # end the read transaction
+
+
+def export_data(out, tables=None, batch_size=None):
+    """Write the tables to the file object out. Returns a report of rows per table and speed."""
+    counts = {}
+    started = time.perf_counter()
+    for chunk in export_lines(tables, batch_size, counts):
+        out.write(chunk)
+    return _report(counts, time.perf_counter() - started)
+
+
+# Import
+
+class _Importer:
+    """Buffers parsed rows per table and writes them in batches."""
+
+    def __init__(self, batch_size):
+        self.batch_size = batch_size
+        self.pending = {name: [] for name in TABLES}
+        self.inserted = {name: 0 for name in TABLES}
+        self.skipped = {name: 0 for name in TABLES}
+        columns = {name: {column.name: column for column in table.columns} for name, table in TABLES.items()}
+        self.columns = columns
+        # Columns a row must carry: not null, without a default, and not the id
+        self.required = {name: {key for key, column in columns[name].items()
+                                if not column.nullable and column.default is None and not column.primary_key}
+                         for name in TABLES}
+        # Omitted columns are filled in, so every row in an executemany has the same keys
+        self.defaults = {name: {key: column.default.arg if column.default is not None and column.default.is_scalar else None
+                                for key, column in columns[name].items() if not column.primary_key}
+                         for name in TABLES}
+
+    def add(self, line_number, line):
+        try:
+            record = json.loads(line)
+            name = record.pop('type')
+        except (ValueError, KeyError, AttributeError, TypeError):
+            raise ValueError(f"line {line_number}: expected a JSON object with a \"type\"")
+        if name not in TABLES:
+            raise ValueError(f"line {line_number}: unknown type {name!r}, expected {', '.join(TABLES)}")
+        unknown = record.keys() - self.columns[name].keys()
+        if unknown:
+            raise ValueError(f"line {line_number}: unknown {name} field {', '.join(sorted(unknown))}")
+        missing = self.required[name] - record.keys()
+        if missing:
+            raise ValueError(f"line {line_number}: {name} is missing {', '.join(sorted(missing))}")
+        row = dict(self.defaults[name])
+        row.update(record)
+        self.pending[name].append(row)
+        if len(self.pending[name]) >= self.batch_size:
+            self.flush()  # every table, in order: the batch may refer to users still pending
+
+    def flush(self):
+        # Users first, so blogs in the same chunk can refer to them
+        for name in TABLES:
+            self.flush_table(name)
+
+    def flush_table(self, name):
+        rows, self.pending[name] = self.pending[name], []
+        if not rows:
+            return
+        table = TABLES[name]
+        ids = [row['id'] for row in rows if row.get('id') is not None]
+        if ids:
+            existing = set(db.session.scalars(select(table.c.id).where(table.c.id.in_(ids))))
+            if existing:
+                self.skipped[name] += sum(1 for row in rows if row.get('id') in existing)
+                rows = [row for row in rows if row.get('id') not in existing]
+        with_id = [row for row in rows if row.get('id') is not None]
+        without_id = [{key: value for key, value in row.items() if key != 'id'} for row in rows if row.get('id') is None]
+        for batch in (with_id, without_id):
+            if batch:
+                db.session.execute(table.insert(), batch)
+                self.inserted[name] += len(batch)
+
+
+def import_data(lines, checkpoint=None, batch_size=None, chunk_rows=None, progress=None):
+    """Insert the rows of an NDJSON line iterable.
+
+    checkpoint is a path recording how many lines have been committed; when
+    it exists the lines it covers are skipped, and it is removed once every
+    line is in. progress(report) is called after each commit. Raises
+    ValueError naming the line for malformed rows and rows the database
+    refuses; everything committed before that chunk stays.
+    """
+    batch_size = batch_size or current_app.config['BULK_BATCH_SIZE']
+    chunk_rows = chunk_rows or current_app.config['BULK_CHUNK_ROWS']
+    importer = _Importer(batch_size)
+    resume_from = _read_checkpoint(checkpoint)
+    started = time.perf_counter()
+    chunk_start = line_number = resume_from
+
+    def commit():
+        try:
+            importer.flush()
+            if any(importer.inserted.values()):
+                feed.mark_changed()  # Core inserts bypass the ORM's change tracking
+            db.session.commit()
+        except IntegrityError as e:
+            db.session.rollback()
+            raise ValueError(f"lines {chunk_start + 1}-{line_number}: {e.orig}")
+        _write_checkpoint(checkpoint, line_number)
+        if progress is not None:
+            progress(_report(importer.inserted, time.perf_counter() - started, importer.skipped, line_number))
+        return line_number
+
+    in_chunk = 0
+    try:
+        for line_number, line in enumerate(lines, 1):
+            if line_number <= resume_from:
+                continue
+            if isinstance(line, bytes):
+                line = line.decode('utf-8')
+            if not line.strip():
+                continue
+            try:
+                importer.add(line_number, line)  # may write a full batch
+            except IntegrityError as e:
+                raise ValueError(f"lines {chunk_start + 1}-{line_number}: {e.orig}")
+            in_chunk += 1
+            if in_chunk >= chunk_rows:
+                chunk_start = commit()
+                in_chunk = 0
+        commit()
+    except ValueError:
+        db.session.rollback()
+        raise
+
+    _fix_sequences()
+    if importer.inserted['user']:
+        user_cache.clear()
+    if importer.inserted['blog']:
+        # Open blog pages reload the feed instead of receiving a million events
+        publish('reset', {})
+        db.session.commit()
+    if checkpoint and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    return _report(importer.inserted, time.perf_counter() - started, importer.skipped, line_number, resume_from)
+
+
+def _read_checkpoint(path):
+    if not path or not os.path.exists(path):
+        return 0
+    with open(path) as f:
+        return json.load(f)['line']
+
+
+def _write_checkpoint(path, line_number):
+    if not path:
+        return
+    with open(path + '.tmp', 'w') as f:
+        json.dump({'line': line_number}, f)
+    os.replace(path + '.tmp', path)
+
+
+def _fix_sequences():
+    # PostgreSQL hands out ids from a sequence that explicit ids don't advance
+    if db.engine.dialect.name != 'postgresql':
+        return
+    for table in TABLES.values():
+        db.session.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('\"{table.name}\"', 'id'), "
+            f"COALESCE((SELECT MAX(id) FROM \"{table.name}\"), 0) + 1, false)"
+        ))
+    db.session.commit()
+
+
+def _report(rows, seconds, skipped=None, lines=None, resumed_from=0):
+    total = sum(rows.values())
+    report = {'rows': dict(rows), 'seconds': round(seconds, 3), 'rows_per_second': round(total / seconds) if seconds else 0}
+    if skipped is not None:
+        report['skipped'] = dict(skipped)
+    if lines is not None:
+        report['lines'] = lines
+    if resumed_from:
+        report['resumed_from_line'] = resumed_from
+    return report
+
+
+def format_report(verb, report):
+    rows = ', '.join(f"{count:,d} {name}s" for name, count in report['rows'].items())
+    skipped = sum(report.get('skipped', {}).values())
+    line = f"{verb} {rows} in {report['seconds']:.1f}s ({report['rows_per_second']:,d} rows/s)"
+    if skipped:
+        line += f", skipped {skipped:,d} already present"
+    if report.get('resumed_from_line'):
+        line += f", resumed after line {report['resumed_from_line']:,d}"
+    return line
@@ -0,0 +1,172 @@
+import hashlib
+from itertools import chain
+
+from sqlalchemy import and_, event, func, or_, select
+from sqlalchemy.orm import Session
+
+from models import db, Blog, FeedVersion, Reply, User, Vote
+
+# Page size limits for the /get_blogs feed
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+# Number of most recent replies embedded with each blog in the feed
+REPLY_PREVIEW_SIZE = 3
+
+# The feed version is a one-row counter in the database, bumped in every
+# transaction that touches a Blog, Reply or User row (or calls mark_changed),
+# so every worker process and CLI command sees the same version.
+_feed_version = FeedVersion.__table__
+
+
+def current_version():
+    """Return the current feed version."""
+    return db.session.execute(select(_feed_version.c.version)).scalar() or 0
+
+
+def mark_changed():
+    """Bump the feed version when the current transaction commits.
+
+    For changes the ORM doesn't see, such as Core inserts and bulk updates.
+    """
+    db.session.info['feed_changed'] = True
+
+
+@event.listens_for(Session, 'after_flush')
+def _track_feed_changes(session, flush_context):
+    """Remember whether this transaction changed anything shown in the feed."""
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, (Blog, Reply, User)):
+            session.info['feed_changed'] = True
+            break
+
+
+@event.listens_for(Session, 'before_commit')
+def _bump_before_commit(session):
+    # In the same transaction as the change, so no reader can see the new
+    # rows under the old version or the old rows under the new one
+    session.flush()
+    if not session.info.pop('feed_changed', False):
+        return
+    bumped = session.execute(_feed_version.update().values(version=_feed_version.c.version + 1))
+    if bumped.rowcount == 0:
+        session.execute(_feed_version.insert().values(id=1, version=1))
+
+
+@event.listens_for(Session, 'after_rollback')
+def _reset_after_rollback(session):
+    session.info.pop('feed_changed', None)
+
+
+def feed_etag(*parts):
+    """Build the weak ETag for a feed page from the version and request parts."""
+    key = '|'.join(str(part) for part in (current_version(),) + parts)
+    return hashlib.md5(key.encode()).hexdigest()
+
+
+def parse_page_size(value):
+    """Clamp the requested page size to [1, MAX_PAGE_SIZE]."""
+    if value is None:
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(value, MAX_PAGE_SIZE))
+
+
+def load_page(cursor, limit):
+    """Return one page of (Blog, User) rows, newest first, plus the next cursor.
+
+    The cursor is the id of the last blog on the previous page.
+    """
+    query = db.session.query(Blog, User).join(User, Blog.user_id == User.id).order_by(Blog.id.desc())
+    if cursor is not None:
+        query = query.filter(Blog.id < cursor)
+    rows = query.limit(limit + 1).all()
+    next_cursor = rows[limit - 1][0].id if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+def serialize_blog(blog, user, summary_length=None, replies=(), vote_counts=None, user_vote=0):
+    """Turn a (Blog, User) row into the dict sent to the client.
+
+    vote_counts overrides the stored (likes, dislikes), e.g. to include
+    deltas that have not been flushed yet.
+    """
+    likes, dislikes = vote_counts or (blog.likes or 0, blog.dislikes or 0)
+    data = {'id': blog.id, 'title': blog.title, 'username': user.display_name, 'user_id': blog.user_id,
+            'reply_count': blog.reply_count, 'replies': list(replies),
+            'likes': likes, 'dislikes': dislikes, 'user_vote': user_vote}
+    if summary_length is None:
+        data['content'] = blog.content
+    else:
+        data['summary'] = blog.content[:summary_length]
+        data['truncated'] = len(blog.content) > summary_length
+    return data
+
+
+def serialize_reply(reply, user):
+    """Turn a (Reply, User) row into the dict sent to the client."""
+    return {'id': reply.id, 'blog_id': reply.blog_id, 'content': reply.content, 'username': user.display_name,
+            'user_id': reply.user_id, 'created_at': reply.created_at.isoformat()}
+
+
+def load_reply_previews(blogs, per_blog=REPLY_PREVIEW_SIZE):
+    """Fetch the newest replies for a page of blogs with a single IN query.
+
+    Returns a dict of blog id -> serialized replies in chronological order.
+    Blogs whose reply_count is zero are left out of the query entirely.
+    """
+    blog_ids = [blog.id for blog in blogs if blog.reply_count]
+    if not blog_ids:
+        return {}
+
+    rank = func.row_number().over(
+        partition_by=Reply.blog_id, order_by=(Reply.created_at.desc(), Reply.id.desc())
+    ).label('rank')
+    ranked = db.session.query(Reply.id, rank).filter(Reply.blog_id.in_(blog_ids)).subquery()
+    rows = (
+        db.session.query(Reply, User)
+        .join(ranked, ranked.c.id == Reply.id)
+        .join(User, Reply.user_id == User.id)
+        .filter(ranked.c.rank <= per_blog)
+        .order_by(Reply.blog_id, Reply.created_at, Reply.id)
+        .all()
+    )
+
+    previews = {}
+    for reply, user in rows:
+        previews.setdefault(reply.blog_id, []).append(serialize_reply(reply, user))
+    return previews
+
+
+def load_user_votes(user_id, blogs):
+    """Return {blog id: vote value} for user_id's votes on a page of blogs."""
+    if user_id is None or not blogs:
+        return {}
+    rows = db.session.query(Vote.blog_id, Vote.value).filter(
+        Vote.user_id == user_id, Vote.blog_id.in_([blog.id for blog in blogs])
+    )
+    return dict(rows.all())
+
+
+def reply_page(blog_id, cursor, limit):
+    """Return one page of a blog's replies, oldest first, plus the next cursor.
+
+    The cursor is the id of the last reply on the previous page; paging is a
+    keyset scan over the (blog_id, created_at) index.
+    """
+    query = (
+        db.session.query(Reply, User)
+        .join(User, Reply.user_id == User.id)
+        .filter(Reply.blog_id == blog_id)
+        .order_by(Reply.created_at, Reply.id)
+    )
+    if cursor is not None:
+        last = db.session.get(Reply, cursor)
+        if last is not None and last.blog_id == blog_id:
+            query = query.filter(or_(
+                Reply.created_at > last.created_at,
+                and_(Reply.created_at == last.created_at, Reply.id > last.id),
+            ))
+
+    rows = query.limit(limit + 1).all()
+    next_cursor = rows[limit - 1][0].id if len(rows) > limit else None
+    return [serialize_reply(reply, user) for reply, user in rows[:limit]], next_cursor
@@ -0,0 +1,334 @@
+"""Live blog feed: created, edited, deleted and vote events pushed over Server-Sent Events.
+
+Routes that change the feed call publish(), which adds a FeedEvent row to
+the same transaction, so an event exists exactly when its change was
+committed and the row ids order events across every worker process. After
+the commit a UDP datagram wakes the event hub.
+
+The hub is one asyncio process holding every /events connection as a bare
+transport, with no thread or task per browser:
+
+    flask --app app serve-events
+
+When woken (or every EVENTS_POLL_INTERVAL seconds, in case a datagram was
+lost) it reads the new rows once, encodes them once and writes the same
+bytes to every connection. A browser whose unsent data passes
+EVENTS_MAX_BUFFER is cut off and catches up when it reconnects.
+
+Browsers send the id of the last event they saw back as Last-Event-ID when
+they reconnect and get only the events after it, from the hub's last
+EVENTS_REPLAY events, or a "reset" event telling them to reload the feed
+if they have been away longer than that. Older rows are pruned by the hub
+and, every EVENTS_PRUNE_EVERY events, by the writers themselves, so the
+table stays bounded when the hub isn't running. With live updates off
+(EVENTS_URL empty) nothing is published at all.
+
+Pages connect to EVENTS_URL: by default port EVENTS_PORT on their own
+host; behind a reverse proxy, route /events to the hub and set it to /events.
+"""
+import asyncio
+import collections
+import itertools
+import json
+import os
+import socket
+import time
+from urllib.parse import parse_qs, urlsplit
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import db, FeedEvent
+
+# Rows read per database round trip
+READ_BATCH = 1000
+# How long an id skipped by a concurrent, still uncommitted transaction is
+# looked for before it is taken to be rolled back (PostgreSQL can commit
+# sequence values out of order; SQLite can't)
+GAP_TIMEOUT = 10
+
+_RESPONSE_HEAD = (b'HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n'
+                  b'Access-Control-Allow-Origin: *\r\nX-Accel-Buffering: no\r\n\r\n')
+
+
+_published = itertools.count(1)  # events published by this process
+
+
+def publish(kind, data):
+    """Add a feed event to the current transaction; it goes out when the transaction commits."""
+    if not current_app.config['EVENTS_URL']:
+        return  # live updates are off: nothing would ever read it
+    db.session.add(FeedEvent(kind=kind, data=json.dumps(data, separators=(',', ':'))))
+    db.session.info['feed_events'] = True
+    if next(_published) % current_app.config['EVENTS_PRUNE_EVERY'] == 0:
+        prune(current_app.config['EVENTS_REPLAY'])
+
+
+def prune(keep):
+    """Delete all but the newest keep events, in the current transaction."""
+    head = latest_event_id()
+    db.session.query(FeedEvent).filter(FeedEvent.id <= head - keep).delete(synchronize_session=False)
+
+
+def latest_event_id():
+    """Id of the newest committed event; a page rendered after reading it resumes from there."""
+    return db.session.query(db.func.max(FeedEvent.id)).scalar() or 0
+
+
+@event.listens_for(Session, 'after_commit')
+def _wake_after_commit(session):
+    if session.info.pop('feed_events', False):
+        feed_events.wake()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_after_rollback(session):
+    session.info.pop('feed_events', None)
+
+
+def frame(event_id, kind, data):
+    """One event in the text/event-stream format."""
+    return f'id: {event_id}\nevent: {kind}\ndata: {data}\n\n'.encode()
+
+
+class FeedEvents:
+    """Configuration for the live feed, and the wake-up sent to the hub after each commit."""
+
+    def __init__(self, app=None):
+        self.wake_address = None
+        self._socket = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('EVENTS_PORT', int(os.environ.get('EVENTS_PORT', 8001)))
+        # Where the web workers send wake-ups; the hub listens for them on EVENTS_PORT too
+        app.config.setdefault('EVENTS_HUB_HOST', os.environ.get('EVENTS_HUB_HOST', '127.0.0.1'))
+        # A path or URL, or :port/path on the page's own host; empty turns live updates off
+        app.config.setdefault('EVENTS_URL', os.environ.get('EVENTS_URL', f":{app.config['EVENTS_PORT']}/events"))
+        app.config.setdefault('EVENTS_REPLAY', 5000)
+        # Each writer process prunes the table after this many events
+        app.config.setdefault('EVENTS_PRUNE_EVERY', 1000)
+        app.config.setdefault('EVENTS_POLL_INTERVAL', 1.0)
+        app.config.setdefault('EVENTS_KEEPALIVE', 15)
+        app.config.setdefault('EVENTS_MAX_BUFFER', 256 * 1024)
+        self.wake_address = (app.config['EVENTS_HUB_HOST'], app.config['EVENTS_PORT'])
+
+    def wake(self):
+        """Tell the hub there are new rows. Best effort: it polls anyway."""
+        if self.wake_address is None:
+            return
+        try:
+            if self._socket is None:
+                self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                self._socket.setblocking(False)
+            self._socket.sendto(b'1', self.wake_address)
+        except OSError:
+            pass
+
+
+feed_events = FeedEvents()
+
+
+class _Wake(asyncio.DatagramProtocol):
+    def __init__(self, woken):
+        self.woken = woken
+
+    def datagram_received(self, data, addr):
+        self.woken.set()
+
+
+class _Subscriber(asyncio.Protocol):
+    """One browser connection: reads the request, then only ever gets written to."""
+
+    def __init__(self, hub):
+        self.hub = hub
+        self.transport = None
+        self.request = b''
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        if self.request is None:
+            return  # the request was already handled
+        self.request += data
+        if b'\r\n\r\n' in self.request:
+            request, self.request = self.request, None
+            self.hub.handle(self, request)
+        elif len(self.request) > 8192:
+            self.transport.close()
+
+    def connection_lost(self, exc):
+        self.hub.clients.discard(self)
+
+    def send(self, data):
+        if self.transport.get_write_buffer_size() > self.hub.max_buffer:
+            # Too slow to keep up; it reconnects with Last-Event-ID and catches up
+            self.hub.stats['dropped'] += 1
+            self.transport.abort()
+            return
+        self.transport.write(data)
+
+
+class EventHub:
+    """The /events server: fans committed FeedEvents out to every connected browser."""
+
+    def __init__(self, app):
+        self.app = app
+        self.replay = collections.deque(maxlen=app.config['EVENTS_REPLAY'])  # (id, frame), in delivery order
+        self.max_buffer = app.config['EVENTS_MAX_BUFFER']
+        self.clients = set()
+        self.head = 0
+        self.stats = {'connections': 0, 'events': 0, 'bytes_sent': 0, 'resumed': 0, 'reset': 0, 'dropped': 0}
+        self._gaps = {}  # skipped id -> when it was first missed
+        self._woken = None
+
+    def run(self, host, port):
+        _raise_open_file_limit()
+        asyncio.run(self.serve(host, port))
+
+    async def serve(self, host, port):
+        loop = asyncio.get_running_loop()
+        self._woken = asyncio.Event()
+        await loop.run_in_executor(None, self._load_replay)
+        server = await loop.create_server(lambda: _Subscriber(self), host, port, backlog=4096)
+        await loop.create_datagram_endpoint(lambda: _Wake(self._woken), local_addr=(host, port))
+        print(f"Serving feed events on {host}:{port} from event {self.head}")
+        async with server:
+            await asyncio.gather(self._pump(), self._keepalive())
+
+    # Reading events
+
+    def _load_replay(self):
+        with self.app.app_context():
+            rows = (db.session.query(FeedEvent.id, FeedEvent.kind, FeedEvent.data)
+                    .order_by(FeedEvent.id.desc()).limit(self.replay.maxlen).all())
+        for event_id, kind, data in reversed(rows):
+            self.replay.append((event_id, frame(event_id, kind, data)))
+        self.head = rows[0][0] if rows else 0
+
+    def _read_new(self):
+        """Rows after head, plus any skipped ids that have since committed."""
+        with self.app.app_context():
+            condition = FeedEvent.id > self.head
+            if self._gaps:
+                condition = condition | FeedEvent.id.in_(list(self._gaps))
+            return (db.session.query(FeedEvent.id, FeedEvent.kind, FeedEvent.data)
+                    .filter(condition).order_by(FeedEvent.id).limit(READ_BATCH).all())
+
+    def _prune(self):
+        with self.app.app_context():
+            db.session.query(FeedEvent).filter(FeedEvent.id <= self.head - self.replay.maxlen).delete()
+            db.session.commit()
+
+    async def _pump(self):
+        loop = asyncio.get_running_loop()
+        interval = self.app.config['EVENTS_POLL_INTERVAL']
+        last_prune = time.monotonic()
+        while True:
+            try:
+                await asyncio.wait_for(self._woken.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+            self._woken.clear()
+            try:
+                rows = await loop.run_in_executor(None, self._read_new)
+                if time.monotonic() - last_prune > 60:
+                    last_prune = time.monotonic()
+                    await loop.run_in_executor(None, self._prune)
+            except Exception as e:
+                print(f"Reading feed events failed: {e}")
+                continue
+            self._deliver(rows)
+            if len(rows) == READ_BATCH:
+                self._woken.set()  # more waiting
+
+    def _deliver(self, rows):
+        now = time.monotonic()
+        frames = []
+        for event_id, kind, data in rows:
+            if event_id > self.head:
+                self._gaps.update((missing, now) for missing in range(self.head + 1, event_id) if self.head)
+                self.head = event_id
+            else:
+                self._gaps.pop(event_id, None)
+            encoded = frame(event_id, kind, data)
+            self.replay.append((event_id, encoded))
+            frames.append(encoded)
+        self._gaps = {event_id: since for event_id, since in self._gaps.items() if now - since < GAP_TIMEOUT}
+        if frames:
+            self.stats['events'] += len(frames)
+            self.broadcast(b''.join(frames))
+
+    def broadcast(self, data):
+        """Write data to every subscriber, one write each."""
+        for client in list(self.clients):
+            client.send(data)
+        self.stats['bytes_sent'] += len(data) * len(self.clients)
+
+    async def _keepalive(self):
+        # A comment line now and then keeps proxies from timing idle streams out
+        # and finds connections that went away without a FIN
+        while True:
+            await asyncio.sleep(self.app.config['EVENTS_KEEPALIVE'])
+            self.broadcast(b': keepalive\n\n')
+
+    # Requests
+
+    def handle(self, subscriber, request):
+        lines = request.split(b'\r\n\r\n', 1)[0].decode('latin-1').split('\r\n')
+        parts = lines[0].split()
+        headers = dict(line.split(':', 1) for line in lines[1:] if ':' in line)
+        headers = {name.strip().lower(): value.strip() for name, value in headers.items()}
+        target = urlsplit(parts[1] if len(parts) > 1 else '/')
+        transport = subscriber.transport
+
+        if parts[0] != 'GET' or target.path not in ('/events', '/events/stats'):
+            transport.write(b'HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+            transport.close()
+            return
+        if target.path == '/events/stats':
+            body = json.dumps(dict(self.stats, clients=len(self.clients), head=self.head)).encode()
+            transport.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nAccess-Control-Allow-Origin: *\r\n'
+                            b'Content-Length: %d\r\nConnection: close\r\n\r\n' % len(body) + body)
+            transport.close()
+            return
+
+        last_id = headers.get('last-event-id') or parse_qs(target.query).get('last_event_id', [None])[0]
+        subscriber.send(_RESPONSE_HEAD + b'retry: 3000\n\n' + self._catch_up(last_id))
+        self.clients.add(subscriber)
+        self.stats['connections'] += 1
+
+    def _catch_up(self, last_id):
+        """What a browser that last saw last_id has missed."""
+        try:
+            last_id = int(last_id)
+        except (TypeError, ValueError):
+            # A new subscriber: give it a resume token and nothing else
+            return f'id: {self.head}\nevent: hello\ndata: {{}}\n\n'.encode()
+        missed = []
+        for event_id, encoded in reversed(self.replay):
+            if event_id <= last_id:
+                break
+            missed.append(encoded)
+        else:
+            if len(self.replay) == self.replay.maxlen:
+                missed = None  # older events may have been missed too
+        if missed is None or last_id > self.head:
+            # Too far back (or from another database): start over from the current feed
+            self.stats['reset'] += 1
+            return f'id: {self.head}\nevent: reset\ndata: {{}}\n\n'.encode()
+        self.stats['resumed'] += 1
+        return b''.join(reversed(missed))
+
+
+def _raise_open_file_limit():
+    """Every connection is a file descriptor; the default soft limit is often 1024."""
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError, OSError):
+        pass
@@ -0,0 +1,157 @@
+"""Read and write GeoJSON FeatureCollections one feature at a time.
+
+iter_features() walks the top-level object with the standard library's
+JSONDecoder.raw_decode over a sliding text buffer, so only the feature being
+decoded (plus one read chunk) is held in memory rather than the whole
+document. Processing steps are plain generators chained onto it, e.g.
+
+    features = project_properties(map.label_cosewic_status(iter_features(path)), fields)
+    write_feature_collection(features, out_path)
+
+Run ``python geojson_stream.py IN OUT --fields a,b`` to write a trimmed copy.
+"""
+import argparse
+import json
+import os
+
+# Characters read from the file at a time
+CHUNK_SIZE = 1 << 20
+
+_WHITESPACE = ' \t\n\r'
+
+
+class _Reader:
+    """A text buffer over a file that JSON values are decoded from in order."""
+
+    def __init__(self, f, chunk_size):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def fill(self, size):
+        """Read at least size more characters; False once the file is exhausted."""
+        chunk = self.f.read(size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Return the next non-whitespace character without consuming it ('' at the end)."""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer) or not self.fill(self.chunk_size):
+                return self.buffer[self.pos:self.pos + 1]
+
+    def expect(self, chars):
+        """Consume the next non-whitespace character, which must be one of chars."""
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError(f"Expected one of {chars!r} at character {self.pos}, found {char!r}")
+        self.pos += 1
+        return char
+
+    def decode(self):
+        """Decode the next JSON value."""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+                end = None
+            # A value that stops at the end of the buffer may continue in the next chunk
+            if end is not None and (end < len(self.buffer) or self.eof):
+                self.pos = end
+                return value
+            # Grow the read with the pending value so a huge feature costs linear, not quadratic, time
+            self.fill(max(self.chunk_size, len(self.buffer) - self.pos))
+
+
+def iter_features(path, members=None, chunk_size=CHUNK_SIZE):
+    """Yield the features of a GeoJSON FeatureCollection file one at a time.
+
+    The other top-level members (crs, name, ...) are stored in the members
+    dict as they are passed; those written before "features", as is usual,
+    are available by the time the first feature is yielded.
+    """
+    members = {} if members is None else members
+    with open(path, 'r', encoding='utf-8') as f:
+        reader = _Reader(f, chunk_size)
+        reader.expect('{')
+        if reader.peek() == '}':
+            return
+        while True:
+            key = reader.decode()
+            reader.expect(':')
+            if key == 'features':
+                reader.expect('[')
+                if reader.peek() == ']':
+                    reader.pos += 1
+                else:
+                    while True:
+                        yield reader.decode()
+                        if reader.expect(',]') == ']':
+                            break
+            else:
+                members[key] = reader.decode()
+            if reader.expect(',}') == '}':
+                return
+
+
+def project_properties(features, fields):
+    """Keep only the listed properties of each feature."""
+    for feature in features:
+        properties = feature.get('properties') or {}
+        feature['properties'] = {field: properties.get(field) for field in fields}
+        yield feature
+
+
+def write_feature_collection(features, path, members=None):
+    """Write features to path as a FeatureCollection without holding them all; returns the count.
+
+    The file is written next to path and renamed into place, so readers
+    never see a partial file.
+    """
+    def header():
+        # Built once the first feature is in hand, so members filled by iter_features are included
+        parts = ['{"type":"FeatureCollection"']
+        for key, value in (members or {}).items():
+            if key not in ('type', 'features'):
+                parts.append(f',{json.dumps(key)}:{json.dumps(value, separators=(",", ":"))}')
+        return ''.join(parts) + ',"features":[\n'
+
+    count = 0
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for feature in features:
+            f.write(',\n' if count else header())
+            f.write(json.dumps(feature, separators=(',', ':')))
+            count += 1
+        f.write('\n]}\n' if count else header() + ']}\n')
+    os.replace(tmp_path, path)
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a trimmed copy of a GeoJSON FeatureCollection.")
+    parser.add_argument('source')
+    parser.add_argument('target')
+    parser.add_argument('--fields', required=True, help='comma-separated properties to keep')
+    args = parser.parse_args()
+
+    members = {}
+    features = project_properties(iter_features(args.source, members), args.fields.split(','))
+    count = write_feature_collection(features, args.target, members)
+    print(f"Wrote {count} features to {args.target}")
+
+
+if __name__ == '__main__':
+    main()
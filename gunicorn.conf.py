@@ -0,0 +1,57 @@
+"""Production server settings; gunicorn reads this file from the working directory.
+
+    flask --app app migrate      # once per deploy
+    gunicorn                     # serves app:create_app()
+
+Worker and thread counts follow the CPU count and can be set with
+WEB_CONCURRENCY and WEB_THREADS (or gunicorn's own -w/--threads flags).
+Threads matter here: requests spend much of their time in SQLite, file
+I/O and the upstream tile servers, all of which release the GIL.
+
+The app is loaded once in the master and forked into the workers, so they
+share its memory pages and a broken deploy fails before any worker starts.
+Send SIGHUP for a graceful reload: new workers start before old ones are
+told to finish their requests (with preload the code itself is only
+re-read on a full restart, or on SIGUSR2 to swap in a new master).
+
+Run the background jobs in their own process (flask --app app
+run-scheduler) rather than with SCHEDULER_ENABLED in the web workers, and
+the live feed's event hub (flask --app app serve-events) next to gunicorn:
+its idle /events connections would each hold a gthread worker thread here.
+"""
+import multiprocessing
+import os
+
+wsgi_app = 'app:create_app()'
+bind = os.environ.get('BIND', f"0.0.0.0:{os.environ.get('PORT', '8000')}")
+
+cpus = multiprocessing.cpu_count()
+workers = int(os.environ.get('WEB_CONCURRENCY', 2 * cpus + 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('WEB_THREADS', 4))
+preload_app = True
+
+# Long map renders and upstream tile fetches are still well inside this
+timeout = int(os.environ.get('WEB_TIMEOUT', 60))
+graceful_timeout = 30
+keepalive = 5
+# Recycle workers now and then so a slow leak can't grow without bound
+max_requests = int(os.environ.get('WEB_MAX_REQUESTS', 10000))
+max_requests_jitter = max_requests // 10
+
+accesslog = os.environ.get('ACCESS_LOG')  # e.g. '-' for stdout
+errorlog = '-'
+
+
+def post_fork(server, worker):
+    """Give each worker its own database connections instead of the master's."""
+    from models import db
+    with worker.app.wsgi().app_context():
+        db.engine.dispose(close=False)
+
+
+def worker_exit(server, worker):
+    """Write out buffered vote counters before the worker goes away."""
+    from votes import vote_buffer
+    if vote_buffer.app is not None:
+        vote_buffer.flush()
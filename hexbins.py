@@ -0,0 +1,311 @@
+"""Hexagon bins of the drought impact points, one level per zoom.
+
+Drawing every drought impact site as its own marker doesn't scale, so the
+map shows them binned into hexagons about HEX_PIXELS wide on screen. For
+each zoom in HEX_ZOOMS the points (projected to Web Mercator metres once)
+are snapped to a pointy-top hexagonal grid with a vectorized cube rounding,
+and every occupied cell gets its count per IMPACT class. The dominant class
+colours the cell and the count sets its opacity.
+
+Cells are stored sorted by the tile holding their centre, so a tile request
+is two binary searches plus the GeoJSON for at most a few dozen hexagons.
+Zooms past the last level reuse its cells. The pyramid is saved as an .npz
+under pyramid.PYRAMID_DIR and rebuilt when the source file's size or mtime
+changes; spatial.refresh() rebuilds it along with the drought index.
+
+    python hexbins.py              # (re)build the pyramid, print a size report
+"""
+import functools
+import json
+import math
+import os
+import threading
+from html import escape
+
+import numpy as np
+import shapely
+
+import map as map_builder
+import pyramid
+import spatial
+
+# Width of a hexagon on screen, in pixels
+HEX_PIXELS = 40
+HEX_ZOOMS = range(0, 15)
+
+EARTH_RADIUS = spatial.EARTH_RADIUS
+WORLD_HALF = math.pi * EARTH_RADIUS  # half the width of the Web Mercator square, in metres
+SQRT3 = math.sqrt(3)
+
+# Corners of a pointy-top hexagon of circumradius 1, closed
+HEX_CORNERS = np.array([(math.cos(math.radians(a)), math.sin(math.radians(a))) for a in range(30, 391, 60)])
+
+MISSING_COLOR = '#9E9E9E'
+
+
+def cache_path():
+    return os.path.join(pyramid.PYRAMID_DIR, 'drought_impact.hexbins.npz')
+
+
+def hex_size(zoom):
+    """Circumradius in metres of the hexagons at zoom (HEX_PIXELS across the flats)."""
+    metres_per_pixel = 2 * WORLD_HALF / (256 * 2 ** zoom)
+    return HEX_PIXELS * metres_per_pixel / SQRT3
+
+
+def lonlat_to_web_mercator(coords):
+    """Convert an (n, 2) array of EPSG:4326 degrees to EPSG:3857 metres."""
+    coords = np.asarray(coords, dtype=float)
+    lat = np.radians(np.clip(coords[:, 1], -85.05112878, 85.05112878))
+    return np.column_stack([EARTH_RADIUS * np.radians(coords[:, 0]), EARTH_RADIUS * np.log(np.tan(np.pi / 4 + lat / 2))])
+
+
+def hex_cells(xy, size):
+    """Axial (q, r) coordinates of the hexagon of circumradius size holding each point."""
+    q = (SQRT3 / 3 * xy[:, 0] - xy[:, 1] / 3) / size
+    r = (2 / 3 * xy[:, 1]) / size
+    s = -q - r
+    rq, rr, rs = np.rint(q), np.rint(r), np.rint(s)
+    dq, dr, ds = np.abs(rq - q), np.abs(rr - r), np.abs(rs - s)
+    # Cube rounding: fix the component that moved most so q + r + s stays 0
+    fix_q = (dq > dr) & (dq > ds)
+    fix_r = ~fix_q & (dr > ds)
+    rq = np.where(fix_q, -rr - rs, rq)
+    rr = np.where(fix_r, -rq - rs, rr)
+    return rq.astype(np.int64), rr.astype(np.int64)
+
+
+def hex_centers(q, r, size):
+    return np.column_stack([size * SQRT3 * (q + r / 2), size * 1.5 * r])
+
+
+def tile_keys(centers, zoom):
+    """x * 2**zoom + y of the tile holding each point."""
+    n = 2 ** zoom
+    tx = np.clip(((centers[:, 0] + WORLD_HALF) / (2 * WORLD_HALF) * n).astype(np.int64), 0, n - 1)
+    ty = np.clip(((WORLD_HALF - centers[:, 1]) / (2 * WORLD_HALF) * n).astype(np.int64), 0, n - 1)
+    return tx * n + ty
+
+
+class HexLevel:
+    """The occupied cells of one zoom, sorted by tile: axial coordinates and counts per class."""
+
+    def __init__(self, zoom, q, r, class_counts):
+        self.zoom = zoom
+        self.size = hex_size(zoom)
+        self.q, self.r, self.class_counts = q, r, class_counts
+        self.counts = class_counts.sum(axis=1)
+        self.dominant = class_counts.argmax(axis=1)
+        self.centers = hex_centers(q, r, self.size)
+        self.tiles = tile_keys(self.centers, zoom)
+        self.max_count = int(self.counts.max()) if len(self.counts) else 0
+
+    @classmethod
+    def build(cls, zoom, xy, classes, n_classes):
+        q, r = hex_cells(xy, hex_size(zoom))
+        keys = (q << 32) | (r & 0xFFFFFFFF)
+        cells, inverse = np.unique(keys, return_inverse=True)
+        class_counts = np.bincount(inverse * n_classes + classes, minlength=len(cells) * n_classes)
+        class_counts = class_counts.reshape(-1, n_classes).astype(np.uint32)
+        q = (cells >> 32).astype(np.int32)
+        r = (cells & 0xFFFFFFFF).astype(np.uint32).view(np.int32)
+        order = np.argsort(tile_keys(hex_centers(q, r, hex_size(zoom)), zoom), kind='stable')
+        return cls(zoom, q[order], r[order], class_counts[order])
+
+    def cells_in_tile(self, z, x, y):
+        """Indices of the cells whose centre lies in tile (z, x, y), for z at or past this level."""
+        shift = z - self.zoom
+        key = (x >> shift) * 2 ** self.zoom + (y >> shift)
+        start, end = np.searchsorted(self.tiles, [key, key + 1])
+        cells = np.arange(start, end)
+        if shift:
+            # A deeper tile only covers part of this level's tile
+            n = 2 ** z
+            tile_width = 2 * WORLD_HALF / n
+            west, north = x * tile_width - WORLD_HALF, WORLD_HALF - y * tile_width
+            centers = self.centers[cells]
+            inside = ((centers[:, 0] >= west) & (centers[:, 0] < west + tile_width)
+                      & (centers[:, 1] <= north) & (centers[:, 1] > north - tile_width))
+            cells = cells[inside]
+        return cells
+
+
+class HexPyramid:
+    """Hexagon bins of a point layer for every zoom in HEX_ZOOMS."""
+
+    def __init__(self, classes, levels):
+        self.classes = list(classes)
+        self.levels = levels  # zoom -> HexLevel
+        self.colors = [map_builder.DROUGHT_IMPACT_COLOR_MAP.get(c, MISSING_COLOR) for c in self.classes]
+        self.labels = [escape(map_builder.DROUGHT_IMPACT_LABELS.get(c, c or 'Unknown')) for c in self.classes]
+
+    @classmethod
+    def build(cls, xy, impacts, zooms=HEX_ZOOMS):
+        """Bin points at xy (Web Mercator metres) with their IMPACT codes."""
+        classes, codes = np.unique(np.asarray(impacts, dtype=str), return_inverse=True)
+        codes = codes.reshape(-1)
+        return cls(classes, {zoom: HexLevel.build(zoom, xy, codes, len(classes)) for zoom in zooms})
+
+    @classmethod
+    def from_index(cls, index):
+        """Bin the points of a spatial.FeatureIndex (in lon/lat)."""
+        coords, owners = shapely.get_coordinates(index.geometries, return_index=True)
+        impacts = [properties.get('IMPACT') or '' for properties in index.properties]
+        return cls.build(lonlat_to_web_mercator(coords), np.asarray(impacts, dtype=str)[owners])
+
+    def save(self, path, source_stat):
+        arrays = {'classes': np.asarray(self.classes, dtype=str),
+                  'source': np.array([source_stat.st_size, source_stat.st_mtime_ns])}
+        for zoom, level in self.levels.items():
+            arrays.update({f'z{zoom}_q': level.q, f'z{zoom}_r': level.r, f'z{zoom}_counts': level.class_counts})
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        # Written aside and swapped in: workers may be loading it while the scheduler saves it
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, source_stat):
+        """Load a saved pyramid, or return None if it is missing or older than the source."""
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as stored:
+            if list(stored['source']) != [source_stat.st_size, source_stat.st_mtime_ns]:
+                return None
+            zooms = sorted(int(name[1:-2]) for name in stored.files if name.endswith('_q'))
+            levels = {zoom: HexLevel(zoom, stored[f'z{zoom}_q'], stored[f'z{zoom}_r'], stored[f'z{zoom}_counts'])
+                      for zoom in zooms}
+            return cls(stored['classes'].tolist(), levels)
+
+    def level_for(self, zoom):
+        """The level a tile at zoom is cut from: its own, or the deepest one."""
+        return self.levels.get(zoom) or self.levels[max(self.levels)]
+
+    def render(self, z, x, y):
+        """Return the tile's hexagons as a GeoJSON FeatureCollection string."""
+        level = self.level_for(z)
+        cells = level.cells_in_tile(z, x, y)
+        decimals = max(0, math.ceil(-math.log10(pyramid.tolerance_for(z) / 4)))
+        corners = level.centers[cells][:, None, :] + HEX_CORNERS * level.size
+        rings = np.round(spatial.web_mercator_to_lonlat(corners.reshape(-1, 2)), decimals).reshape(-1, 7, 2).tolist()
+        scale = math.log1p(level.max_count) or 1
+
+        pieces = []
+        for cell, ring in zip(cells, rings):
+            count, dominant = int(level.counts[cell]), level.dominant[cell]
+            opacity = round(0.3 + 0.5 * math.log1p(count) / scale, 2)
+            rows = ''.join(f'<tr><th>{label}</th><td>{n:,}</td></tr>'
+                           for label, n in zip(self.labels, level.class_counts[cell].tolist()) if n)
+            pieces.append(
+                '{"type":"Feature","geometry":{"type":"Polygon","coordinates":[' + str(ring).replace(' ', '') + ']},'
+                f'"properties":{{"count":{count},"impact":{json.dumps(self.classes[dominant])},'
+                f'"style":{{"color":"{self.colors[dominant]}","weight":1,"fillColor":"{self.colors[dominant]}",'
+                f'"fillOpacity":{opacity}}},'
+                f'"tooltip":"<table><tr><th>Drought impact sites</th><td>{count:,}</td></tr>{rows}</table>"}}}}'
+            )
+        return '{"type":"FeatureCollection","features":[' + ','.join(pieces) + ']}'
+
+
+_pyramid = None
+_loaded_from = None  # source file (size, mtime) _pyramid was loaded from
+_loaded = False
+_lock = threading.Lock()
+_build_lock = threading.Lock()  # one (re)load at a time
+
+
+def _source_stat():
+    try:
+        return os.stat(spatial.LAYER_SOURCES['drought_impact'])
+    except OSError:
+        return None
+
+
+def _stat_key(source_stat):
+    return (source_stat.st_size, source_stat.st_mtime_ns) if source_stat is not None else None
+
+
+def _build(index=None):
+    """Load the saved pyramid if it is fresh, else build and save it (None if there is no data)."""
+    source_stat = _source_stat()
+    if source_stat is None:
+        return None
+    built = HexPyramid.load(cache_path(), source_stat)
+    if built is None:
+        # The index for this source, not an older one still being served during a reload
+        index = index if index is not None else spatial.get_index('drought_impact', wait=True)
+        if index is None:
+            return None
+        built = HexPyramid.from_index(index)
+        built.save(cache_path(), source_stat)
+    return built
+
+
+def get_pyramid():
+    """Return the drought impact HexPyramid, loading or building it on first use.
+
+    It is loaded again once the source file changes, so a rebuild() done in
+    another process (the scheduler) reaches every worker. While one request
+    reloads it, the others keep getting the old pyramid.
+    """
+    global _pyramid, _loaded_from, _loaded
+    key = _stat_key(_source_stat())
+    if _loaded and _loaded_from == key:
+        return _pyramid
+    # Only the first load waits for another request's build
+    if not _build_lock.acquire(blocking=not _loaded):
+        return _pyramid
+    try:
+        if not _loaded or _loaded_from != key:
+            built = _build()
+            with _lock:
+                _pyramid, _loaded_from, _loaded = built, key, True
+        return _pyramid
+    finally:
+        _build_lock.release()
+
+
+def rebuild(index=None):
+    """Build the pyramid again (from index, a freshly loaded drought FeatureIndex) and swap it in."""
+    global _pyramid, _loaded_from, _loaded
+    key = _stat_key(_source_stat())
+    built = _build(index)
+    with _lock:
+        _pyramid, _loaded_from, _loaded = built, key, True
+    _render_tile.cache_clear()
+    return built
+
+
+def render_tile(z, x, y):
+    """Return a tile of drought impact hexagons as GeoJSON bytes, or None if there is no data."""
+    hexes = get_pyramid()
+    return _render_tile(hexes, z, x, y) if hexes is not None else None
+
+
+# Keyed by the pyramid itself, so tiles of a replaced pyramid are never served
+@functools.lru_cache(maxsize=4096)
+def _render_tile(hexes, z, x, y):
+    return hexes.render(z, x, y).encode()
+
+
+def reset():
+    """Forget the loaded pyramid and rendered tiles."""
+    global _pyramid, _loaded_from, _loaded
+    with _lock:
+        _pyramid, _loaded_from, _loaded = None, None, False
+    _render_tile.cache_clear()
+
+
+def main():
+    hexes = rebuild()
+    if hexes is None:
+        print(f"No drought impact data at {spatial.LAYER_SOURCES['drought_impact']}")
+        return
+    print(f"{'zoom':>4} {'hex km':>8} {'cells':>10} {'largest':>8}")
+    for zoom, level in hexes.levels.items():
+        print(f"{zoom:4d} {level.size * SQRT3 / 1000:8.2f} {len(level.counts):10,d} {level.max_count:8,d}")
+    print(f"{cache_path()}: {os.path.getsize(cache_path()):,d} bytes")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+"""Binary columnar cache of the map's vector layers.
+
+Parsing text GeoJSON is the slowest part of loading a layer, so each layer
+is also kept as an uncompressed Arrow IPC (Feather v2) file under
+LAYER_CACHE_DIR: a WKB geometry column already in lon/lat (EPSG:4326), an
+id column and one column per property the styles and tooltips use. The
+file is memory-mapped on load and the geometries are decoded in one
+vectorized shapely.from_wkb call.
+
+The file carries GeoParquet-style "geo" metadata, so geopandas.read_feather
+can open it too. A cache file is used only while the source GeoJSON's size
+and mtime and the requested properties match what it was built from;
+otherwise the layer is streamed from the GeoJSON and the cache rewritten.
+
+    python layer_cache.py          # (re)build the cache for every layer
+"""
+import json
+import os
+import threading
+from collections import namedtuple
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from shapely.geometry import shape
+
+try:
+    import pyarrow as pa
+except ImportError:  # without pyarrow every load streams the GeoJSON
+    pa = None
+
+LAYER_CACHE_DIR = os.environ.get('LAYER_CACHE_DIR', 'cache/layers')
+
+# Bump when the file layout changes so old caches are rebuilt
+CACHE_FORMAT = 1
+
+# Rows per record batch; geometries are decoded a batch at a time
+BATCH_SIZE = 10000
+
+# A loaded layer: geometries (numpy object array), property dicts and feature ids, all aligned
+LayerData = namedtuple('LayerData', ['geometries', 'properties', 'ids'])
+
+
+def layer_from_features(features):
+    """Collect a LayerData from an iterable of GeoJSON features in one pass."""
+    geometries, properties, ids = [], [], []
+    for i, feature in enumerate(features):
+        geometries.append(shape(feature['geometry']))
+        properties.append(feature.get('properties') or {})
+        ids.append(feature.get('id', i))
+    return LayerData(np.array(geometries, dtype=object), properties, ids)
+
+
+def iter_layer_features(data):
+    """Yield a LayerData back as GeoJSON feature dicts."""
+    for geometry, properties, feature_id in zip(shapely.to_geojson(data.geometries), data.properties, data.ids):
+        yield {'type': 'Feature', 'id': feature_id, 'geometry': json.loads(geometry), 'properties': properties}
+
+
+def layer_frame(data):
+    """A GeoDataFrame of a LayerData: one column per property, indexed by feature id."""
+    properties = pd.DataFrame.from_records(data.properties, index=pd.Index(data.ids, name='id'))
+    return gpd.GeoDataFrame(properties, geometry=data.geometries, crs='EPSG:4326')
+
+
+def frame_layer(frame):
+    """The LayerData of a GeoDataFrame, with missing values as None."""
+    properties = frame.drop(columns=frame.geometry.name).astype(object)
+    properties = properties.where(properties.notna(), None)
+    return LayerData(frame.geometry.to_numpy(), properties.to_dict('records'), frame.index.tolist())
+
+
+def cache_path(name, directory=LAYER_CACHE_DIR):
+    return os.path.join(directory, f'{name}.arrow')
+
+
+def _column(values):
+    """An Arrow array for values, falling back to strings for mixed-type columns."""
+    try:
+        return pa.array(values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return pa.array([None if value is None else str(value) for value in values])
+
+
+def _cache_key(source_stat, fields):
+    return {'format': CACHE_FORMAT, 'source_size': source_stat.st_size,
+            'source_mtime_ns': source_stat.st_mtime_ns, 'fields': list(fields)}
+
+
+def save_layer(path, data, fields, source_stat):
+    """Write data as an Arrow IPC file, atomically."""
+    columns = {'geometry': pa.array(shapely.to_wkb(data.geometries), type=pa.binary()), 'id': _column(data.ids)}
+    for field in fields:
+        columns[field] = _column([properties.get(field) for properties in data.properties])
+    geo = {'version': '1.0.0', 'primary_column': 'geometry',
+           'columns': {'geometry': {'encoding': 'WKB', 'geometry_types': []}}}  # no crs: OGC:CRS84 (lon/lat)
+    metadata = {'geo': json.dumps(geo), 'layer_cache': json.dumps(_cache_key(source_stat, fields))}
+    table = pa.table(columns).replace_schema_metadata(metadata)
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'  # one per writer: workers and the scheduler may race
+    with pa.OSFile(tmp_path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table, max_chunksize=BATCH_SIZE)
+    os.replace(tmp_path, path)
+
+
+def read_layer(path, fields, source_stat):
+    """Read a cached layer, or return None if it is missing or stale."""
+    if not os.path.exists(path):
+        return None
+    with pa.memory_map(path) as source:
+        reader = pa.ipc.open_file(source)
+        stored = json.loads((reader.schema.metadata or {}).get(b'layer_cache', b'{}'))
+        if stored != _cache_key(source_stat, fields):
+            return None
+        table = reader.read_all()
+        # Decoding chunk by chunk avoids holding a Python bytes copy of every WKB at once
+        geometries = np.concatenate([shapely.from_wkb(chunk.to_numpy(zero_copy_only=False))
+                                     for chunk in table.column('geometry').chunks] or [np.array([], dtype=object)])
+        values = [table.column(field).to_pylist() for field in fields]
+        ids = table.column('id').to_pylist()
+    properties = [dict(zip(fields, row)) for row in zip(*values)] if fields else [{} for _ in ids]
+    return LayerData(geometries, properties, ids)
+
+
+def load_layer(name, source_path, stream, fields, directory=LAYER_CACHE_DIR):
+    """Load a layer from its cache if fresh, else from stream() and refresh the cache.
+
+    stream() must return the layer's features (in lon/lat, trimmed to
+    fields) or None; it is only called when the cache can't be used.
+    Returns a LayerData, or None if the source file is missing.
+    """
+    if not os.path.exists(source_path):
+        print(f"File {source_path} does not exist.")
+        return None
+    source_stat = os.stat(source_path)
+    path = cache_path(name, directory)
+    if pa is not None:
+        data = read_layer(path, fields, source_stat)
+        if data is not None:
+            return data
+
+    features = stream()
+    if features is None:
+        return None
+    data = layer_from_features(features)
+    if pa is not None:
+        save_layer(path, data, fields, source_stat)
+    return data
+
+
+def main():
+    import spatial
+
+    for name in spatial.QUERY_LAYERS:
+        path = cache_path(name)
+        if os.path.exists(path):
+            os.remove(path)  # force a rebuild from the GeoJSON
+        index = spatial.get_index(name)
+        if index is None:
+            print(f"{name:<18} no data")
+        else:
+            print(f"{name:<18} {len(index.ids):>8} features  {os.path.getsize(cache_path(name)):>12,} bytes")
+
+
+if __name__ == '__main__':
+    main()
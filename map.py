@@ -1,8 +1,26 @@
 import folium
 import os
+import re
+import sys
 import json
+import time
+import hashlib
+import inspect
+import threading
 import requests
+import numpy as np
+import pandas as pd
+from collections import namedtuple
+from jinja2 import Template
+from branca.element import Element, MacroElement
+from folium.map import Layer
 from folium.plugins import Draw
+from folium.utilities import get_obj_in_upper_tree
+
+import assets
+import layer_cache
+from geojson_stream import iter_features, project_properties
+
 # Map species + population to unique colors as shown in the legend
 SPECIES_POPULATION_COLOR_MAP = {
     ("Barren-ground Caribou", "Dolphin and Union"): "#D462FF",  # Purple
@@ -17,6 +35,248 @@ SPECIES_POPULATION_COLOR_MAP = {
 # Local path for the saved Priority Species GeoJSON file
 PRIORITY_SPECIES_FILE_PATH = 'static/priority_species.geojson'
 
+# Local path for the Vegetation Zones GeoJSON file
+VEGETATION_ZONES_FILE_PATH = 'static/vegetation_map.geojson'
+
+# Local path for the 2023 drought impact points (EPSG:3857)
+DROUGHT_IMPACT_FILE_PATH = 'static/drought_2023_impact.geojson'
+
+# Drought impact classes (the IMPACT property) with their labels and colors
+DROUGHT_IMPACT_LABELS = {'S': 'Short-term', 'L': 'Long-term', 'SL': 'Short- and long-term'}
+DROUGHT_IMPACT_COLOR_MAP = {'S': '#FBC02D', 'L': '#8D6E63', 'SL': '#E64A19'}
+
+# Define a color map based on vegetation names
+VEGETATION_COLOR_MAP = {
+    "High Arctic Sparse Tundra": "#D4E157",
+    "Mid-Arctic Dwarf Shrub Tundra": "#FFEB3B",
+    "Low Arctic Shrub Tundra": "#FFC107",
+    "Subarctic Alpine Tundra": "#FF9800",
+    "Western Boreal Alpine Tundra": "#F57C00",
+    "Cordilleran Alpine Tundra": "#E65100",
+    "Pacific Alpine Tundra": "#A5D6A7",
+    "Eastern Alpine Tundra": "#66BB6A",
+    "Subarctic Woodland-Tundra": "#81C784",
+    "Northern Boreal Woodland": "#4CAF50",
+    "Northwestern Boreal Forest": "#388E3C",
+    "West-Central Boreal Forest": "#2E7D32",
+    "Eastern Boreal Forest": "#1B5E20",
+    "Atlantic Maritime Heathland": "#26A69A",
+    "Pacific Maritime Rainforest": "#80CBC4",
+    "Pacific Dry Forest": "#00796B",
+    "Pacific Montane Forest": "#004D40",
+    "Cordilleran Subboreal Forest": "#8E24AA",
+    "Cordilleran Montane Forest": "#5E35B1",
+    "Cordilleran Rainforest": "#4527A0",
+    "Cordilleran Dry Forest": "#311B92",
+    "Eastern Temperate Mixed Forest": "#3949AB",
+    "Eastern Temperate Deciduous Forest": "#1E88E5",
+    "Acadian Temperate Forest": "#1976D2",
+    "Rocky Mountains Foothills Parkland": "#0D47A1",
+    "Great Plains Parkland": "#BBDEFB",
+    "Intermontane Shrub-Steppe": "#90CAF9",
+    "Rocky Mountains Foothills Fescue Grassland": "#64B5F6",
+    "Great Plains Fescue Grassland": "#42A5F5",
+    "Great Plains Mixedgrass Grassland": "#2196F3",
+    "Central Tallgrass Grassland": "#1E88E5",
+    "Cypress Hills": "#1565C0",
+    "Glaciers": "#0D47A1"
+}
+
+# Tooltip fields (and their labels) for the GeoJSON overlays
+SPECIES_TOOLTIP_FIELDS = ['CommName_E', 'Population_E', 'COSEWIC_Status_Label', 'SARA_Status']
+SPECIES_TOOLTIP_ALIASES = ['Species', 'Population', 'COSEWIC Status', 'SARA Status']
+VEGETATION_TOOLTIP_FIELDS = ['level_1']  # Adjust the field based on available fields in your GeoJSON
+VEGETATION_TOOLTIP_ALIASES = ['Vegetation Zone:']
+
+# Feature properties the styles and tooltips read; everything else is dropped on load
+SPECIES_FIELDS = ['CommName_E', 'Population_E', 'COSEWIC_Status', 'SARA_Status']
+VEGETATION_FIELDS = ['level_1', 'level_2']
+
+# Style shared by every feature of a layer; only the fill color varies
+SPECIES_STYLE = {'color': 'black', 'weight': 1, 'fillOpacity': 0.7}
+VEGETATION_STYLE = {'color': 'black', 'weight': 1, 'fillOpacity': 0.6}
+
+COSEWIC_STATUS_MAP = {
+    1: 'Extinct', 2: 'Extirpated', 3: 'Endangered', 4: 'Threatened', 5: 'Special Concern'
+}
+
+# How the GeoJSON overlays reach the browser: 'tiles' loads clipped and
+# simplified tiles from /tiles/<layer>/<z>/<x>/<y> as the user pans, 'inline'
+# embeds every feature in map.html
+MAP_VECTOR_SOURCE = os.environ.get('MAP_VECTOR_SOURCE', 'tiles')
+
+# WMS services for the image overlays
+CRITICAL_HABITAT_WMS_URL = 'https://maps-cartes.ec.gc.ca/arcgis/services/CWS_SCF/CriticalHabitat/MapServer/WMSServer'
+WILDFIRE_HOTSPOTS_WMS_URL = 'https://geo.weather.gc.ca/geomet'
+PROTECTED_AREAS_WMS_URL = 'https://maps-cartes.ec.gc.ca/arcgis/services/CWS_SCF/CPCAD/MapServer/WMSServer'
+
+# Basemap tile services
+OPENSTREETMAP_TILES_URL = 'https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png'
+ARCGIS_IMAGERY_TILES_URL = 'https://services.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}'
+
+# Whether the browser fetches WMS and basemap tiles through the caching /proxy
+# routes (tile_proxy.py) or straight from the upstream servers
+MAP_TILE_PROXY = os.environ.get('MAP_TILE_PROXY', '1') != '0'
+
+def tile_url(layer, upstream_url, tiled=False):
+    """URL the browser should load layer's tiles from: the proxy route, or upstream_url directly."""
+    if not MAP_TILE_PROXY:
+        return upstream_url
+    return f'/proxy/{layer}/{{z}}/{{x}}/{{y}}' if tiled else f'/proxy/{layer}'
+
+class GeoJsonTileLayer(Layer):
+    """An overlay drawn from GeoJSON tiles fetched as they come into view.
+
+    Each tile is a FeatureCollection from tiles.py whose features carry their
+    Leaflet style (and tooltip HTML) in properties, so no per-feature Python
+    callbacks are needed at build time.
+    """
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = new (L.GridLayer.extend({
+                initialize: function (options) {
+                    L.GridLayer.prototype.initialize.call(this, options);
+                    this._features = L.layerGroup();
+                    this._tileFeatures = {};
+                    this.on('tileunload', function (e) {
+                        var key = this._tileCoordsToKey(e.coords);
+                        if (this._tileFeatures[key]) {
+                            this._features.removeLayer(this._tileFeatures[key]);
+                            delete this._tileFeatures[key];
+                        }
+                    });
+                },
+                onAdd: function (map) {
+                    this._features.addTo(map);
+                    L.GridLayer.prototype.onAdd.call(this, map);
+                },
+                onRemove: function (map) {
+                    L.GridLayer.prototype.onRemove.call(this, map);
+                    this._features.clearLayers().remove();
+                    this._tileFeatures = {};
+                },
+                createTile: function (coords, done) {
+                    var tile = document.createElement('div');
+                    var key = this._tileCoordsToKey(coords);
+                    var self = this;
+                    fetch(L.Util.template({{ this.url|tojson }}, coords))
+                        .then(function (response) { return response.json(); })
+                        .then(function (data) {
+                            var features = L.geoJson(data, {
+                                style: function (feature) { return feature.properties.style; },
+                                onEachFeature: function (feature, layer) {
+                                    if (feature.properties.tooltip) {
+                                        layer.bindTooltip(feature.properties.tooltip, {sticky: true});
+                                    }
+                                }
+                            });
+                            // Skip tiles that scrolled away while the request was in flight
+                            if (self._map && self._tiles[key]) {
+                                self._tileFeatures[key] = features;
+                                self._features.addLayer(features);
+                            }
+                            done(null, tile);
+                        })
+                        .catch(function (error) { done(error, tile); });
+                    return tile;
+                }
+            }))({{ this.options|tojson }});
+        {% endmacro %}
+    """)
+
+    def __init__(self, url, name=None, overlay=True, control=True, show=True):
+        super().__init__(name=name, overlay=overlay, control=control, show=show)
+        self._name = 'GeoJsonTileLayer'
+        self.url = url
+        self.options = {'tileSize': 256, 'updateWhenZooming': False, 'keepBuffer': 1}
+
+# Ask /api/query what lies inside each drawn shape and show the counts in a popup
+QUERY_ON_DRAW_JS = '''
+    {map}.on('draw:created', function (e) {
+        fetch('/api/query', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify(e.layer.toGeoJSON())
+        })
+        .then(function (response) { return response.json(); })
+        .then(function (data) {
+            if (!data.success) { return; }
+            var labels = {priority_species: 'Priority species ranges', vegetation_zones: 'Vegetation zones',
+                          drought_impact: 'Drought impact sites'};
+            var lines = Object.keys(data.layers).map(function (name) {
+                return (labels[name] || name) + ': ' + data.layers[name].count;
+            });
+            e.layer.bindPopup(lines.join('<br>')).openPopup();
+        });
+    });
+'''
+
+class QueryOnDraw(MacroElement):
+    """Attaches QUERY_ON_DRAW_JS to its parent map; as a child its script runs after the map exists."""
+
+    _template = Template('{% macro script(this, kwargs) %}'
+                         + QUERY_ON_DRAW_JS.replace('{map}', '{{ this._parent.get_name() }}')
+                         + '{% endmacro %}')
+
+# Overlays start as empty groups in the LayerControl; the first time one is
+# switched on it loads its script, which builds the layer and passes it to
+# mapLayerLoaded. The legend follows the overlay most recently switched on.
+LAZY_LAYERS_JS = '''
+    var shownLegends = [];
+
+    function followLegend(legend, shown) {
+        var select = document.getElementById('legend-select');
+        if (!legend || !select) { return; }
+        var wasShowing = select.value === legend;
+        shownLegends = shownLegends.filter(function (other) { return other !== legend; });
+        if (shown) { shownLegends.push(legend); }
+        if (shownLegends.length && (shown || wasShowing)) {
+            select.value = shownLegends[shownLegends.length - 1];
+            showLegend();
+        }
+    }
+
+    var LazyMapLayer = L.LayerGroup.extend({
+        initialize: function (name, url, legend) {
+            L.LayerGroup.prototype.initialize.call(this);
+            this.name = name;
+            this.url = url;
+            this.legend = legend;
+            this.state = null;  // 'loading', then 'loaded'
+            LazyMapLayer.byName[name] = this;
+        },
+        onAdd: function (map) {
+            L.LayerGroup.prototype.onAdd.call(this, map);
+            followLegend(this.legend, true);
+            if (this.state) { return; }
+            var self = this;
+            var script = document.createElement('script');
+            script.src = this.url;
+            // Tried again the next time the layer is switched on
+            script.onerror = function () { self.state = null; };
+            this.state = 'loading';
+            document.head.appendChild(script);
+        },
+        onRemove: function (map) {
+            L.LayerGroup.prototype.onRemove.call(this, map);
+            followLegend(this.legend, false);
+        },
+        setZIndex: function (zIndex) {
+            this.zIndex = zIndex;  // for the layer that arrives later
+            return L.LayerGroup.prototype.setZIndex.call(this, zIndex);
+        }
+    });
+    LazyMapLayer.byName = {};
+
+    function mapLayerLoaded(name, layer) {
+        var group = LazyMapLayer.byName[name];
+        group.state = 'loaded';
+        if (group.zIndex !== undefined && layer.setZIndex) { layer.setZIndex(group.zIndex); }
+        group.addLayer(layer);
+    }
+'''
+
 def load_local_geojson(file_path):
     """Load local GeoJSON file and return it as a dictionary."""
     if os.path.exists(file_path):
@@ -26,58 +286,144 @@ def load_local_geojson(file_path):
         print(f"File {file_path} does not exist.")
         return None
 
+def stream_local_geojson(file_path, members=None):
+    """Return an iterator over a local GeoJSON file's features (None if the file is missing)."""
+    if not os.path.exists(file_path):
+        print(f"File {file_path} does not exist.")
+        return None
+    return iter_features(file_path, members)
+
+def label_cosewic_status(features):
+    """Add a COSEWIC_Status_Label property with the label for each feature's status code."""
+    for feature in features:
+        cosewic_status_code = feature['properties'].get('COSEWIC_Status')
+        feature['properties']['COSEWIC_Status_Label'] = COSEWIC_STATUS_MAP.get(cosewic_status_code, 'Unknown')
+        yield feature
+
 def preprocess_species_data(species_data):
     """Preprocess the GeoJSON data by replacing COSEWIC status codes with labels."""
-    COSEWIC_STATUS_MAP = {
-        1: 'Extinct', 2: 'Extirpated', 3: 'Endangered', 4: 'Threatened', 5: 'Special Concern'
-    }
-    for feature in species_data['features']:
-        cosewic_status_code = feature['properties'].get('COSEWIC_Status')
-        if cosewic_status_code in COSEWIC_STATUS_MAP:
-            feature['properties']['COSEWIC_Status_Label'] = COSEWIC_STATUS_MAP[cosewic_status_code]
-        else:
-            feature['properties']['COSEWIC_Status_Label'] = 'Unknown'
+    species_data['features'] = list(label_cosewic_status(species_data['features']))
     return species_data
 
+def stream_species_features():
+    """Stream the priority species features, trimmed to SPECIES_FIELDS (None if missing)."""
+    features = stream_local_geojson(PRIORITY_SPECIES_FILE_PATH)
+    return project_properties(features, SPECIES_FIELDS) if features is not None else None
+
+def stream_vegetation_features():
+    """Stream the vegetation zone features, trimmed to VEGETATION_FIELDS (None if missing)."""
+    features = stream_local_geojson(VEGETATION_ZONES_FILE_PATH)
+    return project_properties(features, VEGETATION_FIELDS) if features is not None else None
+
+def load_species_layer():
+    """Load the priority species layer, from the binary layer cache when it is fresh."""
+    return layer_cache.load_layer('priority_species', PRIORITY_SPECIES_FILE_PATH, stream_species_features,
+                                  SPECIES_FIELDS)
+
+def load_vegetation_layer():
+    """Load the vegetation zones layer, from the binary layer cache when it is fresh."""
+    return layer_cache.load_layer('vegetation_zones', VEGETATION_ZONES_FILE_PATH, stream_vegetation_features,
+                                  VEGETATION_FIELDS)
+
+def style_species(feature):
+    """Style function to color the species regions."""
+    species = feature['properties'].get('CommName_E', 'Unknown')
+    population = feature['properties'].get('Population_E', None)
+    color = SPECIES_POPULATION_COLOR_MAP.get((species, population), 'gray')
+    return {'fillColor': color, **SPECIES_STYLE}
+
+def style_vegetation(feature):
+    """Style function to color the vegetation zones."""
+    return {'fillColor': VEGETATION_COLOR_MAP.get(feature['properties']['level_2'], 'gray'), **VEGETATION_STYLE}
+
+def _map_categories(values, mapping, default):
+    """Look values up in mapping once per distinct value rather than once per row."""
+    categorical = values.astype('category').cat
+    # Missing values have code -1, which picks the trailing default
+    lookup = np.array([mapping.get(value, default) for value in categorical.categories] + [default], dtype=object)
+    return pd.Series(lookup[categorical.codes.to_numpy()], index=values.index)
+
+def prepare_species_frame(frame):
+    """Add the COSEWIC_Status_Label and fill_color columns to a species GeoDataFrame.
+
+    Both are categorical lookups, so the Python work is per distinct value,
+    not per feature; the result matches label_cosewic_status and style_species.
+    """
+    frame['COSEWIC_Status_Label'] = _map_categories(frame['COSEWIC_Status'], COSEWIC_STATUS_MAP, 'Unknown')
+    # (species, population) pairs as one key; None is kept apart from an empty population
+    keys = frame['CommName_E'].fillna('Unknown').astype(str) + '\x1f' + frame['Population_E'].fillna('\x00').astype(str)
+    colors = {f'{species}\x1f{population if population is not None else chr(0)}': color
+              for (species, population), color in SPECIES_POPULATION_COLOR_MAP.items()}
+    frame['fill_color'] = _map_categories(keys, colors, 'gray')
+    return frame
+
+def prepare_vegetation_frame(frame):
+    """Add the fill_color column to a vegetation GeoDataFrame."""
+    frame['fill_color'] = _map_categories(frame['level_2'], VEGETATION_COLOR_MAP, 'gray')
+    return frame
+
+def load_species_frame():
+    """The priority species layer as a GeoDataFrame with labels and fill colors (None if missing)."""
+    data = load_species_layer()
+    return prepare_species_frame(layer_cache.layer_frame(data)) if data is not None else None
+
+def load_vegetation_frame():
+    """The vegetation zones layer as a GeoDataFrame with fill colors (None if missing)."""
+    data = load_vegetation_layer()
+    return prepare_vegetation_frame(layer_cache.layer_frame(data)) if data is not None else None
+
+class PreStyledGeoJson(folium.GeoJson):
+    """A GeoJson layer filled from each feature's fill_color property.
+
+    With a style_function, folium calls it in Python for every feature and
+    writes a JS switch with a case per feature. Here the style is one JS
+    expression over the precomputed fill_color, with style for the rest.
+    """
+
+    def __init__(self, data, style, **kwargs):
+        super().__init__(data, **kwargs)
+        self.style = True
+        self.feature_identifier = 'null'
+        entries = [f'{json.dumps(key)}: {json.dumps(value)}' for key, value in style.items()]
+        self.style_map = {'default': '{' + ', '.join(entries + ['"fillColor": feature.properties.fill_color']) + '}'}
+
+    def render(self, **kwargs):
+        # Skip GeoJson.render, which rebuilds style_map from a style_function
+        self.parent_map = get_obj_in_upper_tree(self, folium.Map)
+        super(folium.GeoJson, self).render(**kwargs)
+
 def add_priority_species_layer(m):
-    """Add the priority species layer to the map."""
-    species_data = load_local_geojson(PRIORITY_SPECIES_FILE_PATH)
-    if species_data:
-        species_data = preprocess_species_data(species_data)
-
-        # Define a style function to color the species regions
-        def style_species(feature):
-            species = feature['properties'].get('CommName_E', 'Unknown')
-            population = feature['properties'].get('Population_E', None)
-            color = SPECIES_POPULATION_COLOR_MAP.get((species, population), 'gray')
-            return {
-                'fillColor': color,
-                'color': 'black',
-                'weight': 1,
-                'fillOpacity': 0.7
-            }
+    """Add the priority species layer to the map and return it (None if there is no data)."""
+    if MAP_VECTOR_SOURCE == 'tiles':
+        if not os.path.exists(PRIORITY_SPECIES_FILE_PATH):
+            print("No priority species data to load.")
+            return None
+        return GeoJsonTileLayer('/tiles/priority_species/{z}/{x}/{y}', name="Priority Species Data").add_to(m)
 
+    species_frame = load_species_frame()
+    if species_frame is not None:
         # Add species GeoJSON layer to the map
-        folium.GeoJson(
-            species_data,
+        return PreStyledGeoJson(
+            species_frame[SPECIES_TOOLTIP_FIELDS + ['fill_color', 'geometry']],
+            SPECIES_STYLE,
             name="Priority Species Data",
-            style_function=style_species,
             tooltip=folium.GeoJsonTooltip(
-                fields=['CommName_E', 'Population_E', 'COSEWIC_Status_Label', 'SARA_Status'],
-                aliases=['Species', 'Population', 'COSEWIC Status', 'SARA Status'],
+                fields=SPECIES_TOOLTIP_FIELDS,
+                aliases=SPECIES_TOOLTIP_ALIASES,
                 localize=True,
                 sticky=True
             )
         ).add_to(m)
     else:
         print("No priority species data to load.")
+        return None
 
 def add_critical_habitat_layer(m):
     """Add the critical habitat WMS layer to the map."""
     try:
         # Add the WMS layer from the provided WMS service
-        folium.WmsTileLayer(
-            url='https://maps-cartes.ec.gc.ca/arcgis/services/CWS_SCF/CriticalHabitat/MapServer/WMSServer',
+        return folium.WmsTileLayer(
+            url=tile_url('critical_habitat', CRITICAL_HABITAT_WMS_URL),
             layers='0',  # Layer ID for Critical Habitat (as found in GetCapabilities)
             name="Critical Habitat Data",
             fmt='image/png',  # WMS typically provides images like PNG
@@ -86,80 +432,49 @@ def add_critical_habitat_layer(m):
         ).add_to(m)
     except Exception as e:
         print(f"Error adding Critical Habitat WMS layer: {e}")
+        return None
 
 def add_vegetation_zones_layer(m):
-    """Add the Vegetation Zones GeoJSON layer to the map."""
-    # Local path for the Vegetation Zones GeoJSON file
-    VEGETATION_ZONES_FILE_PATH = 'static/vegetation_map.geojson'
-
-    # Define a color map based on vegetation names
-    VEGETATION_COLOR_MAP = {
-    "High Arctic Sparse Tundra": "#D4E157",
-    "Mid-Arctic Dwarf Shrub Tundra": "#FFEB3B",
-    "Low Arctic Shrub Tundra": "#FFC107",
-    "Subarctic Alpine Tundra": "#FF9800",
-    "Western Boreal Alpine Tundra": "#F57C00",
-    "Cordilleran Alpine Tundra": "#E65100",
-    "Pacific Alpine Tundra": "#A5D6A7",
-    "Eastern Alpine Tundra": "#66BB6A",
-    "Subarctic Woodland-Tundra": "#81C784",
-    "Northern Boreal Woodland": "#4CAF50",
-    "Northwestern Boreal Forest": "#388E3C",
-    "West-Central Boreal Forest": "#2E7D32",
-    "Eastern Boreal Forest": "#1B5E20",
-    "Atlantic Maritime Heathland": "#26A69A",
-    "Pacific Maritime Rainforest": "#80CBC4",
-    "Pacific Dry Forest": "#00796B",
-    "Pacific Montane Forest": "#004D40",
-    "Cordilleran Subboreal Forest": "#8E24AA",
-    "Cordilleran Montane Forest": "#5E35B1",
-    "Cordilleran Rainforest": "#4527A0",
-    "Cordilleran Dry Forest": "#311B92",
-    "Eastern Temperate Mixed Forest": "#3949AB",
-    "Eastern Temperate Deciduous Forest": "#1E88E5",
-    "Acadian Temperate Forest": "#1976D2",
-    "Rocky Mountains Foothills Parkland": "#0D47A1",
-    "Great Plains Parkland": "#BBDEFB",
-    "Intermontane Shrub-Steppe": "#90CAF9",
-    "Rocky Mountains Foothills Fescue Grassland": "#64B5F6",
-    "Great Plains Fescue Grassland": "#42A5F5",
-    "Great Plains Mixedgrass Grassland": "#2196F3",
-    "Central Tallgrass Grassland": "#1E88E5",
-    "Cypress Hills": "#1565C0",
-    "Glaciers": "#0D47A1"
-    }
-
+    """Add the Vegetation Zones GeoJSON layer to the map and return it (None if there is no data)."""
+    if MAP_VECTOR_SOURCE == 'tiles':
+        if not os.path.exists(VEGETATION_ZONES_FILE_PATH):
+            print("No vegetation data to load.")
+            return None
+        return GeoJsonTileLayer('/tiles/vegetation_zones/{z}/{x}/{y}', name="Vegetation Zones").add_to(m)
 
     # Load the GeoJSON data
-    vegetation_data = load_local_geojson(VEGETATION_ZONES_FILE_PATH)
+    vegetation_frame = load_vegetation_frame()
 
-    if vegetation_data:
+    if vegetation_frame is not None:
         # Add the GeoJSON layer to the map with a proper style and tooltip
-        folium.GeoJson(
-            vegetation_data,
+        return PreStyledGeoJson(
+            vegetation_frame[VEGETATION_TOOLTIP_FIELDS + ['fill_color', 'geometry']],
+            VEGETATION_STYLE,
             name="Vegetation Zones",
-            style_function=lambda feature: {
-                'fillColor': VEGETATION_COLOR_MAP.get(feature['properties']['level_2'], 'gray'),
-                'color': 'black',
-                'weight': 1,
-                'fillOpacity': 0.6
-            },
             tooltip=folium.GeoJsonTooltip(
-                fields=['level_1'],  # Adjust the field based on available fields in your GeoJSON
-                aliases=['Vegetation Zone:'],
+                fields=VEGETATION_TOOLTIP_FIELDS,
+                aliases=VEGETATION_TOOLTIP_ALIASES,
                 localize=True,
                 sticky=True
             )
         ).add_to(m)
     else:
         print("No vegetation data to load.")
+        return None
+
+def add_drought_impact_layer(m):
+    """Add the drought impact sites, binned into hexagons per zoom by hexbins.py (None if there is no data)."""
+    if not os.path.exists(DROUGHT_IMPACT_FILE_PATH):
+        print("No drought impact data to load.")
+        return None
+    return GeoJsonTileLayer('/clusters/drought_impact/{z}/{x}/{y}', name="Drought Impact Sites 2023").add_to(m)
 
 def add_wildfire_hotspots_layer(m):
     """Add the Wildfire hotspots WMS layer to the map."""
     try:
         # Add the WMS layer for RAQDPS-FW.CE_HOTSPOTS.2019
-        folium.WmsTileLayer(
-            url='https://geo.weather.gc.ca/geomet',
+        return folium.WmsTileLayer(
+            url=tile_url('wildfire_hotspots', WILDFIRE_HOTSPOTS_WMS_URL),
             layers='RAQDPS-FW.CE_HOTSPOTS.2019',
             name="Wildfire Hotspots 2019",
             fmt='image/png',
@@ -168,13 +483,14 @@ def add_wildfire_hotspots_layer(m):
         ).add_to(m)
     except Exception as e:
         print(f"Error adding Wildfire Hotspots WMS layer: {e}")
+        return None
 
 def add_protected_areas_wms_layer(m):
     """Add the protected areas WMS layer to the map."""
     try:
         # Add the WMS layer from the provided WMS service
-        folium.WmsTileLayer(
-            url='https://maps-cartes.ec.gc.ca/arcgis/services/CWS_SCF/CPCAD/MapServer/WMSServer',
+        return folium.WmsTileLayer(
+            url=tile_url('protected_areas', PROTECTED_AREAS_WMS_URL),
             layers='0',  # Layer ID for protected areas (as found in GetCapabilities)
             name="Protected Areas Data",
             fmt='image/png',  # WMS typically provides images like PNG
@@ -183,54 +499,290 @@ def add_protected_areas_wms_layer(m):
         ).add_to(m)
     except Exception as e:
         print(f"Error adding Protected Areas WMS layer: {e}")
+        return None
 
 
-def create_map():
-    """Create the interactive map with priority species and critical habitats."""
-    # Create base map centered on Canada
+# Where the generated map page and the per-layer build cache are written
+MAP_OUTPUT_PATH = os.environ.get('MAP_OUTPUT_PATH', 'templates/map.html')
+MAP_CACHE_DIR = os.environ.get('MAP_CACHE_DIR', 'cache/map')
+
+# Fixed variable name for the Leaflet map so cached layer scripts can refer to it
+MAP_ID = 'canada'
+
+# Whether map.html is a light shell whose overlays each fetch their script
+# from /map/layers/ when first switched on, or builds every overlay up front
+MAP_LAZY_LAYERS = os.environ.get('MAP_LAZY_LAYERS', '1') != '0'
+# Overlays switched on when a lazy map opens, e.g. "priority_species,drought_impact"
+MAP_DEFAULT_LAYERS = [name for name in os.environ.get('MAP_DEFAULT_LAYERS', 'priority_species').split(',') if name]
+# Where the overlay scripts are written, named by a hash of their content
+MAP_LAYER_DIR = os.environ.get('MAP_LAYER_DIR', os.path.join(MAP_CACHE_DIR, 'layers'))
+MAP_LAYER_URL = '/map/layers/'
+
+# An overlay built by `add`, fingerprinted from its input files, its config
+# and the source of the functions listed in `code`
+MapLayer = namedtuple('MapLayer', ['name', 'add', 'inputs', 'config', 'code'])
+
+
+class CachedLayer(Layer):
+    """A layer whose rendered header, HTML and script come from the build cache."""
+
+    def __init__(self, fragment):
+        self.fragment = fragment
+        super().__init__(name=fragment['layer_name'], overlay=fragment['overlay'],
+                         control=fragment['control'], show=fragment['show'])
+
+    def get_name(self):
+        return self.fragment['var_name']
+
+    def render(self, **kwargs):
+        figure = self.get_root()
+        for section in ('header', 'html', 'script'):
+            for name, rendered in self.fragment[section]:
+                getattr(figure, section).add_child(Element(rendered), name=name)
+
+
+class LazyLayer(Layer):
+    """An overlay listed in the LayerControl whose script is only fetched once it is switched on."""
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = new LazyMapLayer({{ this.layer|tojson }}, {{ this.url|tojson }}, {{ this.legend|tojson }});
+        {% endmacro %}
+    """)
+
+    def __init__(self, fragment, layer, url, legend=None, show=False):
+        super().__init__(name=fragment['layer_name'], overlay=fragment['overlay'],
+                         control=fragment['control'], show=show)
+        self._name = 'LazyLayer'
+        self._id = layer
+        self.fragment = fragment
+        self.layer = layer
+        self.url = url
+        self.legend = legend
+
+    def render(self, **kwargs):
+        # Styles (e.g. for tooltips) are small and stay in the page
+        figure = self.get_root()
+        for section in ('header', 'html'):
+            for name, rendered in self.fragment[section]:
+                getattr(figure, section).add_child(Element(rendered), name=name)
+        super().render(**kwargs)
+
+
+def _layer_script(name, fragment):
+    """The script that builds an overlay from its fragment and hands it to mapLayerLoaded."""
+    var_name = fragment['var_name']
+    add_to_map = re.compile(rf'\s*{re.escape(var_name)}\.addTo\(map_{MAP_ID}\);\s*')
+    parts = [rendered for _, rendered in fragment['script'] if not add_to_map.fullmatch(rendered)]
+    return ''.join(parts) + f'\nmapLayerLoaded({json.dumps(name)}, {var_name});\n'
+
+
+def write_layer_scripts(fragments, directory=None):
+    """Write each overlay's script under a content-hashed name; returns {layer: url}.
+
+    Scripts of the previous build are kept for pages opened before this one.
+    """
+    directory = directory or MAP_LAYER_DIR
+    os.makedirs(directory, exist_ok=True)
+    urls = {}
+    for layer, fragment in zip(MAP_LAYERS, fragments):
+        if fragment is not None:
+            script = _layer_script(layer.name, fragment).encode('utf-8')
+            urls[layer.name] = MAP_LAYER_URL + assets.write_fingerprinted(directory, f'{layer.name}.js', script)
+
+    manifest_path = os.path.join(directory, 'layers.json')
+    previous = _read_json(manifest_path)['files'] if os.path.exists(manifest_path) else []
+    current = sorted(url[len(MAP_LAYER_URL):] for url in urls.values())
+    keep = set(current) | set(previous)
+    for name in os.listdir(directory):
+        stem, ext = os.path.splitext(name)
+        if name != 'layers.json' and (stem if ext in ('.gz', '.br') else name) not in keep:
+            os.remove(os.path.join(directory, name))
+    _write_atomic(manifest_path, lambda f: json.dump({'files': current}, f))
+    return urls
+
+
+def _new_map():
+    """Create the base map centered on Canada, without any tiles or overlays."""
     m = folium.Map(
         location=[56.1304, -106.3468],  # Center on Canada
         zoom_start=4,
         control_scale=True,
         tiles=None  # No default tiles
     )
+    m._id = MAP_ID
+    return m
+
+
+def _rendered_parts(m):
+    """Render the map's figure and return its header, html and script entries by name."""
+    figure = m.get_root()
+    figure.render()
+    return {
+        section: {name: child.render() for name, child in getattr(figure, section)._children.items()}
+        for section in ('header', 'html', 'script')
+    }
+
+
+def _write_atomic(path, write):
+    """Call write(f) on a temporary file next to path, then rename it over path.
+
+    Readers (and /map requests) see either the old file or the new one,
+    never a half-written one.
+    """
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            write(f)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _read_json(path):
+    """Read one of the build's own JSON files (the manifest, the input index, a cached layer)."""
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _file_hashes(paths, cache_dir):
+    """Return {path: sha256} for the existing paths, re-hashing only files whose size or mtime changed."""
+    index_path = os.path.join(cache_dir, 'inputs.json')
+    index = _read_json(index_path) if os.path.exists(index_path) else {}
+    hashes = {}
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        stat = os.stat(path)
+        entry = index.get(path)
+        if entry is None or entry[:2] != [stat.st_size, stat.st_mtime_ns]:
+            digest = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(chunk)
+            entry = index[path] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+        hashes[path] = entry[2]
+    _write_atomic(index_path, lambda f: json.dump(index, f))
+    return hashes
+
+
+def _layer_fingerprint(layer, file_hashes):
+    digest = hashlib.sha256(f"{folium.__version__} {MAP_VECTOR_SOURCE} {MAP_TILE_PROXY}".encode())
+    digest.update(repr(layer.config).encode())
+    for function in layer.code:
+        digest.update(inspect.getsource(function).encode())
+    for path in layer.inputs:
+        digest.update(f"{path}={file_hashes.get(path, 'missing')}".encode())
+    return digest.hexdigest()
+
+
+def _render_layer(layer, base_parts):
+    """Render one layer on its own and keep only what it added to the page."""
+    m = _new_map()
+    added = layer.add(m)
+    if added is None:
+        return None
+    added._id = layer.name  # stable variable name for the LayerControl to reference
+    parts = _rendered_parts(m)
+    fragment = {'var_name': added.get_name(), 'layer_name': added.layer_name,
+                'overlay': added.overlay, 'control': added.control, 'show': added.show}
+    for section in ('header', 'html', 'script'):
+        fragment[section] = [[name, rendered] for name, rendered in parts[section].items()
+                             if name not in base_parts[section]]
+    return fragment
+
+
+def build_layers(force=False, cache_dir=MAP_CACHE_DIR):
+    """Return the rendered fragment of every overlay, re-rendering only stale layers.
+
+    Also returns a report with the build time and status of each layer.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    file_hashes = _file_hashes([path for layer in MAP_LAYERS for path in layer.inputs], cache_dir)
+    base_parts = None
+    fragments, report = [], []
+
+    for layer in MAP_LAYERS:
+        start = time.perf_counter()
+        cache_path = os.path.join(cache_dir, f'{layer.name}.json')
+        fingerprint = _layer_fingerprint(layer, file_hashes)
+        cached = _read_json(cache_path) if os.path.exists(cache_path) else None
+
+        if not force and cached is not None and cached['fingerprint'] == fingerprint:
+            fragment, status = cached['fragment'], 'cached'
+        else:
+            if base_parts is None:
+                base_parts = _rendered_parts(_new_map())
+            fragment, status = _render_layer(layer, base_parts), 'rendered'
+            _write_atomic(cache_path, lambda f: json.dump({'fingerprint': fingerprint, 'fragment': fragment}, f))
+
+        fragments.append(fragment)
+        report.append({'layer': layer.name, 'status': status if fragment is not None else status + ' (empty)',
+                       'seconds': time.perf_counter() - start,
+                       'bytes': sum(len(rendered) for section in ('header', 'html', 'script')
+                                    for _, rendered in (fragment or {}).get(section, []))})
+
+    _write_atomic(os.path.join(cache_dir, 'build_report.json'), lambda f: json.dump(report, f, indent=2))
+    return fragments, report
+
+
+def print_build_report(report):
+    """Print how long each layer took to build and how much it adds to the page."""
+    for entry in report:
+        print(f"{entry['layer']:<20} {entry['status']:<18} {entry['seconds'] * 1000:9.1f} ms {entry['bytes']:>12,} bytes")
+
+
+def create_map(force=False):
+    """Create the interactive map with priority species and critical habitats.
+
+    Overlays come from the per-layer cache in MAP_CACHE_DIR and are only
+    re-rendered when their input files or configuration change (or force is
+    set). With MAP_LAZY_LAYERS each overlay's script is written to
+    MAP_LAYER_DIR and the page only loads those in MAP_DEFAULT_LAYERS.
+    Returns the per-layer build report.
+    """
+    start = time.perf_counter()
+    fragments, report = build_layers(force)
+
+    # Create base map centered on Canada
+    m = _new_map()
 
     # Add OpenStreetMap as a base layer
     folium.TileLayer(
-        tiles="https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png",
+        tiles=tile_url('openstreetmap', OPENSTREETMAP_TILES_URL, tiled=True),
         attr="&copy; OpenStreetMap contributors",
         name="OpenStreetMap",
         overlay=False,
         control=True
     ).add_to(m)
 
-    # Add ArcGIS Satellite Imagery as a base layer
+    # Add ArcGIS Satellite Imagery as a base layer (hidden under OpenStreetMap unless lazy, so not loaded then)
     folium.TileLayer(
-        tiles="https://services.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}",
+        tiles=tile_url('arcgis_imagery', ARCGIS_IMAGERY_TILES_URL, tiled=True),
         attr="Esri",
         name="ArcGIS Satellite Imagery",
         overlay=False,
-        control=True
+        control=True,
+        show=not MAP_LAZY_LAYERS
     ).add_to(m)
 
-
-
-    # Add the Priority Species layer
-    add_priority_species_layer(m)
-
-    # Add the Critical Habitat WMS layer
-    add_critical_habitat_layer(m)
-
-    # Add the Vegetation Zones WMS layer
-    add_vegetation_zones_layer(m)
-
-    # Add the Air Quality Hotspots WMS layer
-    add_wildfire_hotspots_layer(m)
-
-    add_protected_areas_wms_layer(m)
+    # Add the overlays (species, critical habitat, vegetation, drought, wildfire, protected areas)
+    if MAP_LAZY_LAYERS:
+        m.get_root().script.add_child(Element(LAZY_LAYERS_JS), name='lazy_layers')
+        urls = write_layer_scripts(fragments)
+        for layer, fragment in zip(MAP_LAYERS, fragments):
+            if fragment is not None:
+                LazyLayer(fragment, layer.name, urls[layer.name], LAYER_LEGENDS.get(layer.name),
+                          show=layer.name in MAP_DEFAULT_LAYERS).add_to(m)
+    else:
+        for fragment in fragments:
+            if fragment is not None:
+                CachedLayer(fragment).add_to(m)
 
     draw = Draw(export=True)
     draw.add_to(m)
+    QueryOnDraw().add_to(m)
 
     # Add Layer Control for base maps and overlays
     folium.LayerControl(position='topright', collapsed=False).add_to(m)
@@ -249,6 +801,7 @@ def create_map():
                 <option value="priority">Priority Species Legend</option>
                 <option value="critical">Critical Habitat Legend</option>
                 <option value="vegetation">Vegetation Zones Legend</option>
+                <option value="drought">Drought Impact Legend</option>
                 <option value="wildfire">Wildfire Hotspots Legend</option>
                 <option value="protected">Protected Areas Legend</option>
             </select>
@@ -396,6 +949,21 @@ def create_map():
                 </div>
             </div>
 
+            <!-- Drought Impact Legend -->
+            <div id="drought-legend" style="display: none;">
+                <strong>Drought Impact Sites 2023</strong><br>
+                <div style="display: flex; align-items: center; margin-bottom: 6px;">
+                    <div style="background-color: #FBC02D; width: 30px; height: 15px; border-radius: 2px; margin-right: 10px;"></div> Mostly short-term impact
+                </div>
+                <div style="display: flex; align-items: center; margin-bottom: 6px;">
+                    <div style="background-color: #8D6E63; width: 30px; height: 15px; border-radius: 2px; margin-right: 10px;"></div> Mostly long-term impact
+                </div>
+                <div style="display: flex; align-items: center; margin-bottom: 6px;">
+                    <div style="background-color: #E64A19; width: 30px; height: 15px; border-radius: 2px; margin-right: 10px;"></div> Mostly short- and long-term impact
+                </div>
+                Stronger fills hold more sites.
+            </div>
+
             <!-- Wildfire Hotspots Legend -->
             <div id="wildfire-legend" style="display: none;">
                 <strong>Wildfire Hotspots Legend</strong><br>
@@ -438,6 +1006,7 @@ def create_map():
         document.getElementById("priority-legend").style.display = (selectedLegend === "priority") ? "block" : "none";
         document.getElementById("critical-legend").style.display = (selectedLegend === "critical") ? "block" : "none";
         document.getElementById("vegetation-legend").style.display = (selectedLegend === "vegetation") ? "block" : "none";
+        document.getElementById("drought-legend").style.display = (selectedLegend === "drought") ? "block" : "none";
         document.getElementById("wildfire-legend").style.display = (selectedLegend === "wildfire") ? "block" : "none";
         document.getElementById("protected-legend").style.display = (selectedLegend === "protected") ? "block" : "none";
     }
@@ -449,7 +1018,42 @@ def create_map():
     m.get_root().html.add_child(folium.Element(dropdown_html))
 
     # Save the map to the 'templates' folder, replacing the old one
-    m.save('templates/map.html')
+    _write_atomic(MAP_OUTPUT_PATH, lambda f: f.write(m.get_root().render()))
+
+    report.append({'layer': 'page', 'status': 'assembled', 'seconds': time.perf_counter() - start,
+                   'bytes': os.path.getsize(MAP_OUTPUT_PATH)})
+    return report
+
+
+# The legend-select option shown for each overlay
+LAYER_LEGENDS = {
+    'priority_species': 'priority',
+    'critical_habitat': 'critical',
+    'vegetation_zones': 'vegetation',
+    'drought_impact': 'drought',
+    'wildfire_hotspots': 'wildfire',
+    'protected_areas': 'protected',
+}
+
+# Overlays in the order they are added to the map
+MAP_LAYERS = [
+    MapLayer('priority_species', add_priority_species_layer, [PRIORITY_SPECIES_FILE_PATH],
+             (SPECIES_POPULATION_COLOR_MAP, COSEWIC_STATUS_MAP, SPECIES_FIELDS, SPECIES_STYLE),
+             [add_priority_species_layer, load_species_frame, load_species_layer, stream_species_features,
+              prepare_species_frame, _map_categories, PreStyledGeoJson, GeoJsonTileLayer]),
+    MapLayer('critical_habitat', add_critical_habitat_layer, [], CRITICAL_HABITAT_WMS_URL,
+             [add_critical_habitat_layer, tile_url]),
+    MapLayer('vegetation_zones', add_vegetation_zones_layer, [VEGETATION_ZONES_FILE_PATH],
+             (VEGETATION_COLOR_MAP, VEGETATION_FIELDS, VEGETATION_STYLE),
+             [add_vegetation_zones_layer, load_vegetation_frame, load_vegetation_layer, stream_vegetation_features,
+              prepare_vegetation_frame, _map_categories, PreStyledGeoJson, GeoJsonTileLayer]),
+    MapLayer('drought_impact', add_drought_impact_layer, [DROUGHT_IMPACT_FILE_PATH], None,
+             [add_drought_impact_layer, GeoJsonTileLayer]),
+    MapLayer('wildfire_hotspots', add_wildfire_hotspots_layer, [], WILDFIRE_HOTSPOTS_WMS_URL,
+             [add_wildfire_hotspots_layer, tile_url]),
+    MapLayer('protected_areas', add_protected_areas_wms_layer, [], PROTECTED_AREAS_WMS_URL,
+             [add_protected_areas_wms_layer, tile_url]),
+]
 
 if __name__ == "__main__":
-    create_map()
+    print_build_report(create_map(force='--force' in sys.argv))
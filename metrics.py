@@ -0,0 +1,204 @@
+"""Per-route request metrics in the Prometheus text format.
+
+For every request, labelled by endpoint (the view name, so URLs with ids
+don't explode the label set) and method, this records:
+
+* http_request_duration_seconds  latency histogram, and requests by status
+* http_response_size_bytes       body size histogram
+* db_queries_per_request         SQL statements issued, counted with SQLAlchemy cursor events
+* db_query_seconds               total time spent in those statements
+
+Statements slower than SLOW_QUERY_MS are printed with the endpoint that ran
+them and counted in db_slow_queries_total. Everything is exposed at
+/metrics. Counters live in the process, so under gunicorn each scrape
+sees the worker that answered it; the pid label tells them apart.
+
+Adding ?__profile=1 to a request runs it under cProfile and returns the
+report instead of the response, for users named in METRICS_ADMINS (or
+anyone when the app runs in debug mode).
+"""
+import cProfile
+import io
+import os
+import pstats
+import threading
+import time
+
+from flask import current_app, g, has_request_context, request
+from flask_login import current_user
+from sqlalchemy import event
+
+from models import db
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+
+
+class Histogram:
+    """Cumulative bucket counts, a sum and a count, as Prometheus expects."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+        yield f'{name}_sum{{{labels}}} {float(self.sum)!r}'
+        yield f'{name}_count{{{labels}}} {self.count}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metrics:
+    """Record request, response and query metrics and serve them at /metrics."""
+
+    def __init__(self, app=None):
+        self.slow_query_seconds = 0.1
+        self._lock = threading.Lock()
+        self.reset()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('METRICS_ENABLED', os.environ.get('METRICS_ENABLED', '1') == '1')
+        app.config.setdefault('SLOW_QUERY_MS', float(os.environ.get('SLOW_QUERY_MS', 100)))
+        # Display names allowed to use ?__profile=1
+        app.config.setdefault('METRICS_ADMINS', [name for name in os.environ.get('METRICS_ADMINS', '').split(',') if name])
+        self.slow_query_seconds = app.config['SLOW_QUERY_MS'] / 1000
+        if not app.config['METRICS_ENABLED']:
+            return
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.add_url_rule('/metrics', 'metrics', self.metrics_view)
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(db.engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    def reset(self):
+        with self._lock:
+            self._requests = {}    # (endpoint, method, status) -> count
+            self._latency = {}     # (endpoint, method) -> Histogram
+            self._size = {}        # (endpoint, method) -> Histogram
+            self._queries = {}     # (endpoint, method) -> Histogram
+            self._query_seconds = {}  # endpoint -> seconds
+            self._slow_queries = {}   # endpoint -> count
+
+    # SQLAlchemy events; queries outside a request (vote flushes, jobs) are filed under "background"
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - conn.info['metrics_started'].pop()
+        in_request = has_request_context()
+        endpoint = (request.endpoint or 'unmatched') if in_request else 'background'
+        if in_request and 'metrics_queries' in g:
+            g.metrics_queries += 1
+            g.metrics_query_seconds += seconds
+        with self._lock:
+            self._query_seconds[endpoint] = self._query_seconds.get(endpoint, 0) + seconds
+            if seconds >= self.slow_query_seconds:
+                self._slow_queries[endpoint] = self._slow_queries.get(endpoint, 0) + 1
+        if seconds >= self.slow_query_seconds:
+            print(f"Slow query ({seconds * 1000:.1f}ms, {endpoint}): {' '.join(statement.split())[:500]}")
+
+    # Request hooks
+
+    def _before_request(self):
+        g.metrics_started = time.perf_counter()
+        g.metrics_queries = 0
+        g.metrics_query_seconds = 0.0
+        if request.args.get('__profile') == '1' and self._may_profile():
+            g.metrics_profiler = cProfile.Profile()
+            g.metrics_profiler.enable()
+
+    def _may_profile(self):
+        if current_app.debug:
+            return True
+        return current_user.is_authenticated and current_user.display_name in current_app.config['METRICS_ADMINS']
+
+    def _after_request(self, response):
+        if 'metrics_started' not in g:
+            return response  # a before_request hook answered before ours ran
+        seconds = time.perf_counter() - g.metrics_started
+        key = (request.endpoint or 'unmatched', request.method)
+        size = response.content_length
+        if size is None and not response.is_streamed:
+            size = len(response.get_data())
+        with self._lock:
+            status_key = key + (response.status_code,)
+            self._requests[status_key] = self._requests.get(status_key, 0) + 1
+            self._latency.setdefault(key, Histogram(LATENCY_BUCKETS)).observe(seconds)
+            self._queries.setdefault(key, Histogram(QUERY_BUCKETS)).observe(g.metrics_queries)
+            if size is not None:
+                self._size.setdefault(key, Histogram(SIZE_BUCKETS)).observe(size)
+        response.headers['Server-Timing'] = (f'app;dur={seconds * 1000:.1f}, '
+                                             f'db;dur={g.metrics_query_seconds * 1000:.1f};desc="{g.metrics_queries} queries"')
+        profiler = g.pop('metrics_profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            return self._profile_response(profiler, seconds, response)
+        return response
+
+    def _profile_response(self, profiler, seconds, response):
+        out = io.StringIO()
+        out.write(f"{request.method} {request.full_path} -> {response.status}, {seconds * 1000:.1f}ms, "
+                  f"{g.metrics_queries} queries in {g.metrics_query_seconds * 1000:.1f}ms\n\n")
+        pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(40)
+        return current_app.response_class(out.getvalue(), mimetype='text/plain')
+
+    # Exposition
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        pid = os.getpid()
+
+        def labels(endpoint, method=None, **extra):
+            parts = [f'endpoint="{_escape(endpoint)}"'] + ([f'method="{method}"'] if method else [])
+            parts += [f'{name}="{_escape(value)}"' for name, value in extra.items()] + [f'pid="{pid}"']
+            return ','.join(parts)
+
+        lines = []
+        with self._lock:
+            lines += ['# HELP http_requests_total Requests answered, by status.', '# TYPE http_requests_total counter']
+            lines += [f'http_requests_total{{{labels(endpoint, method, status=status)}}} {count}'
+                      for (endpoint, method, status), count in sorted(self._requests.items())]
+            for name, help_text, histograms in (
+                    ('http_request_duration_seconds', 'Time to produce the response.', self._latency),
+                    ('http_response_size_bytes', 'Response body size.', self._size),
+                    ('db_queries_per_request', 'SQL statements issued per request.', self._queries)):
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+                for (endpoint, method), histogram in sorted(histograms.items()):
+                    lines += histogram.lines(name, labels(endpoint, method))
+            lines += ['# HELP db_query_seconds_total Time spent executing SQL.', '# TYPE db_query_seconds_total counter']
+            lines += [f'db_query_seconds_total{{{labels(endpoint)}}} {float(seconds)!r}'
+                      for endpoint, seconds in sorted(self._query_seconds.items())]
+            lines += [f'# HELP db_slow_queries_total Statements slower than {self.slow_query_seconds * 1000:g}ms.',
+                      '# TYPE db_slow_queries_total counter']
+            lines += [f'db_slow_queries_total{{{labels(endpoint)}}} {count}'
+                      for endpoint, count in sorted(self._slow_queries.items())]
+        return '\n'.join(lines) + '\n'
+
+    def metrics_view(self):
+        return current_app.response_class(self.render(), mimetype='text/plain; version=0.0.4')
+
+
+metrics = Metrics()
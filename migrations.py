@@ -0,0 +1,74 @@
+"""Schema creation and data migrations for databases created by older versions of the app."""
+import pickle
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+
+from models import db, Reply
+import search
+
+
+def _reply_from_pickled(blog_id, author_id, item):
+    """Build a Reply from one entry of an old pickled replies list.
+
+    Entries were never given a fixed shape, so accept plain strings as well as
+    dicts, and fall back to the blog's author when no user is recorded.
+    """
+    if isinstance(item, dict):
+        content = item.get('content') or item.get('text') or ''
+        user_id = item.get('user_id') or author_id
+        created_at = item.get('created_at')
+        if isinstance(created_at, str):
+            created_at = datetime.fromisoformat(created_at)
+    else:
+        content, user_id, created_at = str(item), author_id, None
+    return Reply(blog_id=blog_id, user_id=user_id, content=content, created_at=created_at or datetime.utcnow())
+
+
+def migrate_pickled_replies():
+    """Move the pickled blog.replies column into the reply table.
+
+    Adds the reply_count column, converts every pickled list into Reply rows,
+    recomputes the counters and drops the old column. Safe to run again.
+    Returns the number of replies converted.
+    """
+    db.create_all()
+    columns = {column['name'] for column in inspect(db.engine).get_columns('blog')}
+
+    if 'reply_count' not in columns:
+        db.session.execute(text('ALTER TABLE blog ADD COLUMN reply_count INTEGER NOT NULL DEFAULT 0'))
+    if 'replies' not in columns:
+        db.session.commit()
+        return 0
+
+    converted = 0
+    rows = db.session.execute(text('SELECT id, user_id, replies FROM blog WHERE replies IS NOT NULL')).all()
+    for blog_id, author_id, blob in rows:
+        for item in pickle.loads(blob) or []:
+            db.session.add(_reply_from_pickled(blog_id, author_id, item))
+            converted += 1
+    db.session.flush()
+
+    db.session.execute(text(
+        'UPDATE blog SET reply_count = (SELECT COUNT(*) FROM reply WHERE reply.blog_id = blog.id)'
+    ))
+    db.session.execute(text('ALTER TABLE blog DROP COLUMN replies'))
+    db.session.commit()
+    return converted
+
+
+def upgrade():
+    """Bring the database up to date: create missing tables and indexes, then migrate data.
+
+    Run once per deploy (flask --app app migrate) rather than in every
+    server process. Returns the number of replies converted.
+    """
+    db.create_all()
+    search.create_search_index()
+    return migrate_pickled_replies()
+
+
+def missing_tables():
+    """Names of model tables not yet in the database."""
+    existing = set(inspect(db.engine).get_table_names())
+    return sorted(name for name in db.metadata.tables if name not in existing)
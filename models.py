@@ -1,19 +1,24 @@
+from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
+from passwords import password_hasher
 
 db = SQLAlchemy()
 
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     display_name = db.Column(db.String(150), unique=True, nullable=False)
-    password_hash = db.Column(db.String(128), nullable=False)
+    # scrypt hashes are about 160 characters
+    password_hash = db.Column(db.String(256), nullable=False)
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return password_hasher.verify(self.password_hash, password)
+
+    def password_needs_rehash(self):
+        return password_hasher.needs_rehash(self.password_hash)
 
 class Blog(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -23,5 +28,59 @@ class Blog(db.Model):
     user = db.relationship('User', backref='blogs')
     likes = db.Column(db.Integer, default=0)
     dislikes = db.Column(db.Integer, default=0)
-    replies = db.Column(db.PickleType, default=[])
-    
+    # Denormalized so feeds can show counts without touching the reply table
+    reply_count = db.Column(db.Integer, default=0, nullable=False)
+    replies = db.relationship('Reply', backref='blog', lazy='dynamic', cascade='all, delete-orphan')
+    votes = db.relationship('Vote', backref='blog', lazy='dynamic', cascade='all, delete-orphan')
+
+class Reply(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    blog_id = db.Column(db.Integer, db.ForeignKey('blog.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    content = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    user = db.relationship('User')
+
+    # Replies are always read per blog in creation order
+    __table_args__ = (db.Index('ix_reply_blog_id_created_at', 'blog_id', 'created_at'),)
+
+
+class Vote(db.Model):
+    # One row per user per blog, so repeating a vote can't count twice
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    blog_id = db.Column(db.Integer, db.ForeignKey('blog.id'), primary_key=True, index=True)
+    value = db.Column(db.SmallInteger, nullable=False)  # 1 for a like, -1 for a dislike
+
+
+class FeedVersion(db.Model):
+    # A single row counting the commits that changed the feed; the ETags of
+    # /get_blogs and /blog are derived from it (see feed.py)
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
+class FeedEvent(db.Model):
+    # Committed changes to the blog feed, pushed to browsers by feed_events.py;
+    # the id is the resume token, so ids must never be reused
+    __table_args__ = {'sqlite_autoincrement': True}
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(16), nullable=False)  # created, edited, deleted or votes
+    data = db.Column(db.Text, nullable=False)  # JSON
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+
+class ScrapedPage(db.Model):
+    # HTTP validators from the last fetch of each page, for conditional GETs
+    url = db.Column(db.String(2048), primary_key=True)
+    etag = db.Column(db.String(256))
+    last_modified = db.Column(db.String(64))
+    fetched_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+
+class NewsArticle(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    url = db.Column(db.String(2048), unique=True, nullable=False)
+    title = db.Column(db.Text, nullable=False)
+    published = db.Column(db.Date, index=True)
+    body = db.Column(db.Text, nullable=False)
+    scraped_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
@@ -0,0 +1,112 @@
+"""Password hashing with a configurable method and a bounded worker pool.
+
+PASSWORD_HASH_METHOD picks the algorithm and its cost:
+
+* werkzeug methods, e.g. ``scrypt:32768:8:1`` (the default) or ``pbkdf2:sha256:600000``
+* ``bcrypt:<rounds>``, e.g. ``bcrypt:12`` (needs the bcrypt package)
+
+Stored hashes record the parameters they were made with, so existing users
+keep logging in after the method changes; needs_rehash() tells the login
+route to re-hash their password with the current method.
+
+Hashes are computed on at most PASSWORD_HASH_WORKERS threads (the hash
+functions release the GIL), so a burst of logins uses that many cores and
+leaves the rest to other requests. At most PASSWORD_HASH_QUEUE hashes wait
+for a worker; past that, HasherBusy is raised instead of queueing forever.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+try:
+    import bcrypt
+except ImportError:  # only needed for the bcrypt method
+    bcrypt = None
+
+DEFAULT_METHOD = 'scrypt:32768:8:1'
+
+
+class HasherBusy(Exception):
+    """Too many password hashes are already waiting for a worker."""
+
+
+def _bcrypt_rounds(method):
+    _, _, rounds = method.partition(':')
+    return int(rounds or 12)
+
+
+class PasswordHasher:
+    """Hash and verify passwords with the configured method on a bounded pool."""
+
+    def __init__(self, app=None):
+        self.method = DEFAULT_METHOD
+        self._prefix = None
+        self._pool = None
+        self._slots = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PASSWORD_HASH_METHOD', os.environ.get('PASSWORD_HASH_METHOD', DEFAULT_METHOD))
+        app.config.setdefault('PASSWORD_HASH_WORKERS',
+                              int(os.environ.get('PASSWORD_HASH_WORKERS', max(1, (os.cpu_count() or 2) // 2))))
+        app.config.setdefault('PASSWORD_HASH_QUEUE', int(os.environ.get('PASSWORD_HASH_QUEUE', 64)))
+        self.configure(app.config['PASSWORD_HASH_METHOD'], app.config['PASSWORD_HASH_WORKERS'],
+                       app.config['PASSWORD_HASH_QUEUE'])
+
+    def configure(self, method, workers, queue):
+        if method.startswith('bcrypt') and bcrypt is None:
+            raise RuntimeError("PASSWORD_HASH_METHOD is bcrypt but the bcrypt package is not installed")
+        self.method = method
+        # The parameter part of a hash made now, e.g. 'scrypt:32768:8:1' or '$2b$12'
+        self._prefix = self._parameters(self._hash(''))
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+        self._slots = threading.BoundedSemaphore(workers + queue)
+
+    @staticmethod
+    def _parameters(password_hash):
+        if password_hash.startswith('$2'):
+            return password_hash[:6]  # $2b$12
+        return password_hash.split('$', 1)[0]
+
+    def _hash(self, password):
+        if self.method.startswith('bcrypt'):
+            return bcrypt.hashpw(password.encode(), bcrypt.gensalt(_bcrypt_rounds(self.method))).decode()
+        return generate_password_hash(password, self.method)
+
+    @staticmethod
+    def _verify(password_hash, password):
+        if password_hash.startswith('$2'):
+            return bcrypt is not None and bcrypt.checkpw(password.encode(), password_hash.encode())
+        return check_password_hash(password_hash, password)
+
+    def _run(self, fn, *args):
+        if self._pool is None:  # used outside the app, e.g. from a script
+            self.configure(self.method, 1, 64)
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusy("Too many password checks in progress, try again shortly")
+        try:
+            return self._pool.submit(fn, *args).result()
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        """Hash password with the configured method."""
+        return self._run(self._hash, password)
+
+    def verify(self, password_hash, password):
+        """Check password against a hash made with any supported method."""
+        return self._run(self._verify, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """True if password_hash was made with other parameters than the configured ones."""
+        if self._prefix is None:
+            self.configure(self.method, 1, 64)
+        return self._parameters(password_hash) != self._prefix
+
+
+password_hasher = PasswordHasher()
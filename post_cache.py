@@ -0,0 +1,101 @@
+"""In-memory cache of rendered blog posts for the server-rendered /blog page.
+
+/blog arrives with its first BLOG_PAGE_SIZE posts in place instead of an
+empty page that fetches them from /get_blogs. Rendering a post means
+escaping its title, content and replies into a few dozen lines of markup,
+so each post is rendered once and kept here, and a page render is mostly
+concatenation.
+
+Posts are keyed by blog id and by what differs between visitors: whether
+the post is their own (the Edit and Delete buttons) and how they voted.
+Each entry remembers the version of the post it was rendered from, that
+is everything the post shows, and is rendered again when that changed:
+after an edit, a vote, a reply or a rename, whichever process made it.
+edit_blog and delete_blog also call invalidate() to drop the post's
+entries straight away.
+"""
+import threading
+from collections import OrderedDict
+
+
+def post_version(post):
+    """Everything a serialized feed post shows.
+
+    The title and content themselves rather than a counter: comparing them
+    costs far less than rendering, and SQLite can hand a deleted post's id
+    to the next one.
+    """
+    replies = tuple((reply['id'], reply['username'], reply['content']) for reply in post['replies'])
+    return (post['title'], post['content'], post['username'], post['likes'], post['dislikes'],
+            post['reply_count'], replies)
+
+
+class PostCache:
+    """Map blog ids to their rendered HTML, rendering misses with render(post, owner)."""
+
+    def __init__(self, app=None):
+        self.max_size = 1000
+        # blog_id -> {(owner, user_vote): (version, html)}, least recently used first
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.reset_stats()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # Posts rendered into /blog; the rest load with Load More as before
+        app.config.setdefault('BLOG_PAGE_SIZE', 20)
+        # Blogs kept; a size of 0 turns the cache off
+        app.config.setdefault('POST_CACHE_SIZE', 1000)
+        self.max_size = app.config['POST_CACHE_SIZE']
+        self.clear()
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats = {'hits': 0, 'misses': 0, 'stale': 0, 'evicted': 0, 'invalidated': 0}
+
+    def get(self, post, current_user_id, render):
+        """Return the HTML of post (as made by feed.serialize_blog) for current_user_id."""
+        owner = post['user_id'] == current_user_id
+        variant = (owner, post['user_vote'])
+        version = post_version(post)
+        with self._lock:
+            entry = self._entries.get(post['id'], {}).get(variant)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(post['id'])
+                self._stats['hits'] += 1
+                return entry[1]
+            self._stats['stale' if entry is not None else 'misses'] += 1
+
+        html = render(post, owner)
+        if self.max_size > 0:
+            with self._lock:
+                variants = self._entries.setdefault(post['id'], {})
+                if any(cached[0] != version for cached in variants.values()):
+                    variants.clear()  # rendered from an older version
+                variants[variant] = (version, html)
+                self._entries.move_to_end(post['id'])
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+                    self._stats['evicted'] += 1
+        return html
+
+    def invalidate(self, blog_id):
+        """Forget blog_id, e.g. after it was edited or deleted."""
+        with self._lock:
+            if self._entries.pop(blog_id, None) is not None:
+                self._stats['invalidated'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, size=len(self._entries), max_size=self.max_size)
+        lookups = stats['hits'] + stats['misses'] + stats['stale']
+        stats['hit_ratio'] = stats['hits'] / lookups if lookups else 0
+        return stats
+
+
+post_cache = PostCache()
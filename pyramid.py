@@ -0,0 +1,182 @@
+"""Precomputed level-of-detail pyramids for the tiled GeoJSON overlays.
+
+For each layer in tiles.TILE_SOURCES this builds one simplified copy of the
+geometries per zoom in LOD_ZOOMS, simplified to about a pixel at that zoom.
+Polygons are not simplified one by one, which would pull the two copies of
+a shared border in different directions and open gaps between neighbouring
+vegetation zones. Instead every boundary is noded into arcs, each arc is
+simplified once, the arcs are polygonized back into faces and each feature
+is rebuilt from the faces it covered (TopoJSON-style).
+
+Levels are stored as concatenated WKB in compressed .npz files under
+PYRAMID_DIR and are rebuilt when the source file's size or mtime changes:
+
+    python pyramid.py              # build pyramids, print a size report
+    python pyramid.py --synthetic  # same, on generated adjacent zones
+"""
+import os
+import sys
+import tempfile
+
+import numpy as np
+import shapely
+
+PYRAMID_DIR = os.environ.get('PYRAMID_DIR', 'cache/pyramids')
+
+# Zoom levels that get their own simplified copy; deeper zooms use the source
+LOD_ZOOMS = (2, 4, 6, 8, 10)
+
+
+def tolerance_for(zoom):
+    """Simplification tolerance in degrees: one 256px tile pixel at zoom."""
+    return 360 / (256 * 2 ** zoom)
+
+
+def level_for(zoom, levels):
+    """Pick the coarsest available level that is still fine enough for zoom (None for full detail)."""
+    candidates = [level for level in levels if level >= zoom]
+    return min(candidates) if candidates else None
+
+
+def simplify_topology(geometries, tolerance):
+    """Simplify polygons together so shared borders stay shared.
+
+    Returns an array aligned with geometries; features that collapse
+    entirely come back as empty polygons.
+    """
+    arcs = shapely.get_parts(shapely.line_merge(shapely.union_all(shapely.boundary(geometries))))
+    arcs = shapely.simplify(arcs, tolerance, preserve_topology=True)
+    faces = shapely.get_parts(shapely.polygonize(arcs))
+
+    # A face belongs to every source feature containing a point inside it,
+    # which also handles overlapping features such as species ranges
+    face_index, feature_index = shapely.STRtree(geometries).query(
+        shapely.point_on_surface(faces), predicate='within'
+    )
+    result = np.array([shapely.Polygon()] * len(geometries), dtype=object)
+    for feature in np.unique(feature_index):
+        result[feature] = shapely.union_all(faces[face_index[feature_index == feature]])
+    return result
+
+
+def interior_gap_area(original, simplified, tolerance):
+    """Area inside the original coverage that no simplified feature covers.
+
+    Borders shared by neighbours lie inside the coverage, so any gap opened
+    between them shows up here; the outer edge is excluded by shrinking the
+    coverage by twice the tolerance.
+    """
+    interior = shapely.union_all(original).buffer(-2 * tolerance)
+    return shapely.area(shapely.difference(interior, shapely.union_all(simplified)))
+
+
+def _level_path(layer, zoom, directory):
+    return os.path.join(directory, f'{layer}.z{zoom}.npz')
+
+
+def save_level(path, geometries, source_stat):
+    wkb = shapely.to_wkb(geometries)
+    offsets = np.cumsum([0] + [len(item) for item in wkb])
+    data = np.frombuffer(b''.join(wkb), dtype=np.uint8)
+    np.savez_compressed(path, data=data, offsets=offsets,
+                        source=np.array([source_stat.st_size, source_stat.st_mtime_ns]))
+
+
+def load_level(path, source_stat):
+    """Load a level, or return None if it is missing or older than the source."""
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as stored:
+        if list(stored['source']) != [source_stat.st_size, source_stat.st_mtime_ns]:
+            return None
+        data, offsets = stored['data'].tobytes(), stored['offsets']
+    return shapely.from_wkb([data[start:end] for start, end in zip(offsets[:-1], offsets[1:])])
+
+
+def load_pyramid(layer, source_path, directory=PYRAMID_DIR):
+    """Return {zoom: geometries} for every fresh level of layer."""
+    if not os.path.exists(source_path):
+        return {}
+    source_stat = os.stat(source_path)
+    levels = {}
+    for zoom in LOD_ZOOMS:
+        geometries = load_level(_level_path(layer, zoom, directory), source_stat)
+        if geometries is not None:
+            levels[zoom] = geometries
+    return levels
+
+
+def build_pyramid(layer, geometries, source_path, directory=PYRAMID_DIR):
+    """Build and save every level of layer. Returns one report row per level."""
+    os.makedirs(directory, exist_ok=True)
+    source_stat = os.stat(source_path)
+    report = [{'layer': layer, 'level': 'source', 'tolerance': 0,
+               'vertices': int(shapely.get_num_coordinates(geometries).sum()),
+               'bytes': source_stat.st_size, 'gap_area': 0.0, 'independent_gap_area': 0.0}]
+    for zoom in LOD_ZOOMS:
+        tolerance = tolerance_for(zoom)
+        simplified = simplify_topology(geometries, tolerance)
+        path = _level_path(layer, zoom, directory)
+        save_level(path, simplified, source_stat)
+        independent = shapely.simplify(geometries, tolerance, preserve_topology=True)
+        report.append({'layer': layer, 'level': f'z{zoom}', 'tolerance': tolerance,
+                       'vertices': int(shapely.get_num_coordinates(simplified).sum()),
+                       'bytes': os.path.getsize(path),
+                       'gap_area': interior_gap_area(geometries, simplified, tolerance),
+                       'independent_gap_area': interior_gap_area(geometries, independent, tolerance)})
+    return report
+
+
+def print_report(report):
+    print(f"{'layer':<18} {'level':<7} {'vertices':>12} {'bytes':>14} {'gap area':>12} {'naive gap':>12}")
+    for row in report:
+        print(f"{row['layer']:<18} {row['level']:<7} {row['vertices']:>12,} {row['bytes']:>14,} "
+              f"{row['gap_area']:>12.3g} {row['independent_gap_area']:>12.3g}")
+
+
+def synthetic_zones(cells=200, seed=3):
+    """Adjacent zones over Canada with wiggly shared borders, as a FeatureCollection."""
+    rng = np.random.default_rng(seed)
+    points = shapely.multipoints(np.column_stack([rng.uniform(-140, -55, cells), rng.uniform(42, 75, cells)]))
+    extent = shapely.box(-140, 42, -55, 75)
+    voronoi = shapely.intersection(shapely.get_parts(shapely.voronoi_polygons(points, extend_to=extent)), extent)
+
+    # Densify and jitter each shared arc once so both neighbours keep the same border
+    arcs = shapely.get_parts(shapely.line_merge(shapely.union_all(shapely.boundary(voronoi))))
+    arcs = shapely.segmentize(arcs, 0.02)
+    arcs = shapely.transform(arcs, lambda c: c + 0.03 * np.column_stack(
+        [np.sin(c[:, 1] * 9.0), np.cos(c[:, 0] * 11.0)]) * ~np.isin(c, extent.bounds).any(axis=1)[:, None])
+    zones = shapely.get_parts(shapely.polygonize(arcs))
+    return {'type': 'FeatureCollection', 'features': [
+        {'type': 'Feature', 'geometry': shapely.geometry.mapping(zone),
+         'properties': {'level_1': f'Zone {i}', 'level_2': 'Glaciers'}} for i, zone in enumerate(zones)]}
+
+
+def main():
+    import json
+    import map as map_builder
+    import tiles
+
+    if '--synthetic' in sys.argv:
+        os.chdir(tempfile.mkdtemp(prefix='pyramid-'))
+        os.makedirs('static')
+        with open(map_builder.VEGETATION_ZONES_FILE_PATH, 'w') as f:
+            json.dump(synthetic_zones(), f)
+
+    report = []
+    for layer, source in tiles.TILE_SOURCES.items():
+        frame = source.load()
+        if frame is None:
+            continue
+        report += build_pyramid(layer, frame.geometry.to_numpy(), source.path)
+    print_report(report)
+
+    # Shared borders must not open up: gaps may only come from rounding noise
+    worst = max((row['gap_area'] for row in report), default=0)
+    if worst > 1e-9:
+        print(f"FAILED: simplified zones leave gaps (area {worst:.3g})")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""Token-bucket rate limiting for the login route.
+
+Each client IP and each account name gets a bucket that holds up to
+``burst`` tokens and refills at ``rate`` tokens per second; an attempt
+takes one token from both, and is refused while either is empty. A
+successful login gives the account's token back, so only wrong passwords
+count against an account. The IP bucket stops one client hammering many
+accounts, the account bucket stops many clients guessing one password.
+
+Trade-offs:
+
+* Anyone who knows an account name can still lock its owner out by
+  sending wrong passwords from several IPs: the owner is refused too until
+  the bucket refills (one attempt per LOGIN_ACCOUNT_RATE). That is the
+  price of bounding guesses against one password.
+* Buckets live in memory, per process, and the least recently used ones
+  are dropped beyond ``max_keys``. Under gunicorn each worker has its own
+  buckets, so the limits a client sees are multiplied by the number of
+  workers (2 * CPUs + 1 by default); set the LOGIN_* limits with that in
+  mind.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class TokenBucketLimiter:
+    """Allow bursts of up to burst events per key, refilling at rate per second."""
+
+    def __init__(self, rate, burst, max_keys=100000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> [tokens, updated_at]
+        self._lock = threading.Lock()
+
+    def _refill(self, key, now):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [float(self.burst), now]
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def retry_after(self, key):
+        """Seconds until key has a token (0 if it has one now)."""
+        with self._lock:
+            tokens = self._refill(key, time.monotonic())[0]
+        return 0 if tokens >= 1 else (1 - tokens) / self.rate
+
+    def give_back(self, key):
+        """Return a token taken for key, up to burst."""
+        with self._lock:
+            bucket = self._refill(key, time.monotonic())
+            bucket[0] = min(self.burst, bucket[0] + 1)
+
+    def take(self, key):
+        """Take a token for key; False if its bucket is empty."""
+        with self._lock:
+            bucket = self._refill(key, time.monotonic())
+            if bucket[0] < 1:
+                return False
+            bucket[0] -= 1
+            return True
+
+
+class LoginLimiter:
+    """Per-IP and per-account buckets in front of /login."""
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.by_ip = None
+        self.by_account = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('LOGIN_RATE_LIMIT', True)
+        # Bursts of 20 attempts per IP, then one every 3 seconds
+        app.config.setdefault('LOGIN_IP_BURST', 20)
+        app.config.setdefault('LOGIN_IP_RATE', 1 / 3)
+        # Bursts of 5 attempts per account, then one every 30 seconds
+        app.config.setdefault('LOGIN_ACCOUNT_BURST', 5)
+        app.config.setdefault('LOGIN_ACCOUNT_RATE', 1 / 30)
+        self.enabled = app.config['LOGIN_RATE_LIMIT']
+        self.by_ip = TokenBucketLimiter(app.config['LOGIN_IP_RATE'], app.config['LOGIN_IP_BURST'])
+        self.by_account = TokenBucketLimiter(app.config['LOGIN_ACCOUNT_RATE'], app.config['LOGIN_ACCOUNT_BURST'])
+
+    def check(self, ip, account):
+        """Take a token for ip and account. Returns 0 if the attempt may go ahead, else seconds to wait."""
+        if not self.enabled:
+            return 0
+        if not self.by_ip.take(ip):
+            return self.by_ip.retry_after(ip)
+        if not self.by_account.take(account.lower()):
+            return self.by_account.retry_after(account.lower())
+        return 0
+
+    def succeeded(self, account):
+        """The password was right: give the account its token back."""
+        if self.enabled:
+            self.by_account.give_back(account.lower())
+
+
+login_limiter = LoginLimiter()
@@ -0,0 +1,243 @@
+"""Periodic background jobs: the news scrape, layer rebuilds and map regeneration.
+
+Each job runs every SCHEDULER_INTERVALS[name] seconds (0 turns it off),
+either on a daemon thread inside the web process (SCHEDULER_ENABLED=1) or
+in a separate worker:
+
+    flask --app app run-scheduler      # loop forever
+    flask --app app run-job scrape_news
+
+Runs are single-flight: a job holds an exclusive lock file in
+SCHEDULER_LOCK_DIR while it runs, so a run that would overlap one still
+going, in this process or another, is skipped instead of piling up.
+Durations and outcomes are written next to the lock (under the same lock)
+and served by /jobs/stats, whichever process ran the job.
+"""
+import json
+import os
+import threading
+import time
+import traceback
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import map as map_builder
+import scrape
+import spatial
+
+try:
+    import fcntl
+except ImportError:  # Windows: runs are single-flight within a process only
+    fcntl = None
+
+HOUR = 3600
+
+DEFAULT_INTERVALS = {
+    'scrape_news': HOUR,
+    'rebuild_layers': 6 * HOUR,
+    'regenerate_map': 6 * HOUR,
+}
+
+# A job: run() is called inside an app context and returns a JSON-able summary
+Job = namedtuple('Job', ['name', 'run'])
+
+
+def scrape_news():
+    report = scrape.scrape_news()
+    return {key: report[key] for key in ('listing', 'new', 'fetched', 'failed')}
+
+
+def rebuild_layers():
+    return {'rebuilt': spatial.refresh()}
+
+
+def regenerate_map():
+    report = map_builder.create_map()
+    return {'rendered': [entry['layer'] for entry in report if entry['status'].startswith('rendered')]}
+
+
+JOBS = [Job('scrape_news', scrape_news), Job('rebuild_layers', rebuild_layers), Job('regenerate_map', regenerate_map)]
+
+
+def parse_intervals(text):
+    """Read "scrape_news=1800,regenerate_map=0" into {name: seconds}."""
+    intervals = {}
+    for item in filter(None, (part.strip() for part in text.split(','))):
+        name, _, seconds = item.partition('=')
+        intervals[name.strip()] = float(seconds)
+    return intervals
+
+
+class JobLock:
+    """An exclusive, non-blocking lock on a job, shared by every process using lock_dir."""
+
+    def __init__(self, lock_dir, name):
+        self.path = os.path.join(lock_dir, f'{name}.lock')
+        self._thread_lock = threading.Lock()
+        self._file = None
+
+    def acquire(self):
+        if not self._thread_lock.acquire(blocking=False):
+            return False
+        if fcntl is None:
+            return True
+        self._file = open(self.path, 'a')
+        try:
+            fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self._file.close()
+            self._file = None
+            self._thread_lock.release()
+            return False
+        return True
+
+    def release(self):
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+        self._thread_lock.release()
+
+
+class Scheduler:
+    """Run JOBS on their intervals, one run of each job at a time across processes."""
+
+    def __init__(self, app=None, jobs=None):
+        self.app = None
+        self.jobs = {job.name: job for job in (JOBS if jobs is None else jobs)}
+        self.intervals = {}
+        self.lock_dir = None
+        self._locks = {}
+        self._next_run = {}
+        self._skipped = {name: 0 for name in self.jobs}
+        self._running = set()
+        self._state_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SCHEDULER_ENABLED', os.environ.get('SCHEDULER_ENABLED', '0') == '1')
+        app.config.setdefault('SCHEDULER_LOCK_DIR', os.environ.get('SCHEDULER_LOCK_DIR', 'cache/jobs'))
+        app.config.setdefault('SCHEDULER_INTERVALS',
+                              dict(DEFAULT_INTERVALS, **parse_intervals(os.environ.get('SCHEDULER_INTERVALS', ''))))
+        self.app = app
+        self.lock_dir = app.config['SCHEDULER_LOCK_DIR']
+        self.intervals = {name: app.config['SCHEDULER_INTERVALS'].get(name, 0) for name in self.jobs}
+        os.makedirs(self.lock_dir, exist_ok=True)
+        self._locks = {name: JobLock(self.lock_dir, name) for name in self.jobs}
+        if app.config['SCHEDULER_ENABLED']:
+            self.start()
+
+    def _status_path(self, name):
+        return os.path.join(self.lock_dir, f'{name}.json')
+
+    def _read_status(self, name):
+        try:
+            with open(self._status_path(name)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'runs': 0, 'succeeded': 0, 'failed': 0, 'total_seconds': 0.0, 'max_seconds': 0.0, 'last': None}
+
+    def _write_status(self, name, status):
+        path = self._status_path(name)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(status, f)
+        os.replace(tmp_path, path)
+
+    def run(self, name, scheduled=False):
+        """Run job name now unless a run of it is already going.
+
+        A scheduled run is also skipped if any process started the job less
+        than its interval ago. Returns the outcome that was recorded, or None
+        if the run was skipped.
+        """
+        lock = self._locks[name]
+        if not lock.acquire():
+            with self._state_lock:
+                self._skipped[name] += 1
+            return None
+        try:
+            last = self._read_status(name)['last']
+            if scheduled and last is not None and time.time() - last['started_at'] < self.intervals[name]:
+                with self._state_lock:
+                    self._next_run[name] = last['started_at'] + self.intervals[name]
+                return None
+            started_at = time.time()
+            start = time.perf_counter()
+            try:
+                with self.app.app_context():
+                    outcome = {'status': 'ok', 'result': self.jobs[name].run()}
+            except Exception as e:
+                traceback.print_exc()
+                outcome = {'status': 'failed', 'error': f'{type(e).__name__}: {e}'}
+            seconds = time.perf_counter() - start
+            outcome.update(started_at=started_at, seconds=seconds, pid=os.getpid())
+
+            status = self._read_status(name)
+            status['runs'] += 1
+            status['succeeded' if outcome['status'] == 'ok' else 'failed'] += 1
+            status['total_seconds'] += seconds
+            status['max_seconds'] = max(status['max_seconds'], seconds)
+            status['last'] = outcome
+            self._write_status(name, status)
+            print(f"Job {name} {outcome['status']} in {seconds:.1f}s")
+            return outcome
+        finally:
+            lock.release()
+
+    def stats(self):
+        """Per job: interval, run counts, mean and max duration, the last outcome and the next run."""
+        stats = {}
+        with self._state_lock:
+            skipped, running, next_run = dict(self._skipped), set(self._running), dict(self._next_run)
+        for name in self.jobs:
+            status = self._read_status(name)
+            status['mean_seconds'] = status['total_seconds'] / status['runs'] if status['runs'] else 0
+            status.update(interval=self.intervals[name], skipped=skipped[name], running=name in running,
+                          next_run_at=next_run.get(name))
+            stats[name] = status
+        return stats
+
+    def _run_scheduled(self, name):
+        try:
+            self.run(name, scheduled=True)
+        finally:
+            with self._state_lock:
+                self._running.discard(name)
+
+    def run_forever(self, tick=1.0):
+        """Start each job when it is due until stop() is called. Jobs run side by side."""
+        now = time.time()
+        with self._state_lock:
+            self._next_run = {name: now for name, interval in self.intervals.items() if interval > 0}
+        with ThreadPoolExecutor(max_workers=max(1, len(self._next_run)), thread_name_prefix='job') as pool:
+            while not self._stop.is_set():
+                now = time.time()
+                with self._state_lock:
+                    due = [name for name, at in self._next_run.items() if at <= now and name not in self._running]
+                    for name in due:
+                        # Scheduled from the start time, so a slow run doesn't push the next one back
+                        self._next_run[name] = now + self.intervals[name]
+                        self._running.add(name)
+                for name in due:
+                    pool.submit(self._run_scheduled, name)
+                self._stop.wait(tick)
+
+    def start(self):
+        """Run the schedule on a daemon thread."""
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run_forever, name='scheduler', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+scheduler = Scheduler()
@@ -1,58 +1,207 @@
-import requests
-from bs4 import BeautifulSoup
-from datetime import datetime, timedelta
-
-# URL of the news page
-url = "https://newsroom.calgary.ca/?h=1&t=Police"
-
-month_mapping = {'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4, 'May': 5, 'Jun': 6,
-                 'Jul': 7, 'Aug': 8, 'Sep': 9, 'Oct': 10, 'Nov': 11, 'Dec': 12}
-
-# Send a GET request to the URL
-response = requests.get(url)
-soup = BeautifulSoup(response.content, 'html.parser')
-
-# Extract all news articles
-articles = soup.find_all('a', class_='td_headlines')  # Check the correct class in the HTML
-
-# Filter articles from the last month
-one_month_ago = datetime.now() - timedelta(days=30)
-for article in articles:
+"""Incremental scraper for the Calgary newsroom's police news.
 
-    months = soup.find_all('div', class_="pp_date_month")
+scrape_news() reads the listing page, skips articles already stored in
+NewsArticle or older than RECENT_DAYS, fetches the rest concurrently over a
+pooled session (retrying with backoff) and stores them. Every page is fetched
+with the ETag / Last-Modified from its previous fetch, kept in ScrapedPage,
+so an unchanged listing costs a 304 and nothing else.
 
-    for month in months:
-        if month.getText() in month_mapping:
-            release_month = month_mapping[month.getText()]
+Call it inside an app context, or run:
 
-            if ((datetime.now().month - 2) % 12 or 12 ) <= release_month <= datetime.now().month:
-
-                article_url = article['href']
-                response = requests.get(article_url)
-                news_soup = BeautifulSoup(response.content, 'html.parser')
-
-                print(article_url)
-
-                article_body = soup.find_all('div', class_="pp-overflow-hidden pp-min-width-5")  # Check the correct class in the HTML
-
-                print(article_body)
+    flask --app app scrape-news
+"""
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from urllib.parse import urljoin
 
+import requests
+from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+from models import db, NewsArticle, ScrapedPage
 
+# URL of the news page
+NEWS_URL = "https://newsroom.calgary.ca/?h=1&t=Police"
 
+# Only articles published within this many days are fetched
+RECENT_DAYS = 60
 
+# Concurrent article fetches, which is also the connection pool size
+MAX_WORKERS = 8
 
-    title = article.text.strip()
-    date_text = article.find_next('meta', {'name': 'date'})  # Find the date text (check HTML for correct tag)
+REQUEST_TIMEOUT = 15
+USER_AGENT = 'SpaceApps-Hackathon-news/1.0'
 
-    print(date_text)
+month_mapping = {'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4, 'May': 5, 'Jun': 6,
+                 'Jul': 7, 'Aug': 8, 'Sep': 9, 'Oct': 10, 'Nov': 11, 'Dec': 12}
 
-    article_date = datetime.strptime(date_text, '%B %d, %Y')  # Modify format as per the date on site
 
-    # Print article details if it was published in the last month
-    if article_date >= one_month_ago:
-        link = article.find('a')['href']
-        print(f"Title: {title}")
-        print(f"Date: {article_date.strftime('%Y-%m-%d')}")
-        print(f"Link: {link}")
-        print("------")
+def make_session(workers=MAX_WORKERS, retries=3, backoff=0.5):
+    """A requests session with a connection pool per host and retries with exponential backoff."""
+    retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=('GET',), respect_retry_after_header=True)
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=workers, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers['User-Agent'] = USER_AGENT
+    return session
+
+
+def _listing_date(item, today):
+    """The date shown next to a headline, inferring the year when only day and month are given."""
+    month = item.find('div', class_='pp_date_month')
+    if month is None or month.get_text(strip=True)[:3] not in month_mapping:
+        return None
+    month = month_mapping[month.get_text(strip=True)[:3]]
+    day = item.find('div', class_='pp_date_day')
+    year = item.find('div', class_='pp_date_year')
+    day = int(day.get_text(strip=True)) if day is not None and day.get_text(strip=True).isdigit() else 1
+    if year is not None and year.get_text(strip=True).isdigit():
+        year = int(year.get_text(strip=True))
+    else:
+        year = today.year if month <= today.month else today.year - 1
+    try:
+        return date(year, month, day)
+    except ValueError:
+        return None
+
+
+def parse_listing(html, base_url, today=None):
+    """Return [(url, title, listed date or None)] for each headline on the listing page."""
+    today = today or date.today()
+    soup = BeautifulSoup(html, 'html.parser')
+    entries, seen = [], set()
+    for headline in soup.find_all('a', class_='td_headlines'):
+        url = urljoin(base_url, headline.get('href', ''))
+        if not headline.get('href') or url in seen:
+            continue
+        seen.add(url)
+        # The date sits in the same list item as the headline
+        item = headline.parent
+        while item is not None and item.find('div', class_='pp_date_month') is None:
+            item = item.parent
+        entries.append((url, headline.get_text(strip=True), _listing_date(item, today) if item else None))
+    return entries
+
+
+def _parse_date(text):
+    """The date of a meta tag's content: ISO 8601 (with or without a time) or "May 1, 2024"."""
+    text = text.strip()
+    match = re.match(r'\d{4}-\d{2}-\d{2}', text)
+    if match:
+        return date.fromisoformat(match.group())
+    for pattern in ('%B %d, %Y', '%b %d, %Y'):
+        try:
+            return datetime.strptime(text, pattern).date()
+        except ValueError:
+            continue
+    return None
+
+
+def parse_article(html):
+    """Return (body text, published date or None) from an article page."""
+    soup = BeautifulSoup(html, 'html.parser')
+    blocks = soup.find_all('div', class_="pp-overflow-hidden pp-min-width-5")
+    body = '\n\n'.join(block.get_text('\n', strip=True) for block in blocks)
+    meta = soup.find('meta', {'name': 'date'})
+    return body, _parse_date(meta.get('content', '')) if meta is not None else None
+
+
+def conditional_get(session, url, validators=None):
+    """GET url, sending the stored (etag, last_modified) validators if any."""
+    headers = {}
+    if validators is not None:
+        if validators[0]:
+            headers['If-None-Match'] = validators[0]
+        if validators[1]:
+            headers['If-Modified-Since'] = validators[1]
+    return session.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+
+
+def _validators(page):
+    return (page.etag, page.last_modified) if page is not None else None
+
+
+def _remember_validators(page, response):
+    page.etag = response.headers.get('ETag')
+    page.last_modified = response.headers.get('Last-Modified')
+    page.fetched_at = datetime.utcnow()
+    db.session.add(page)
+
+
+def _fetch_article(session, url, validators):
+    """Fetch and parse one article in a worker thread: (url, response, parsed or None, error)."""
+    try:
+        response = conditional_get(session, url, validators)
+        if response.status_code != 200:
+            return url, response, None, None
+        return url, response, parse_article(response.content), None
+    except requests.RequestException as e:
+        return url, None, None, e
+
+
+def scrape_news(listing_url=NEWS_URL, workers=MAX_WORKERS, recent_days=RECENT_DAYS, session=None):
+    """Store the newsroom's recent articles that aren't stored yet and return a report dict."""
+    start = time.perf_counter()
+    session = session or make_session(workers)
+    report = {'listed': 0, 'recent': 0, 'new': 0, 'fetched': 0, 'not_modified': 0, 'failed': 0}
+
+    listing_page = db.session.get(ScrapedPage, listing_url)
+    response = conditional_get(session, listing_url, _validators(listing_page))
+    if response.status_code == 304:
+        report['listing'] = 'not modified'
+        report['seconds'] = time.perf_counter() - start
+        return report
+    response.raise_for_status()
+    report['listing'] = 'fetched'
+
+    cutoff = date.today() - timedelta(days=recent_days)
+    entries = parse_listing(response.content, listing_url)
+    recent = [entry for entry in entries if entry[2] is None or entry[2] >= cutoff]
+    urls = [url for url, _, _ in recent]
+    known = {url for (url,) in db.session.query(NewsArticle.url).filter(NewsArticle.url.in_(urls))} if urls else set()
+    new = [entry for entry in recent if entry[0] not in known]
+    pages = {page.url: page for page in ScrapedPage.query.filter(ScrapedPage.url.in_([url for url, _, _ in new]))} if new else {}
+    report.update(listed=len(entries), recent=len(recent), new=len(new))
+
+    # Fetch in worker threads; all database writes stay on this thread
+    titles = {url: (title, listed) for url, title, listed in new}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(lambda entry: _fetch_article(session, entry[0], _validators(pages.get(entry[0]))), new)
+        for url, article_response, parsed, error in results:
+            if error is not None or article_response.status_code not in (200, 304):
+                print(f"Failed to fetch {url}: {error or article_response.status_code}")
+                report['failed'] += 1
+                continue
+            if article_response.status_code == 304:
+                report['not_modified'] += 1
+                continue
+            title, listed = titles[url]
+            body, published = parsed
+            db.session.add(NewsArticle(url=url, title=title, published=published or listed, body=body))
+            _remember_validators(pages.get(url) or ScrapedPage(url=url), article_response)
+            report['fetched'] += 1
+
+    # Only remember the listing once its articles are stored, so a failed run is retried in full
+    if not report['failed']:
+        _remember_validators(listing_page or ScrapedPage(url=listing_url), response)
+    db.session.commit()
+    report['seconds'] = time.perf_counter() - start
+    return report
+
+
+def print_report(report):
+    print(f"Listing {report['listing']}: {report['listed']} articles, {report['recent']} recent, "
+          f"{report['new']} new; fetched {report['fetched']}, not modified {report['not_modified']}, "
+          f"failed {report['failed']} in {report['seconds']:.2f}s")
+
+
+if __name__ == '__main__':
+    from app import create_app
+
+    with create_app().app_context():
+        print_report(scrape_news())
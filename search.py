@@ -0,0 +1,124 @@
+"""Full-text search over blog titles and content.
+
+On SQLite the blog table is mirrored into an FTS5 external-content table,
+``blog_fts``, kept up to date by triggers, so every insert, edit and
+delete (ORM or raw SQL) is indexed incrementally. Results are ranked with
+bm25, title matches weighing more than content matches. Other databases
+fall back to an unranked ILIKE scan.
+"""
+from html import escape
+
+from sqlalchemy import text
+
+from models import db, Blog, User
+
+# Relative bm25 weights of the indexed columns (title, content)
+TITLE_WEIGHT = 10.0
+CONTENT_WEIGHT = 1.0
+
+# Tokens wrapped around matches by FTS5; replaced with <mark> after escaping
+_MATCH_START, _MATCH_END = '\x02', '\x03'
+
+_SCHEMA = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS blog_fts USING fts5(
+        title, content, content='blog', content_rowid='id', tokenize='porter unicode61'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS blog_fts_insert AFTER INSERT ON blog BEGIN
+        INSERT INTO blog_fts(rowid, title, content) VALUES (new.id, new.title, new.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS blog_fts_delete AFTER DELETE ON blog BEGIN
+        INSERT INTO blog_fts(blog_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+    END""",
+    # Only title/content edits touch the index, not vote or reply counters
+    """CREATE TRIGGER IF NOT EXISTS blog_fts_update AFTER UPDATE OF title, content ON blog BEGIN
+        INSERT INTO blog_fts(blog_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+        INSERT INTO blog_fts(rowid, title, content) VALUES (new.id, new.title, new.content);
+    END""",
+]
+
+_SEARCH = text(f"""
+    SELECT blog.id, blog.title, blog.user_id, "user".display_name,
+           highlight(blog_fts, 0, char(2), char(3)) AS title_highlight,
+           snippet(blog_fts, 1, char(2), char(3), '…', 24) AS snippet
+    FROM blog_fts
+    JOIN blog ON blog.id = blog_fts.rowid
+    JOIN "user" ON "user".id = blog.user_id
+    WHERE blog_fts MATCH :query
+    ORDER BY bm25(blog_fts, {TITLE_WEIGHT}, {CONTENT_WEIGHT}), blog.id
+    LIMIT :limit OFFSET :offset
+""")
+
+
+def is_supported():
+    """Whether the current database gets the FTS5 index."""
+    return db.engine.dialect.name == 'sqlite'
+
+
+def create_search_index():
+    """Create the FTS table and triggers if missing, indexing existing blogs."""
+    if not is_supported():
+        return
+    exists = db.session.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'blog_fts'")).first()
+    for statement in _SCHEMA:
+        db.session.execute(text(statement))
+    if not exists:
+        rebuild_search_index()
+    db.session.commit()
+
+
+def rebuild_search_index():
+    """Re-read every blog into the FTS index."""
+    db.session.execute(text("INSERT INTO blog_fts(blog_fts) VALUES ('rebuild')"))
+    db.session.commit()
+
+
+def to_match_query(terms):
+    """Turn free text into an FTS5 query that ANDs every word.
+
+    Each word is quoted so user input can't use (or break on) FTS5 syntax,
+    and the last word matches as a prefix to support search-as-you-type.
+    """
+    words = [word.replace('"', '""') for word in terms.split()]
+    if not words:
+        return None
+    quoted = [f'"{word}"' for word in words]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def _highlight_html(value):
+    return escape(value).replace(_MATCH_START, '<mark>').replace(_MATCH_END, '</mark>')
+
+
+def search_blogs(terms, limit, offset=0):
+    """Return up to limit ranked results for terms, skipping offset results.
+
+    Each result carries HTML-escaped title_html and snippet_html fields with
+    matches wrapped in <mark>.
+    """
+    if not is_supported():
+        return _search_blogs_like(terms, limit, offset)
+
+    query = to_match_query(terms)
+    if query is None:
+        return []
+    rows = db.session.execute(_SEARCH, {'query': query, 'limit': limit, 'offset': offset})
+    return [
+        {'id': row.id, 'title': row.title, 'user_id': row.user_id, 'username': row.display_name,
+         'title_html': _highlight_html(row.title_highlight), 'snippet_html': _highlight_html(row.snippet)}
+        for row in rows
+    ]
+
+
+def _search_blogs_like(terms, limit, offset):
+    """Unranked fallback for databases without FTS5."""
+    query = db.session.query(Blog, User).join(User, Blog.user_id == User.id)
+    for word in terms.split():
+        pattern = f'%{word}%'
+        query = query.filter(Blog.title.ilike(pattern) | Blog.content.ilike(pattern))
+    rows = query.order_by(Blog.id.desc()).limit(limit).offset(offset).all()
+    return [
+        {'id': blog.id, 'title': blog.title, 'user_id': blog.user_id, 'username': user.display_name,
+         'title_html': escape(blog.title), 'snippet_html': escape(blog.content[:200])}
+        for blog, user in rows
+    ]
@@ -0,0 +1,220 @@
+"""Spatial queries over the map layers ("what falls inside this shape?").
+
+Each layer is held in a FeatureIndex: its shapely geometries (prepared, so
+repeated intersects tests against them are fast), its properties and an
+STRtree. A query first takes the tree's bounding-box candidates and then
+runs the exact intersects test against the prepared geometries of only
+those candidates.
+
+The species and vegetation layers share the indexes built for tiles.py;
+the drought impact points are reprojected from EPSG:3857 on load. Layers
+come from layer_cache, so after the first run they load from the binary
+cache instead of the GeoJSON.
+"""
+import os
+import threading
+
+import numpy as np
+import shapely
+from shapely.geometry import shape
+
+import layer_cache
+import map as map_builder
+from geojson_stream import project_properties
+
+DROUGHT_IMPACT_FILE_PATH = map_builder.DROUGHT_IMPACT_FILE_PATH
+DROUGHT_FIELDS = ['OBJECTID', 'IMPACT']
+
+# Largest number of features returned per layer by one query
+MAX_RESULTS_PER_LAYER = 500
+
+EARTH_RADIUS = 6378137.0  # metres, as used by EPSG:3857
+
+
+def web_mercator_to_lonlat(coords):
+    """Convert an (n, 2) array of EPSG:3857 metres to EPSG:4326 degrees."""
+    coords = np.asarray(coords, dtype=float)
+    lon = np.degrees(coords[:, 0] / EARTH_RADIUS)
+    lat = np.degrees(np.arctan(np.sinh(coords[:, 1] / EARTH_RADIUS)))
+    return np.column_stack([lon, lat])
+
+
+def is_web_mercator(data):
+    """Whether a GeoJSON FeatureCollection declares EPSG:3857 coordinates."""
+    name = ((data.get('crs') or {}).get('properties') or {}).get('name', '')
+    return name.endswith('3857') or name.endswith('900913')
+
+
+class FeatureIndex:
+    """A layer's geometries, properties and an STRtree over them, from a layer_cache.LayerData."""
+
+    def __init__(self, data):
+        self.geometries, self.properties, self.ids = data
+        self.tree = shapely.STRtree(self.geometries)
+        shapely.prepare(self.geometries)
+
+    def intersecting(self, geometry):
+        """Indices of the features that intersect geometry, in index order."""
+        candidates = self.tree.query(geometry)
+        return np.sort(candidates[shapely.intersects(self.geometries[candidates], geometry)])
+
+
+def _reproject_web_mercator(features, members):
+    """Convert features to lon/lat if the collection's crs (read before them) is EPSG:3857."""
+    for feature in features:
+        if is_web_mercator(members):
+            geometry = shapely.transform(shape(feature['geometry']), web_mercator_to_lonlat)
+            feature['geometry'] = shapely.geometry.mapping(geometry)
+        yield feature
+
+
+def stream_drought_features():
+    """Stream the drought impact points in lon/lat, trimmed to DROUGHT_FIELDS (None if missing)."""
+    members = {}
+    features = map_builder.stream_local_geojson(DROUGHT_IMPACT_FILE_PATH, members)
+    if features is None:
+        return None
+    return project_properties(_reproject_web_mercator(features, members), DROUGHT_FIELDS)
+
+
+def _load_drought_impact(rebuild=False):
+    data = layer_cache.load_layer('drought_impact', DROUGHT_IMPACT_FILE_PATH, stream_drought_features, DROUGHT_FIELDS)
+    index = FeatureIndex(data) if data is not None else None
+    if rebuild:
+        import hexbins  # hexbins builds on this index, so import it lazily
+        hexbins.rebuild(index)
+    return index
+
+
+def _tile_index(layer):
+    def load(rebuild=False):
+        import tiles  # tiles builds on FeatureIndex, so import it lazily
+        return tiles.rebuild(layer) if rebuild else tiles.get_index(layer)
+    return load
+
+
+# Layers whose index is tiles.py's, which reloads it itself
+TILED_LAYERS = ('priority_species', 'vegetation_zones')
+
+# Layers that /api/query can search, and how to get their index (rebuild=True skips tiles.py's copy)
+QUERY_LAYERS = {
+    'priority_species': _tile_index('priority_species'),
+    'vegetation_zones': _tile_index('vegetation_zones'),
+    'drought_impact': _load_drought_impact,
+}
+
+# The file each layer is loaded from, watched by refresh()
+LAYER_SOURCES = {
+    'priority_species': map_builder.PRIORITY_SPECIES_FILE_PATH,
+    'vegetation_zones': map_builder.VEGETATION_ZONES_FILE_PATH,
+    'drought_impact': DROUGHT_IMPACT_FILE_PATH,
+}
+
+_indexes = {}
+_source_stats = {}  # layer -> source file (size, mtime) when its index was loaded
+_indexes_lock = threading.Lock()
+_build_locks = {layer: threading.Lock() for layer in QUERY_LAYERS}  # one (re)load of a layer at a time
+
+
+def _source_stat(layer):
+    try:
+        stat = os.stat(LAYER_SOURCES[layer])
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def get_index(layer, wait=False):
+    """Return the FeatureIndex for layer (None if there is no data).
+
+    It is loaded on first use and again once the source file changes, so a
+    refresh() run by the scheduler in another process reaches every worker.
+    While one query reloads it, the others keep getting the old index,
+    unless wait is set.
+    """
+    if layer in TILED_LAYERS:
+        return QUERY_LAYERS[layer]()  # tiles.py keeps it fresh
+    stat = _source_stat(layer)
+    index = _indexes.get(layer)
+    if layer in _indexes and _source_stats.get(layer) == stat:
+        return index
+    # Only the first load waits for another query's build
+    if not _build_locks[layer].acquire(blocking=wait or layer not in _indexes):
+        return index
+    try:
+        if layer not in _indexes or _source_stats.get(layer) != stat:
+            index = QUERY_LAYERS[layer]()
+            with _indexes_lock:
+                _indexes[layer], _source_stats[layer] = index, stat
+        return _indexes[layer]
+    finally:
+        _build_locks[layer].release()
+
+
+def refresh():
+    """Rebuild the layers whose source file changed since they were loaded, or that aren't loaded yet.
+
+    Each new index (and its layer_cache file) is built while queries keep
+    using the old one, then swapped in. Returns the names of the rebuilt layers.
+    """
+    rebuilt = []
+    for layer in QUERY_LAYERS:
+        with _build_locks[layer]:
+            stat = _source_stat(layer)
+            if layer in _indexes and _source_stats.get(layer) == stat:
+                continue
+            index = QUERY_LAYERS[layer](rebuild=True)
+            with _indexes_lock:
+                _indexes[layer], _source_stats[layer] = index, stat
+        rebuilt.append(layer)
+    return rebuilt
+
+
+def reset():
+    """Forget loaded indexes, e.g. after the source files change."""
+    with _indexes_lock:
+        _indexes.clear()
+        _source_stats.clear()
+
+
+def parse_geometry(data):
+    """Read a GeoJSON geometry, Feature or FeatureCollection into one valid shapely geometry.
+
+    Raises ValueError if data is not usable GeoJSON.
+    """
+    if not isinstance(data, dict):
+        raise ValueError("Expected a GeoJSON object")
+    if data.get('type') == 'FeatureCollection':
+        geometries = [parse_geometry(feature) for feature in data.get('features') or []]
+        if not geometries:
+            raise ValueError("FeatureCollection has no features")
+        return shapely.union_all(geometries)
+    if data.get('type') == 'Feature':
+        data = data.get('geometry')
+    try:
+        geometry = shape(data)
+    except Exception as e:
+        raise ValueError(f"Invalid GeoJSON geometry: {e}")
+    if geometry.is_empty:
+        raise ValueError("Geometry is empty")
+    # Shapes drawn by hand can self-intersect
+    return geometry if geometry.is_valid else shapely.make_valid(geometry)
+
+
+def query(geometry, layers=None, limit=MAX_RESULTS_PER_LAYER):
+    """Return the features of each layer intersecting geometry.
+
+    The result maps layer name to {'count', 'truncated', 'features'}, where
+    features holds at most limit {'id', 'properties'} entries.
+    """
+    shapely.prepare(geometry)
+    results = {}
+    for layer in layers or QUERY_LAYERS:
+        index = get_index(layer)
+        hits = index.intersecting(geometry) if index is not None else []
+        results[layer] = {
+            'count': len(hits),
+            'truncated': len(hits) > limit,
+            'features': [{'id': index.ids[i], 'properties': index.properties[i]} for i in hits[:limit]],
+        }
+    return results
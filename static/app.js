@@ -26,7 +26,7 @@ function buildNavbar() {
     // Build the navbar with buttons for Map, Introduction, Blog, and Users using TailwindCSS
     navbar.innerHTML = `
         <div class="logo">
-            <a href="/"><img src="/static/hack.png" alt="Logo" class="h-10"></a>
+            <a href="/"><img src="/static/hack.png?w=160" alt="Logo" class="h-10"></a>
         </div>
         <div class="flex space-x-4">
             <button class="bg-blue-900 text-white py-2 px-4 rounded hover:bg-cyan-500 hover:bg-opacity-20 transition duration-300" onclick="window.location.href='/map'">Map</button>
@@ -57,7 +57,7 @@ function buildNavbar() {
 
 // Function to check if the user is logged in and return a promise
 function checkIfUserLoggedIn() {
-    return fetch('/check_login')
+    return fetch('/current_user')
         .then(response => {
             if (!response.ok) {
                 throw new Error('Network response was not ok');
@@ -2,7 +2,7 @@ document.addEventListener("DOMContentLoaded", function () {
     // Build the navbar when the page loads
     buildNavbar();
 
-    // Build the blog page content
+    // Set up the blog page the server rendered
     buildBlogPage();
 
     // Check if the user is logged in and set up the Create Blog button accordingly
@@ -24,7 +24,7 @@ function buildNavbar() {
 
     navbar.innerHTML = `
         <div class="logo">
-            <a href="/"><img src="/static/hack.png" alt="Logo" class="h-10"></a>
+            <a href="/"><img src="/static/hack.png?w=160" alt="Logo" class="h-10"></a>
         </div>
         <div class="flex space-x-4">
             <button class="bg-blue-900 text-white py-2 px-4 rounded hover:bg-cyan-500 hover:bg-opacity-20 transition duration-300" onclick="window.location.href='/map'">Map</button>
@@ -36,7 +36,7 @@ function buildNavbar() {
             <button class="user-button bg-blue-900 text-white py-2 px-4 rounded hover:bg-cyan-500 hover:bg-opacity-20 transition duration-300">Profile</button>
         </div>
     `;
-    app.appendChild(navbar);
+    app.prepend(navbar);
 
     // Attach event listener for the Profile button
     document.querySelector('.user-button').addEventListener('click', function(e) {
@@ -55,7 +55,7 @@ function buildNavbar() {
 
 // Function to check if the user is logged in and return a promise
 function checkIfUserLoggedIn() {
-    return fetch('/check_login')
+    return fetch('/current_user')
         .then(response => {
             if (!response.ok) {
                 throw new Error('Network response was not ok');
@@ -135,7 +135,9 @@ function createBlog() {
     .then(response => response.json())
     .then(data => {
         if (data.success) {
-            loadBlogs();  // Reload blogs after creating a new one
+            if (!liveFeed) {
+                loadBlogs();  // Reload blogs after creating a new one; the live feed adds it otherwise
+            }
             document.getElementById('blog-title').value = '';  // Clear input
             document.getElementById('blog-content').value = '';  // Clear input
         } else {
@@ -145,85 +147,338 @@ function createBlog() {
     .catch(err => console.error('Error creating blog:', err));
 }
 
+// Cursor for the next page of blogs (null when there are no more)
+let nextBlogCursor = null;
+
+// Load the first page of blogs, replacing whatever is currently shown
 function loadBlogs() {
-    fetch('/get_blogs')
+    document.querySelector('.blog-container').innerHTML = ''; // Clear existing content
+    queuedFeedEvents = queuedFeedEvents || [];
+    fetchBlogPage(null);
+}
+
+// Load the page after the last blog currently shown
+function loadMoreBlogs() {
+    if (nextBlogCursor !== null) {
+        fetchBlogPage(nextBlogCursor);
+    }
+}
+
+function fetchBlogPage(cursor) {
+    const url = cursor === null ? '/get_blogs' : `/get_blogs?cursor=${cursor}`;
+    fetch(url)
         .then(response => response.json())
         .then(data => {
             const blogContainer = document.querySelector('.blog-container');
-            
-            blogContainer.innerHTML = ''; // Clear existing content
-            data.blogs.forEach(blog => {
-                const blogPost = document.createElement('div');
-                blogPost.className = 'border p-10 mb-4 bg-white rounded-lg shadow-md';
-                blogPost.innerHTML = `
-                    <p><strong>${blog.username}</strong></p>
-                    <input class="font-bold text-xl mb-2 border p-2 w-full blog-title-${blog.id}" value="${blog.title}" readonly>
-                    <textarea class="text-lg border p-2 w-full blog-content-${blog.id} expandable-textarea" readonly data-expanded="false" style="height: 100px;">${blog.content}</textarea>
-                    <button class="bg-gray-500 text-white p-2 rounded mt-2 read-more-btn" data-blog-id="${blog.id}">Read More</button>
-                    <button class="bg-gray-500 text-white p-2 rounded mt-2 shrink-btn" data-blog-id="${blog.id}" style="display: none;">Shrink</button>
-                    <div class="mt-4">
-                        ${data.current_user_id === blog.user_id ? `
-                            <button class="bg-blue-500 text-white p-2 rounded mr-2" style="margin-top: 10px;" onclick="editBlog(${blog.id})">Edit</button>
-                            <button class="bg-red-500 text-white p-2 rounded" style="margin-top: 10px;" onclick="deleteBlog(${blog.id})">Delete</button>
-                        ` : ''}
-                    </div>
-                `;
-                blogContainer.appendChild(blogPost);
-
-                // Add event listeners to toggle height on button click
-                const readMoreBtn = blogPost.querySelector(`.read-more-btn[data-blog-id="${blog.id}"]`);
-                const shrinkBtn = blogPost.querySelector(`.shrink-btn[data-blog-id="${blog.id}"]`);
-                const textarea = blogPost.querySelector(`.blog-content-${blog.id}`);
-
-                readMoreBtn.addEventListener('click', function() {
-                    textarea.style.height = 'auto'; // Expanded height
-                    textarea.style.height = textarea.scrollHeight + 'px'; // Adjust height based on content
-                    textarea.dataset.expanded = 'true';
-                    readMoreBtn.style.display = 'none';
-                    shrinkBtn.style.display = 'inline-block';
-                });
-
-                shrinkBtn.addEventListener('click', function() {
-                    textarea.style.height = '100px'; // Collapsed height
-                    textarea.dataset.expanded = 'false';
-                    readMoreBtn.style.display = 'inline-block';
-                    shrinkBtn.style.display = 'none';
-                });
-            });
+            currentUserId = data.current_user_id;
+            data.blogs.forEach(blog => blogContainer.appendChild(buildBlogPost(blog)));
+
+            nextBlogCursor = data.next_cursor;
+            document.getElementById('load-more-btn').style.display = nextBlogCursor === null ? 'none' : 'inline-block';
+            if (cursor === null) {
+                applyQueuedFeedEvents();
+            }
         })
-        .catch(err => console.error('Error loading blogs:', err));
+        .catch(err => {
+            console.error('Error loading blogs:', err);
+            if (cursor === null) {
+                applyQueuedFeedEvents();
+            }
+        });
 }
 
+// Build the element for one blog post
+function buildBlogPost(blog) {
+    const blogPost = document.createElement('div');
+    blogPost.className = `border p-10 mb-4 bg-white rounded-lg shadow-md blog-post-${blog.id}`;
+    blogPost.innerHTML = `
+        <p><strong>${blog.username}</strong></p>
+        <input class="font-bold text-xl mb-2 border p-2 w-full blog-title-${blog.id}" value="${blog.title}" readonly>
+        <textarea class="text-lg border p-2 w-full blog-content-${blog.id} expandable-textarea" readonly data-expanded="false" style="height: 100px;">${blog.content}</textarea>
+        <button class="bg-gray-500 text-white p-2 rounded mt-2 read-more-btn" data-blog-id="${blog.id}">Read More</button>
+        <button class="bg-gray-500 text-white p-2 rounded mt-2 shrink-btn" data-blog-id="${blog.id}" style="display: none;">Shrink</button>
+        <div class="mt-4 votes-${blog.id}" data-vote="${blog.user_vote}">
+            <button class="p-2 rounded mr-2 like-btn" onclick="voteBlog(${blog.id}, 'like')">Like (<span class="like-count">${blog.likes}</span>)</button>
+            <button class="p-2 rounded dislike-btn" onclick="voteBlog(${blog.id}, 'dislike')">Dislike (<span class="dislike-count">${blog.dislikes}</span>)</button>
+        </div>
+        <div class="mt-4">
+            ${currentUserId === blog.user_id ? `
+                <button class="bg-blue-500 text-white p-2 rounded mr-2" style="margin-top: 10px;" onclick="editBlog(${blog.id})">Edit</button>
+                <button class="bg-red-500 text-white p-2 rounded" style="margin-top: 10px;" onclick="deleteBlog(${blog.id})">Delete</button>
+            ` : ''}
+        </div>
+        <div class="mt-4">
+            <p class="font-bold">Replies (<span class="reply-count-${blog.id}">${blog.reply_count}</span>)</p>
+            <div class="reply-list-${blog.id}"></div>
+            <button class="text-blue-500 mt-2 all-replies-btn-${blog.id}" style="display: none;" onclick="loadAllReplies(${blog.id})">Show all replies</button>
+            <input class="border p-2 w-full mt-2 reply-input-${blog.id}" placeholder="Write a reply">
+            <button class="bg-blue-500 text-white p-2 rounded mt-2" onclick="addReply(${blog.id})">Reply</button>
+        </div>
+    `;
 
+    updateVoteButtons(blog.id, blog.user_vote, blogPost);
 
+    // Show the reply preview that came with the page
+    const replyList = blogPost.querySelector(`.reply-list-${blog.id}`);
+    blog.replies.forEach(reply => replyList.appendChild(buildReply(reply)));
+    if (blog.reply_count > blog.replies.length) {
+        blogPost.querySelector(`.all-replies-btn-${blog.id}`).style.display = 'inline-block';
+    }
 
-// Function to dynamically build the blog page content
-function buildBlogPage() {
-    const app = document.getElementById('app');
-    if (!app) return; // Ensure the app element exists
+    setupReadMore(blogPost, blog.id);
+    return blogPost;
+}
 
-    const mainContent = document.createElement('div');
-    mainContent.className = 'p-6';
+// Add event listeners to toggle a post's height on button click
+function setupReadMore(blogPost, blogId) {
+    const readMoreBtn = blogPost.querySelector(`.read-more-btn[data-blog-id="${blogId}"]`);
+    const shrinkBtn = blogPost.querySelector(`.shrink-btn[data-blog-id="${blogId}"]`);
+    const textarea = blogPost.querySelector(`.blog-content-${blogId}`);
+
+    readMoreBtn.addEventListener('click', function() {
+        textarea.style.height = 'auto'; // Expanded height
+        textarea.style.height = textarea.scrollHeight + 'px'; // Adjust height based on content
+        textarea.dataset.expanded = 'true';
+        readMoreBtn.style.display = 'none';
+        shrinkBtn.style.display = 'inline-block';
+    });
 
-    mainContent.innerHTML = `
-        <h1 class="text-4xl font-bold mb-4">Community Blogs</h1>
-        <div class="create-blog mb-6">
-            <input id="blog-title" class="border p-2 w-full mb-2" placeholder="Blog Title"><br>
-            <textarea id="blog-content" class="border p-2 w-full" placeholder="Write a new blog"></textarea><br>
-            <button class="bg-green-500 text-white p-2 mt-2 rounded" id="create-blog-btn">Create Blog</button>
-        </div>
-        <div class="blog-container">
-            <!-- Blogs will be loaded dynamically here -->
-        </div>
-    `;
+    shrinkBtn.addEventListener('click', function() {
+        textarea.style.height = '100px'; // Collapsed height
+        textarea.dataset.expanded = 'false';
+        readMoreBtn.style.display = 'inline-block';
+        shrinkBtn.style.display = 'none';
+    });
+}
+
+// Live updates from the event hub (feed_events.py). While the stream is open,
+// changes arrive as small created/edited/deleted/votes events instead of
+// reloading the feed after every change.
+let liveFeed = false;
+let currentUserId = null;
+// Events that arrive while the first page is loading, applied once it is shown
+let queuedFeedEvents = null;
+
+// The page comes with the first page of the feed as of event lastEventId, so
+// the stream resumes from there and replays whatever changed since.
+function connectLiveFeed(lastEventId) {
+    let url = document.body.dataset.eventsUrl;
+    if (!url || !window.EventSource) {
+        return;  // no live updates: the feed is reloaded after our own changes
+    }
+    if (url.startsWith(':')) {
+        url = `${location.protocol}//${location.hostname}${url}`;  // same host, another port
+    }
+    // Reconnects send the id of the last event received instead
+    const source = new EventSource(`${url}${url.includes('?') ? '&' : '?'}last_event_id=${lastEventId}`);
+
+    source.onopen = function () {
+        liveFeed = true;
+    };
+    source.onerror = function () {
+        liveFeed = false;
+    };
+    // Away for longer than the hub remembers: start over from the current feed
+    source.addEventListener('reset', () => loadBlogs());
+    ['created', 'edited', 'deleted', 'votes'].forEach(kind => {
+        source.addEventListener(kind, event => applyFeedEvent(kind, JSON.parse(event.data)));
+    });
+}
+
+function applyFeedEvent(kind, data) {
+    if (queuedFeedEvents !== null) {
+        queuedFeedEvents.push([kind, data]);
+        return;
+    }
+    const post = document.querySelector(`.blog-post-${data.id}`);
+    if (kind === 'created') {
+        if (!post) {
+            document.querySelector('.blog-container').prepend(buildBlogPost(data));
+        }
+    } else if (!post) {
+        return;  // not on a page this browser has loaded
+    } else if (kind === 'edited') {
+        const titleInput = post.querySelector(`.blog-title-${data.id}`);
+        const contentTextarea = post.querySelector(`.blog-content-${data.id}`);
+        if (titleInput.readOnly) {  // leave it alone while it's being edited here
+            titleInput.value = data.title;
+            contentTextarea.value = data.content;
+        }
+    } else if (kind === 'deleted') {
+        post.remove();
+    } else if (kind === 'votes') {
+        post.querySelector('.like-count').textContent = data.likes;
+        post.querySelector('.dislike-count').textContent = data.dislikes;
+    }
+}
+
+function applyQueuedFeedEvents() {
+    const queued = queuedFeedEvents || [];
+    queuedFeedEvents = null;
+    queued.forEach(([kind, data]) => applyFeedEvent(kind, data));
+}
+
+
+
+
+// Function to highlight the button matching the user's vote (1 like, -1 dislike, 0 none)
+function updateVoteButtons(blogId, vote, root = document) {
+    const votes = root.querySelector(`.votes-${blogId}`);
+    votes.dataset.vote = vote;
+    votes.querySelector('.like-btn').className = `p-2 rounded mr-2 like-btn ${vote === 1 ? 'bg-green-500 text-white' : 'bg-gray-200'}`;
+    votes.querySelector('.dislike-btn').className = `p-2 rounded dislike-btn ${vote === -1 ? 'bg-red-500 text-white' : 'bg-gray-200'}`;
+}
+
+// Function to like or dislike a blog post; pressing the active button again clears the vote
+function voteBlog(blogId, kind) {
+    const votes = document.querySelector(`.votes-${blogId}`);
+    const current = parseInt(votes.dataset.vote);
+    const vote = (kind === 'like' && current === 1) || (kind === 'dislike' && current === -1) ? 'none' : kind;
+
+    checkIfUserLoggedIn().then(isLoggedIn => {
+        if (!isLoggedIn) {
+            openLoginModal();
+            return;
+        }
+        fetch(`/vote_blog/${blogId}`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ vote: vote })
+        })
+        .then(response => response.json())
+        .then(data => {
+            if (data.success) {
+                votes.querySelector('.like-count').textContent = data.likes;
+                votes.querySelector('.dislike-count').textContent = data.dislikes;
+                updateVoteButtons(blogId, data.vote);
+            } else {
+                alert(data.message || 'Error voting.');
+            }
+        })
+        .catch(err => console.error('Error voting:', err));
+    });
+}
+
+// Function to build the element for a single reply
+function buildReply(reply) {
+    const replyElement = document.createElement('p');
+    replyElement.className = 'border-t pt-2 mt-2';
+    const author = document.createElement('strong');
+    author.textContent = reply.username + ': ';
+    replyElement.appendChild(author);
+    replyElement.appendChild(document.createTextNode(reply.content));
+    return replyElement;
+}
+
+// Function to replace the reply preview with the full thread, one page at a time
+function loadAllReplies(blogId, cursor = null) {
+    const url = cursor === null ? `/get_replies/${blogId}` : `/get_replies/${blogId}?cursor=${cursor}`;
+    fetch(url)
+        .then(response => response.json())
+        .then(data => {
+            const replyList = document.querySelector(`.reply-list-${blogId}`);
+            if (cursor === null) {
+                replyList.innerHTML = '';
+                document.querySelector(`.all-replies-btn-${blogId}`).style.display = 'none';
+            }
+            data.replies.forEach(reply => replyList.appendChild(buildReply(reply)));
+            if (data.next_cursor !== null) {
+                loadAllReplies(blogId, data.next_cursor);
+            }
+        })
+        .catch(err => console.error('Error loading replies:', err));
+}
+
+// Function to reply to a blog post
+function addReply(blogId) {
+    const replyInput = document.querySelector(`.reply-input-${blogId}`);
+
+    checkIfUserLoggedIn().then(isLoggedIn => {
+        if (!isLoggedIn) {
+            openLoginModal();
+            return;
+        }
+        fetch(`/add_reply/${blogId}`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ content: replyInput.value })
+        })
+        .then(response => response.json())
+        .then(data => {
+            if (data.success) {
+                // Append the new reply in place instead of reloading the feed
+                document.querySelector(`.reply-list-${blogId}`).appendChild(buildReply(data.reply));
+                const replyCount = document.querySelector(`.reply-count-${blogId}`);
+                replyCount.textContent = parseInt(replyCount.textContent) + 1;
+                replyInput.value = '';
+            } else {
+                alert('Error adding reply.');
+            }
+        })
+        .catch(err => console.error('Error adding reply:', err));
+    });
+}
 
-    app.appendChild(mainContent);
+// Function to set up the blog page content, rendered by the server with the first page of blogs
+function buildBlogPage() {
+    const blogContainer = document.querySelector('.blog-container');
+    if (!blogContainer) return; // Ensure the page was rendered
+
+    currentUserId = parseInt(document.body.dataset.currentUserId) || null;
+    const cursor = document.getElementById('load-more-btn').dataset.nextCursor;
+    nextBlogCursor = cursor ? parseInt(cursor) : null;
+    Array.from(blogContainer.children).forEach(post => setupReadMore(post, post.dataset.blogId));
 
     // Set up the Create Blog button functionality
     setupCreateBlog();
 
-    // Call the function to load blogs
-    loadBlogs();
+    // Subscribe to live updates from the moment the page was rendered
+    connectLiveFeed(parseInt(document.body.dataset.lastEventId) || 0);
+}
+
+// Offset of the next page of search results (null when there are no more)
+let nextSearchOffset = null;
+
+// Function to search blogs server-side and show ranked results with highlighted matches
+function searchBlogs(offset = 0) {
+    const terms = document.getElementById('search-input').value.trim();
+    if (!terms) {
+        clearSearch();
+        return;
+    }
+
+    fetch(`/search_blogs?q=${encodeURIComponent(terms)}&offset=${offset}`)
+        .then(response => response.json())
+        .then(data => {
+            const resultsContainer = document.querySelector('.search-results');
+            if (offset === 0) {
+                resultsContainer.innerHTML = data.results.length ? '' : '<p>No blogs found.</p>';
+            }
+            // title_html and snippet_html are escaped server-side, only <mark> is markup
+            data.results.forEach(result => {
+                const resultElement = document.createElement('div');
+                resultElement.className = 'border p-4 mb-2 bg-white rounded-lg shadow-md';
+                resultElement.innerHTML = `
+                    <p class="font-bold text-xl">${result.title_html}</p>
+                    <p class="text-sm text-gray-500 search-result-author"></p>
+                    <p>${result.snippet_html}</p>
+                `;
+                resultElement.querySelector('.search-result-author').textContent = result.username;
+                resultsContainer.appendChild(resultElement);
+            });
+
+            nextSearchOffset = data.next_offset;
+            document.getElementById('more-results-btn').style.display = nextSearchOffset === null ? 'none' : 'inline-block';
+        })
+        .catch(err => console.error('Error searching blogs:', err));
+}
+
+// Function to clear the search box and results
+function clearSearch() {
+    document.getElementById('search-input').value = '';
+    document.querySelector('.search-results').innerHTML = '';
+    document.getElementById('more-results-btn').style.display = 'none';
+    nextSearchOffset = null;
 }
 
 // Function to set up the Create Blog button event listener
@@ -263,7 +518,9 @@ function editBlog(blogId) {
                 titleInput.classList.remove('border-blue-500');
                 contentTextarea.classList.remove('border-blue-500');
                 editButton.textContent = 'Edit';  // Change button back to "Edit"
-                loadBlogs();  // Reload the blogs to reflect updates
+                if (!liveFeed) {
+                    loadBlogs();  // Reload the blogs to reflect updates
+                }
             } else {
                 alert('Error saving blog.');
             }
@@ -275,7 +532,15 @@ function editBlog(blogId) {
 // Function to delete a blog post
 function deleteBlog(blogId) {
     fetch(`/delete_blog/${blogId}`, { method: 'POST' })
-        .then(() => loadBlogs())  // Reload blogs after deletion
+        .then(() => {
+            // The live feed's event may have removed it already
+            const post = document.querySelector(`.blog-post-${blogId}`);
+            if (!liveFeed) {
+                loadBlogs();  // Reload blogs after deletion
+            } else if (post) {
+                post.remove();
+            }
+        })
         .catch(err => console.error('Error deleting blog:', err));
 }
 
@@ -0,0 +1,297 @@
+"""Caching proxy for the map's WMS overlays and basemap tiles.
+
+The browser asks /proxy/<layer> (WMS GetMap) or /proxy/<layer>/<z>/<x>/<y>
+(XYZ basemaps) instead of the upstream servers. Responses are kept in a
+size-bounded LRU store on disk:
+
+* an entry younger than its layer's TTL is served without contacting upstream;
+* an older one is revalidated with If-None-Match / If-Modified-Since, and a
+  304 just renews it; if upstream fails, the stale copy is served instead;
+* concurrent misses for the same tile share a single upstream request.
+
+Only the layers in UPSTREAMS can be reached and only GetMap parameters are
+forwarded, so this is not an open proxy.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future
+from urllib.parse import urlencode
+
+import requests
+
+import map as map_builder
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+# How a layer is fetched: 'wms' forwards GetMap parameters to url, 'xyz' fills in its {z}/{x}/{y} template.
+# ttl is how long a cached tile is served before it is revalidated.
+Upstream = namedtuple('Upstream', ['kind', 'url', 'ttl'])
+
+UPSTREAMS = {
+    'critical_habitat': Upstream('wms', map_builder.CRITICAL_HABITAT_WMS_URL, 7 * DAY),
+    'protected_areas': Upstream('wms', map_builder.PROTECTED_AREAS_WMS_URL, 7 * DAY),
+    'wildfire_hotspots': Upstream('wms', map_builder.WILDFIRE_HOTSPOTS_WMS_URL, HOUR),
+    'openstreetmap': Upstream('xyz', map_builder.OPENSTREETMAP_TILES_URL, DAY),
+    'arcgis_imagery': Upstream('xyz', map_builder.ARCGIS_IMAGERY_TILES_URL, 7 * DAY),
+}
+
+# GetMap parameters passed upstream; anything else in the query string is dropped
+WMS_PARAMS = ('service', 'request', 'version', 'layers', 'styles', 'format', 'transparent',
+              'width', 'height', 'srs', 'crs', 'bbox')
+MAX_TILE_PIXELS = 1024
+
+USER_AGENT = 'SpaceApps-Hackathon-map/1.0 (tile proxy)'
+
+# A tile ready to send: cache_status is HIT, MISS, REVALIDATED or STALE
+ProxiedTile = namedtuple('ProxiedTile', ['body', 'content_type', 'max_age', 'cache_status'])
+
+
+class UpstreamError(Exception):
+    """The upstream server could not provide a tile and there was no cached copy."""
+
+
+class TileCache:
+    """Tiles on disk, evicted least recently used first once max_bytes is exceeded.
+
+    Each entry is one file: a JSON metadata line followed by the body.
+    Recency is the files' modification times, so it survives restarts and
+    is shared by every worker process using the directory. The byte limit
+    is shared too: a process adds up what it writes and, once that could
+    take the directory past max_bytes or passes a sixteenth of it, scans
+    the directory for the real total and evicts down to LOW_WATER of it.
+    In between, each process can take the directory up to max_bytes / 16
+    over the limit.
+    """
+
+    LOW_WATER = 0.9
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._size = 0  # bytes on disk at the last scan, plus those written since
+        self._written = 0  # bytes written since the last scan
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            self._evict()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.tile')
+
+    def _scan(self):
+        """(mtime, key, size) of every tile in the directory, least recently used first."""
+        files = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.name.endswith('.tile'):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue  # evicted by another process meanwhile
+                    files.append((stat.st_mtime_ns, entry.name[:-5], stat.st_size))
+        return sorted(files)
+
+    def _evict(self):
+        files = self._scan()
+        size = sum(file_size for _, _, file_size in files)
+        if size > self.max_bytes:
+            for _, key, file_size in files[:-1]:
+                if size <= self.max_bytes * self.LOW_WATER:
+                    break
+                try:
+                    os.remove(self._path(key))
+                except OSError:
+                    pass  # another process got there first
+                size -= file_size
+        self._size, self._written = size, 0
+
+    def get(self, key):
+        """Return (metadata, body) for key, or None."""
+        try:
+            with open(self._path(key), 'rb') as f:
+                meta = json.loads(f.readline())
+                body = f.read()
+            os.utime(self._path(key))
+        except (OSError, ValueError):
+            return None
+        return meta, body
+
+    def put(self, key, meta, body):
+        data = json.dumps(meta).encode() + b'\n' + body
+        tmp_path = f'{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, self._path(key))
+        with self._lock:
+            self._size += len(data)
+            self._written += len(data)
+            if self._size > self.max_bytes or self._written > self.max_bytes // 16:
+                self._evict()
+
+    def usage(self):
+        """(tiles, bytes) in the directory now, whichever process wrote them."""
+        files = self._scan()
+        return len(files), sum(file_size for _, _, file_size in files)
+
+
+class TileProxy:
+    """Fetch tiles for the layers in upstreams through a TileCache."""
+
+    def __init__(self, app=None, upstreams=None):
+        self.upstreams = dict(UPSTREAMS if upstreams is None else upstreams)
+        self.cache = None
+        self.timeout = 10
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = USER_AGENT
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.reset_stats()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('TILE_PROXY_DIR', os.environ.get('TILE_PROXY_DIR', 'cache/tiles'))
+        app.config.setdefault('TILE_PROXY_MAX_BYTES', int(os.environ.get('TILE_PROXY_MAX_BYTES', 512 * 2 ** 20)))
+        app.config.setdefault('TILE_PROXY_TIMEOUT', 10)
+        self.cache = TileCache(app.config['TILE_PROXY_DIR'], app.config['TILE_PROXY_MAX_BYTES'])
+        self.timeout = app.config['TILE_PROXY_TIMEOUT']
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self._stats = {'hits': 0, 'misses': 0, 'revalidated': 0, 'stale': 0, 'coalesced': 0,
+                           'upstream_requests': 0, 'upstream_errors': 0, 'upstream_seconds': 0.0}
+
+    def _count(self, **amounts):
+        with self._stats_lock:
+            for name, amount in amounts.items():
+                self._stats[name] += amount
+
+    def stats(self):
+        """Counters plus the hit ratio and the upstream time that hits saved."""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        served = stats['hits'] + stats['misses'] + stats['revalidated'] + stats['stale'] + stats['coalesced']
+        mean_upstream = stats['upstream_seconds'] / stats['upstream_requests'] if stats['upstream_requests'] else 0
+        stats['hit_ratio'] = (stats['hits'] + stats['coalesced']) / served if served else 0
+        stats['upstream_seconds_saved'] = (stats['hits'] + stats['coalesced']) * mean_upstream
+        stats['cached_tiles'], stats['cached_bytes'] = self.cache.usage() if self.cache is not None else (0, 0)
+        return stats
+
+    def resolve(self, layer, params=None, tile=None):
+        """Return (cache key, upstream URL) for a WMS request (params) or an XYZ tile ((z, x, y)).
+
+        The key names the tile, not the server, so moving a layer's upstream
+        keeps its cache. Raises ValueError for unknown layers or unacceptable
+        requests.
+        """
+        upstream = self.upstreams.get(layer)
+        if upstream is None:
+            raise ValueError(f"Unknown layer {layer!r}")
+        if upstream.kind == 'xyz':
+            if tile is None:
+                raise ValueError(f"{layer} is a tiled layer: use /proxy/{layer}/<z>/<x>/<y>")
+            z, x, y = tile
+            if not (0 <= z <= 22 and 0 <= x < 2 ** z and 0 <= y < 2 ** z):
+                raise ValueError("Tile out of range")
+            return f'{layer}/{z}/{x}/{y}', upstream.url.format(s='abc'[(x + y) % 3], z=z, x=x, y=y)
+
+        if tile is not None:
+            raise ValueError(f"{layer} is a WMS layer: use /proxy/{layer}?<GetMap parameters>")
+        params = {key.lower(): value for key, value in (params or {}).items()}
+        if params.get('request', '').lower() != 'getmap':
+            raise ValueError("Only WMS GetMap requests are proxied")
+        for size in ('width', 'height'):
+            if not params.get(size, '').isdigit() or not 0 < int(params[size]) <= MAX_TILE_PIXELS:
+                raise ValueError(f"{size} must be between 1 and {MAX_TILE_PIXELS}")
+        # Sorted so the same tile always maps to the same cache key
+        query = urlencode(sorted((key, params[key]) for key in WMS_PARAMS if key in params))
+        return f'{layer}?{query}', f'{upstream.url}?{query}'
+
+    def get(self, layer, params=None, tile=None):
+        """Return a ProxiedTile for the request, from the cache or upstream.
+
+        Raises ValueError for bad requests and UpstreamError when the tile
+        is neither cached nor fetchable.
+        """
+        name, url = self.resolve(layer, params, tile)
+        ttl = self.upstreams[layer].ttl
+        key = hashlib.sha256(name.encode()).hexdigest()
+
+        cached = self.cache.get(key)
+        if cached is not None and time.time() - cached[0]['fetched_at'] < ttl:
+            self._count(hits=1)
+            return self._tile(cached, ttl, 'HIT')
+
+        # One upstream request per key: later arrivals wait for the first one's result
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+        if not leader:
+            self._count(coalesced=1)
+            return future.result()  # with the leader's status: a STALE copy is still stale
+
+        try:
+            result = self._refresh(key, url, ttl, cached)
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._inflight_lock:
+                del self._inflight[key]
+
+    def _refresh(self, key, url, ttl, cached):
+        headers = {}
+        if cached is not None:
+            if cached[0].get('etag'):
+                headers['If-None-Match'] = cached[0]['etag']
+            if cached[0].get('last_modified'):
+                headers['If-Modified-Since'] = cached[0]['last_modified']
+
+        start = time.perf_counter()
+        try:
+            response = self.session.get(url, headers=headers, timeout=self.timeout)
+        except requests.RequestException as e:
+            response, error = None, e
+        self._count(upstream_requests=1, upstream_seconds=time.perf_counter() - start)
+
+        if response is not None and response.status_code == 304 and cached is not None:
+            meta = dict(cached[0], fetched_at=time.time())
+            self.cache.put(key, meta, cached[1])
+            self._count(revalidated=1)
+            return self._tile((meta, cached[1]), ttl, 'REVALIDATED')
+
+        content_type = response.headers.get('Content-Type', '') if response is not None else ''
+        # WMS servers report errors as 200 responses with an XML body, which must not be cached
+        if response is not None and response.status_code == 200 and content_type.startswith('image/'):
+            meta = {'fetched_at': time.time(), 'content_type': content_type,
+                    'etag': response.headers.get('ETag'), 'last_modified': response.headers.get('Last-Modified')}
+            self.cache.put(key, meta, response.content)
+            self._count(misses=1)
+            return self._tile((meta, response.content), ttl, 'MISS')
+
+        self._count(upstream_errors=1)
+        if cached is not None:
+            self._count(stale=1)
+            return self._tile(cached, 60, 'STALE')  # retry upstream soon
+        if response is None:
+            raise UpstreamError(f"Upstream request failed: {error}")
+        raise UpstreamError(f"Upstream returned {response.status_code} {content_type}".strip())
+
+    @staticmethod
+    def _tile(entry, ttl, cache_status):
+        meta, body = entry
+        max_age = ttl if cache_status == 'STALE' else max(0, int(ttl - (time.time() - meta['fetched_at'])))
+        return ProxiedTile(body, meta['content_type'], max_age, cache_status)
+
+
+tile_proxy = TileProxy()
@@ -0,0 +1,220 @@
+"""GeoJSON vector tiles for the map's polygon overlays.
+
+Each layer is loaded per process into a TileIndex: shapely geometries
+in lat/lon with an STRtree over them, plus each feature's Leaflet style and
+tooltip serialized up front. A tile request queries the tree with the tile's
+bounds, clips the hits to the tile, simplifies them to about a pixel at that
+zoom and rounds coordinates to match, so a tile only carries what is visible.
+
+When pyramid.py has precomputed levels for a layer, tiles are cut from the
+matching level instead; those are already simplified with shared borders
+kept shared, so only clipping and rounding happen per request.
+
+Polygons are sent as two pieces: the clipped fill (no stroke) and the
+clipped outline (no fill). Stroking the clipped fill would draw lines along
+every tile edge.
+
+Tiles are plain GeoJSON; there is no MVT encoder among the dependencies.
+"""
+import functools
+import json
+import math
+import os
+import threading
+from collections import namedtuple
+from html import escape
+
+import numpy as np
+import shapely
+
+import layer_cache
+import map as map_builder
+import pyramid
+from spatial import FeatureIndex
+
+# Extra margin around each tile, as a fraction of its width, so neighbouring
+# fills overlap slightly instead of leaving hairline gaps
+TILE_BUFFER = 1 / 64
+MAX_ZOOM = 22
+
+# How to load, style and label the features of each tiled layer. load() returns a
+# GeoDataFrame with a fill_color column; style holds the rest of the Leaflet style.
+TileSource = namedtuple('TileSource', ['path', 'load', 'style', 'tooltip_fields', 'tooltip_aliases'])
+
+
+TILE_SOURCES = {
+    'priority_species': TileSource(map_builder.PRIORITY_SPECIES_FILE_PATH, map_builder.load_species_frame,
+                                   map_builder.SPECIES_STYLE,
+                                   map_builder.SPECIES_TOOLTIP_FIELDS, map_builder.SPECIES_TOOLTIP_ALIASES),
+    'vegetation_zones': TileSource(map_builder.VEGETATION_ZONES_FILE_PATH, map_builder.load_vegetation_frame,
+                                   map_builder.VEGETATION_STYLE,
+                                   map_builder.VEGETATION_TOOLTIP_FIELDS, map_builder.VEGETATION_TOOLTIP_ALIASES),
+}
+
+
+def _compact_json(value):
+    return json.dumps(value, separators=(',', ':'))
+
+
+def tile_bounds(z, x, y):
+    """Return (west, south, east, north) in degrees for a Web Mercator tile."""
+    n = 2 ** z
+
+    def latitude(row):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+
+    return x / n * 360 - 180, latitude(y + 1), (x + 1) / n * 360 - 180, latitude(y)
+
+
+def is_valid_tile(z, x, y):
+    return 0 <= z <= MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def tooltip_html(properties, fields, aliases):
+    """Render a feature's tooltip table the way folium.GeoJsonTooltip lays it out."""
+    rows = ''.join(
+        f'<tr><th>{escape(str(alias))}</th><td>{escape(str(properties.get(field)))}</td></tr>'
+        for field, alias in zip(fields, aliases)
+    )
+    return f'<table>{rows}</table>'
+
+
+class TileIndex(FeatureIndex):
+    """One layer's features with an STRtree for tile queries."""
+
+    def __init__(self, frame, style, tooltip_fields, tooltip_aliases, levels=None):
+        super().__init__(layer_cache.frame_layer(frame.drop(columns='fill_color')))
+        self.outlines = shapely.boundary(self.geometries)
+
+        # Precomputed simplifications by zoom, each aligned with features
+        self.levels = {
+            zoom: (geometries, shapely.boundary(geometries), shapely.STRtree(geometries))
+            for zoom, geometries in (levels or {}).items()
+        }
+
+        self.fill_properties = []
+        self.outline_properties = []
+        outline = _compact_json({'style': {'color': style['color'], 'weight': style['weight'], 'fill': False}})
+        for properties, fill_color in zip(self.properties, frame['fill_color']):
+            self.fill_properties.append(_compact_json({
+                'style': {'fillColor': fill_color, 'fillOpacity': style['fillOpacity'], 'stroke': False},
+                'tooltip': tooltip_html(properties, tooltip_fields, tooltip_aliases),
+            }))
+            self.outline_properties.append(outline)
+
+    def render(self, z, x, y):
+        """Return the tile as a GeoJSON FeatureCollection string."""
+        west, south, east, north = tile_bounds(z, x, y)
+        pad = (east - west) * TILE_BUFFER
+        bounds = (west - pad, south - pad, east + pad, north + pad)
+
+        # One pixel of the tile in degrees of latitude (the smaller of the two)
+        tolerance = (north - south) / 256
+        decimals = max(0, math.ceil(-math.log10(tolerance / 4)))
+
+        level = pyramid.level_for(z, self.levels)
+        if level is not None:
+            geometries, outlines, tree = self.levels[level]
+            tolerance = 0  # already simplified, without opening gaps between neighbours
+        else:
+            geometries, outlines, tree = self.geometries, self.outlines, self.tree
+        hits = tree.query(shapely.box(*bounds))
+
+        def prepare(source):
+            clipped = shapely.clip_by_rect(source[hits], *bounds)
+            if tolerance:
+                clipped = shapely.simplify(clipped, tolerance, preserve_topology=True)
+            return shapely.transform(clipped, lambda coords: np.round(coords, decimals))
+
+        fills = prepare(geometries)
+        outlines = prepare(outlines)
+
+        pieces = []
+        for index, fill, outline in zip(hits, fills, outlines):
+            if not shapely.is_empty(fill):
+                pieces.append(f'{{"type":"Feature","geometry":{shapely.to_geojson(fill)},'
+                              f'"properties":{self.fill_properties[index]}}}')
+            if not shapely.is_empty(outline):
+                pieces.append(f'{{"type":"Feature","geometry":{shapely.to_geojson(outline)},'
+                              f'"properties":{self.outline_properties[index]}}}')
+        return '{"type":"FeatureCollection","features":[' + ','.join(pieces) + ']}'
+
+
+_indexes = {}  # layer -> (source file (size, mtime) it was loaded from, TileIndex)
+_indexes_lock = threading.Lock()
+_build_locks = {layer: threading.Lock() for layer in TILE_SOURCES}  # one (re)load of a layer at a time
+
+
+def _source_stat(layer):
+    try:
+        stat = os.stat(TILE_SOURCES[layer].path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _build_index(layer):
+    source = TILE_SOURCES[layer]
+    frame = source.load()
+    if frame is None:
+        return None
+    return TileIndex(frame, source.style, source.tooltip_fields, source.tooltip_aliases,
+                     pyramid.load_pyramid(layer, source.path))
+
+
+def get_index(layer):
+    """Return the TileIndex for layer (None if there is no data).
+
+    It is loaded on first use and again once the source file changes, which
+    is how a rebuild done in another process (the scheduler) gets here.
+    While one request reloads it, the others keep getting the old index.
+    """
+    stat = _source_stat(layer)
+    loaded = _indexes.get(layer)
+    if loaded is not None and loaded[0] == stat:
+        return loaded[1]
+    # Only the first load waits for another request's build
+    if not _build_locks[layer].acquire(blocking=loaded is None):
+        return loaded[1]
+    try:
+        loaded = _indexes.get(layer)
+        if loaded is None or loaded[0] != stat:
+            loaded = stat, _build_index(layer)
+            with _indexes_lock:
+                _indexes[layer] = loaded
+        return loaded[1]
+    finally:
+        _build_locks[layer].release()
+
+
+def rebuild(layer):
+    """Load layer again from its files and swap the new index in.
+
+    Tiles keep being served from the old index while the new one is built.
+    """
+    with _build_locks[layer]:
+        stat = _source_stat(layer)
+        index = _build_index(layer)
+        with _indexes_lock:
+            _indexes[layer] = stat, index
+    _render_tile.cache_clear()
+    return index
+
+
+def render_tile(layer, z, x, y):
+    """Return a tile of layer as GeoJSON bytes, or None if the layer has no data."""
+    index = get_index(layer)
+    return _render_tile(index, z, x, y) if index is not None else None
+
+
+# Keyed by the index itself, so tiles of a replaced index are never served
+@functools.lru_cache(maxsize=4096)
+def _render_tile(index, z, x, y):
+    return index.render(z, x, y).encode()
+
+
+def reset():
+    """Forget loaded layers and rendered tiles, e.g. after the source files change."""
+    with _indexes_lock:
+        _indexes.clear()
+    _render_tile.cache_clear()
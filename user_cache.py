@@ -0,0 +1,91 @@
+"""In-memory cache of the logged-in user's identity for Flask-Login.
+
+Flask-Login calls the user loader on every request that carries a session
+cookie, which used to cost a SELECT on the user table each time. The loader
+now returns a CachedUser (id and display name only) from a per-process
+cache with a TTL and least-recently-used eviction. Routes that change the
+user load the real row and call invalidate(); with several processes, the
+others pick up a new display name within USER_CACHE_TTL seconds.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from flask_login import UserMixin
+
+
+class CachedUser(UserMixin):
+    """The identity fields of a User, safe to share between requests and threads."""
+
+    def __init__(self, id, display_name):
+        self.id = id
+        self.display_name = display_name
+
+
+class UserCache:
+    """Map user ids to CachedUser, loading misses with load(user_id)."""
+
+    def __init__(self, app=None):
+        self.ttl = 60
+        self.max_size = 10000
+        self._entries = OrderedDict()  # user_id -> (CachedUser, expires_at), least recently used first
+        self._lock = threading.Lock()
+        self.reset_stats()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # A TTL of 0 turns the cache off
+        app.config.setdefault('USER_CACHE_TTL', 60)
+        app.config.setdefault('USER_CACHE_SIZE', 10000)
+        self.ttl = app.config['USER_CACHE_TTL']
+        self.max_size = app.config['USER_CACHE_SIZE']
+        self.clear()
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evicted': 0, 'invalidated': 0}
+
+    def get(self, user_id, load):
+        """Return the CachedUser for user_id, or None if there is no such user."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(user_id)
+                self._stats['hits'] += 1
+                return entry[0]
+            self._stats['expired' if entry is not None else 'misses'] += 1
+
+        user = load(user_id)
+        if user is None:
+            return None  # not cached: the id may belong to a user created soon
+        cached = CachedUser(user.id, user.display_name)
+        if self.ttl > 0:
+            with self._lock:
+                self._entries[user_id] = (cached, now + self.ttl)
+                self._entries.move_to_end(user_id)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+                    self._stats['evicted'] += 1
+        return cached
+
+    def invalidate(self, user_id):
+        """Forget user_id, e.g. after its display name or password changed."""
+        with self._lock:
+            if self._entries.pop(user_id, None) is not None:
+                self._stats['invalidated'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, size=len(self._entries), ttl=self.ttl)
+        lookups = stats['hits'] + stats['misses'] + stats['expired']
+        stats['hit_ratio'] = stats['hits'] / lookups if lookups else 0
+        return stats
+
+
+user_cache = UserCache()
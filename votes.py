@@ -0,0 +1,183 @@
+"""Blog voting with coalesced like/dislike counter updates."""
+import atexit
+import threading
+
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Blog, Vote
+import feed
+from feed_events import publish
+
+# Accepted values for the "vote" field of /vote_blog
+VOTE_VALUES = {'like': 1, 'dislike': -1, 'none': 0}
+
+_UPDATE_COUNTERS = text(
+    'UPDATE blog SET likes = COALESCE(likes, 0) + :likes, dislikes = COALESCE(dislikes, 0) + :dislikes '
+    'WHERE id = :id'
+)
+
+
+class VoteBuffer:
+    """Accumulate like/dislike deltas in memory and write them in batches.
+
+    Without this every vote on a hot post takes SQLite's writer lock to bump
+    the same row. Deltas are summed per blog and flushed as one executemany
+    of ``likes = likes + ?`` updates, every ``VOTE_FLUSH_INTERVAL`` seconds or
+    as soon as ``VOTE_FLUSH_SIZE`` votes are pending.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._deltas = {}
+        self._in_flight = {}
+        self._pending_votes = 0
+        self._timer = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        atexit.register(self._flush_at_exit)  # once, whichever apps it is bound to
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('VOTE_FLUSH_INTERVAL', 1.0)
+        app.config.setdefault('VOTE_FLUSH_SIZE', 500)
+        if self.app is not None and self.app is not app:
+            self.flush()  # votes queued for the previous app go to its database
+        self.app = app
+
+    def add(self, blog_id, likes, dislikes):
+        """Queue a counter change for blog_id."""
+        with self._lock:
+            delta = self._deltas.setdefault(blog_id, [0, 0])
+            delta[0] += likes
+            delta[1] += dislikes
+            self._pending_votes += 1
+            full = self._pending_votes >= self.app.config['VOTE_FLUSH_SIZE']
+            if not full:
+                self._arm_timer()
+        if full:
+            self.flush()
+
+    def _arm_timer(self):
+        # Called with _lock held
+        if self._timer is None:
+            self._timer = threading.Timer(self.app.config['VOTE_FLUSH_INTERVAL'], self._flush_on_timer)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def pending(self, blog_id):
+        """Return the (likes, dislikes) not yet written to the database."""
+        with self._lock:
+            likes, dislikes = self._deltas.get(blog_id, (0, 0))
+            flushing_likes, flushing_dislikes = self._in_flight.get(blog_id, (0, 0))
+        return likes + flushing_likes, dislikes + flushing_dislikes
+
+    def flush(self):
+        """Write every queued delta in one transaction. Returns the rows updated."""
+        with self._flush_lock:
+            with self._lock:
+                self._in_flight, self._deltas = self._deltas, {}
+                votes, self._pending_votes = self._pending_votes, 0
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+            rows = [{'id': blog_id, 'likes': likes, 'dislikes': dislikes}
+                    for blog_id, (likes, dislikes) in self._in_flight.items() if likes or dislikes]
+            try:
+                if rows:
+                    with self.app.app_context():
+                        db.session.execute(_UPDATE_COUNTERS, rows)
+                        publish_vote_counts([row['id'] for row in rows])
+                        feed.mark_changed()
+                        db.session.commit()
+            except Exception:
+                # Put the deltas back and retry them after the interval, even if no other vote comes
+                with self._lock:
+                    for blog_id, (likes, dislikes) in self._in_flight.items():
+                        delta = self._deltas.setdefault(blog_id, [0, 0])
+                        delta[0] += likes
+                        delta[1] += dislikes
+                    self._pending_votes += votes
+                    self._arm_timer()
+                raise
+            finally:
+                with self._lock:
+                    self._in_flight = {}
+            return len(rows)
+
+    def _flush_on_timer(self):
+        with self._lock:
+            self._timer = None
+        self.flush()
+
+    def _flush_at_exit(self):
+        if self.app is not None:
+            self.flush()
+
+
+vote_buffer = VoteBuffer()
+
+
+def record_vote(user_id, blog_id, value, coalesce=True, attempts=5):
+    """Set user_id's vote on blog_id to value (1, -1 or 0).
+
+    Setting the vote it already has is a no-op, so retried requests are safe.
+    The vote row is changed with a compare-and-set on the old value; if a
+    concurrent request got there first we re-read and try again. Returns the
+    (likes, dislikes) delta applied, or None if every attempt conflicted.
+    """
+    for _ in range(attempts):
+        old = db.session.query(Vote.value).filter_by(user_id=user_id, blog_id=blog_id).scalar() or 0
+        if old == value:
+            db.session.rollback()
+            return 0, 0
+
+        try:
+            if old == 0:
+                db.session.add(Vote(user_id=user_id, blog_id=blog_id, value=value))
+                db.session.flush()
+                changed = True
+            elif value == 0:
+                changed = Vote.query.filter_by(user_id=user_id, blog_id=blog_id, value=old).delete() == 1
+            else:
+                changed = Vote.query.filter_by(user_id=user_id, blog_id=blog_id, value=old).update({Vote.value: value}) == 1
+        except IntegrityError:
+            changed = False
+        if changed:
+            break
+        db.session.rollback()
+    else:
+        return None
+
+    likes = (value == 1) - (old == 1)
+    dislikes = (value == -1) - (old == -1)
+    # The voter's own feed shows their vote, so their cached pages are stale
+    feed.mark_changed()
+    if coalesce:
+        db.session.commit()
+        vote_buffer.add(blog_id, likes, dislikes)
+    else:
+        Blog.query.filter_by(id=blog_id).update({
+            Blog.likes: db.func.coalesce(Blog.likes, 0) + likes,
+            Blog.dislikes: db.func.coalesce(Blog.dislikes, 0) + dislikes,
+        })
+        publish_vote_counts([blog_id])
+        db.session.commit()
+    return likes, dislikes
+
+
+def publish_vote_counts(blog_ids):
+    """Queue a live feed event with the stored counts of each blog, in the current transaction.
+
+    With coalescing this runs once per blog per flush rather than per vote.
+    """
+    rows = db.session.query(Blog.id, Blog.likes, Blog.dislikes).filter(Blog.id.in_(blog_ids)).all()
+    for blog_id, likes, dislikes in rows:
+        publish('votes', {'id': blog_id, 'likes': likes or 0, 'dislikes': dislikes or 0})
+
+
+def vote_counts(blog):
+    """Return (likes, dislikes) for blog, including deltas not yet flushed."""
+    pending_likes, pending_dislikes = vote_buffer.pending(blog.id)
+    return (blog.likes or 0) + pending_likes, (blog.dislikes or 0) + pending_dislikes